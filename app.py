@@ -1,9 +1,61 @@
 # app.py
-from flask import Flask, request, jsonify, render_template
-from chatbot import Chatbot
+import json
+import logging
+import os
+import threading
+import time
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
+from metrics import record_request, render_metrics
+
+with open('config.json') as f:
+    config = json.loads(f.read())
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-bot = Chatbot()
+
+# the chatbot pulls in openai and sqlalchemy, so it is imported by warmup and not with the app,
+# a new worker can accept connections before it is loaded
+Chatbot = None
+get_session_id = None
+store = None
+_warmup_lock = threading.Lock()
+
+
+def warmup() -> None:
+    """
+    will import the chatbot and open everything the first request needs once per process:
+    the conversation store, the database engine, the openai client, the cached tools and system prompt
+    the order index and the return policy index
+    the warmup option of the startup section in the config file, or the CHATBOT_WARMUP environment variable,
+    runs it when the app is imported, in the background after it is imported or on the first request
+    :return: none
+    """
+    global Chatbot, get_session_id, store
+
+    if Chatbot is not None:
+        return
+    with _warmup_lock:
+        if Chatbot is not None:
+            return
+        start = time.perf_counter()
+
+        import chatbot
+        import conversation_store
+        from order_repository import get_engine, get_order_repository
+        from policy_index import get_policy_index
+
+        store = conversation_store.get_conversation_store()
+        chatbot.get_chatbot_setup()
+        chatbot.Chatbot.get_client()
+        with get_engine().connect():
+            pass
+        get_order_repository()
+        get_policy_index()
+
+        get_session_id = conversation_store.get_session_id
+        Chatbot = chatbot.Chatbot
+        logger.info('warmed up in %.3fs', time.perf_counter() - start)
 
 
 @app.route('/')
@@ -14,12 +66,83 @@ def index():
 @app.route('/chat', methods=['POST'])
 def chat():
     """
-    will get the users prompt send it to the chatbot and send the response to the browser
+    will get the users prompt send it to the chatbot of the users session and send the response to the browser
+    the session id comes from the session cookie or the session_id in the request body and is sent back in both
     :return: the chatbots response
     """
+    start = time.perf_counter()
+    warmup()
+    cookie_name = config['sessions']['cookie_name']
+    session_id = get_session_id(request.cookies.get(cookie_name), request.json.get('session_id'))
+
     user_input = request.json.get('message')
+    bot = Chatbot(store.get(session_id))
     response = bot.run_chat(user_input)
-    return jsonify({"response": response})
+    store.set(session_id, bot.messages)
+    record_request('/chat', session_id, time.perf_counter() - start, bot.stats)
+
+    response = jsonify({"response": response, "session_id": session_id})
+    response.set_cookie(cookie_name, session_id, max_age=config['sessions']['ttl_seconds'],
+                        httponly=True, samesite='Lax')
+    return response
+
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    the streaming version of /chat, it sends the chatbots response as server-sent events while it is generated
+    every event has a delta of text, the last event has done set and the session id,
+    or an error and the session id when the response failed
+    :return: the stream of events
+    """
+    start = time.perf_counter()
+    warmup()
+    cookie_name = config['sessions']['cookie_name']
+    session_id = get_session_id(request.cookies.get(cookie_name), request.json.get('session_id'))
+
+    user_input = request.json.get('message')
+    bot = Chatbot(store.get(session_id))
+
+    def generate():
+        failed = False
+        try:
+            for delta in bot.stream_chat(user_input):
+                yield f'data: {json.dumps({"delta": delta})}\n\n'
+        except Exception:
+            logger.exception('the streamed response of session %s failed', session_id)
+            failed = True
+        finally:
+            # the session is saved when the response failed or the client went away too, so the next turn resumes it,
+            # without the tool calls the turn didn't answer, openai rejects every later turn of a session with them
+            store.set(session_id, Chatbot.drop_unanswered_tool_calls(bot.messages))
+            record_request('/chat/stream', session_id, time.perf_counter() - start,
+                           {**bot.stats, 'time_to_first_token': bot.time_to_first_token, 'failed': failed})
+        if failed:
+            yield f'data: {json.dumps({"error": "the response failed, please try again", "session_id": session_id})}\n\n'
+        else:
+            yield f'data: {json.dumps({"done": True, "session_id": session_id})}\n\n'
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.set_cookie(cookie_name, session_id, max_age=config['sessions']['ttl_seconds'],
+                        httponly=True, samesite='Lax')
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    the latency, token, tool, database and cache metrics of this process in the prometheus text format
+    :return: the metrics
+    """
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+warmup_mode = os.environ.get('CHATBOT_WARMUP', config['startup']['warmup'])
+if warmup_mode == 'import':
+    warmup()
+elif warmup_mode == 'background':
+    threading.Thread(target=warmup, name='warmup', daemon=True).start()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,113 @@
+# asgi_app.py
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from quart import Quart, Response, request, jsonify, render_template
+from metrics import record_request, render_metrics
+
+with open('config.json') as f:
+    config = json.loads(f.read())
+
+logger = logging.getLogger(__name__)
+
+app = Quart(__name__)
+
+# like app.py the chatbot is imported by warmup and not with the app
+AsyncChatbot = None
+get_session_id = None
+store = None
+_warmup_lock = threading.Lock()
+
+
+def warmup() -> None:
+    """
+    the same as warmup in app.py for the async chatbot
+    :return: none
+    """
+    global AsyncChatbot, get_session_id, store
+
+    if AsyncChatbot is not None:
+        return
+    with _warmup_lock:
+        if AsyncChatbot is not None:
+            return
+        start = time.perf_counter()
+
+        import async_chatbot
+        import chatbot
+        import conversation_store
+        from order_repository import get_engine, get_order_repository
+        from policy_index import get_policy_index
+
+        store = conversation_store.get_conversation_store()
+        chatbot.get_chatbot_setup()
+        async_chatbot.AsyncChatbot.get_client()
+        with get_engine().connect():
+            pass
+        get_order_repository()
+        get_policy_index()
+
+        get_session_id = conversation_store.get_session_id
+        AsyncChatbot = async_chatbot.AsyncChatbot
+        logger.info('warmed up in %.3fs', time.perf_counter() - start)
+
+
+@app.before_serving
+async def start_warmup() -> None:
+    """
+    the server starts serving once the warmup is done when the warmup option is import,
+    with background it serves right away and the warmup runs on a thread
+    :return: none
+    """
+    warmup_mode = os.environ.get('CHATBOT_WARMUP', config['startup']['warmup'])
+    if warmup_mode == 'import':
+        await asyncio.to_thread(warmup)
+    elif warmup_mode == 'background':
+        threading.Thread(target=warmup, name='warmup', daemon=True).start()
+
+
+@app.route('/')
+async def index():
+    return await render_template('index.html')
+
+
+@app.route('/chat', methods=['POST'])
+async def chat():
+    """
+    the async version of the /chat route in app.py,
+    while a conversation waits on openai the same process can serve other conversations
+    :return: the chatbots response
+    """
+    start = time.perf_counter()
+    if AsyncChatbot is None:
+        await asyncio.to_thread(warmup)
+    body = await request.get_json()
+    cookie_name = config['sessions']['cookie_name']
+    session_id = get_session_id(request.cookies.get(cookie_name), body.get('session_id'))
+
+    # the store can be a sqlite database, so it is read and written off the event loop
+    bot = AsyncChatbot(await asyncio.to_thread(store.get, session_id))
+    response = await bot.run_chat(body.get('message'))
+    await asyncio.to_thread(store.set, session_id, bot.messages)
+    record_request('/chat', session_id, time.perf_counter() - start, bot.stats)
+
+    response = jsonify({"response": response, "session_id": session_id})
+    response.set_cookie(cookie_name, session_id, max_age=config['sessions']['ttl_seconds'],
+                        httponly=True, samesite='Lax')
+    return response
+
+
+@app.route('/metrics')
+async def metrics():
+    """
+    the same metrics as the /metrics route in app.py
+    :return: the metrics
+    """
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+if __name__ == '__main__':
+    app.run(debug=True)
@@ -0,0 +1,136 @@
+import asyncio
+import itertools
+import json
+import os
+import time
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
+import openai
+from chatbot import Chatbot, get_client_retries
+from intent_router import router_stats
+from completion_cache import get_completion_cache
+from completion_scheduler import get_scheduler
+from tool_executor import get_tool_executor
+from openai.types.chat import ChatCompletionMessageToolCall, ChatCompletion
+
+with open('config.json') as f:
+    config = json.loads(f.read())
+
+
+class AsyncChatbot(Chatbot):
+    # one client for the whole process so every conversation shares its connection pool
+    shared_client: Optional[openai.AsyncClient] = None
+
+    @classmethod
+    def get_client(cls) -> openai.AsyncClient:
+        """
+        will create the async openai client the first time it is needed and reuse it after
+        :return: the async openai client
+        """
+        if cls.shared_client is None:
+            cls.shared_client = openai.AsyncClient(
+                api_key=config['openai']['OPENAI_API_KEY'],
+                base_url=config['openai']['base_url'],
+                timeout=config['openai']['timeout'],
+                max_retries=get_client_retries())
+        return cls.shared_client
+
+    async def create_completion(self, use_tools: bool) -> ChatCompletion:
+        """
+        the async version of Chatbot.create_completion, the sqlite tier of the cache is read off the event loop
+        :param use_tools: if the chatbot can answer with tool calls
+        :return: the completion
+        """
+        args = self.get_completion_args(use_tools)
+        cache = get_completion_cache()
+
+        start = time.perf_counter()
+        response = await asyncio.to_thread(cache.get, args) if cache else None
+        source = 'cache' if response is not None else 'openai'
+        if response is None:
+            response, source = await self.request_completion_async(args)
+        self.record_completion(use_tools, source, time.perf_counter() - start, response.usage)
+
+        if source == 'openai' and cache:
+            await asyncio.to_thread(cache.put, args, response)
+        return response
+
+    async def request_completion_async(self, args: Dict[str, Any]) -> Tuple[ChatCompletion, str]:
+        """
+        the async version of Chatbot.request_completion
+        :param args: the arguments of the chat completion request
+        :return: the completion and its source, openai or coalesced
+        """
+        def create() -> Awaitable[ChatCompletion]:
+            return self.client.chat.completions.create(**args)
+
+        scheduler = get_scheduler()
+        if scheduler is None:
+            return await create(), 'openai'
+        response, coalesced = await scheduler.run_async(args, self.get_priority(), create)
+        return response, 'coalesced' if coalesced else 'openai'
+
+    async def handle_tool_calls(self, tool_calls: List[ChatCompletionMessageToolCall], step: int,
+                                llm_seconds: float) -> Optional[str]:
+        """
+        will run the tool calls of a step concurrently on the tool executor threads,
+        so the database lookups don't block the event loop
+        :param tool_calls: the list of tools to call
+        :param step: the step of the agent loop the tool calls were made in
+        :param llm_seconds: how long the completion of the step took
+        :return: the reply when a return policy verdict is answered without the client, otherwise None
+        """
+        start = time.perf_counter()
+        tool_messages = await get_tool_executor().run_async(self.handle_tool_call, tool_calls)
+        self.messages += tool_messages
+        tool_seconds = time.perf_counter() - start
+        self.record_tool_calls(len(tool_calls), tool_seconds)
+        self.record_step(step, llm_seconds, tool_calls, tool_seconds)
+        return self.get_local_reply(tool_messages)
+
+    async def run_chat(self, prompt: str) -> str:
+        """
+        the async version of Chatbot.run_chat for the asgi app
+        :param prompt: the users question
+        :return: the chatbots response
+        """
+
+        # the router looks the order up in the database, so it runs off the event loop
+        response = await asyncio.to_thread(self.run_router, prompt)
+        if response is not None:
+            return response
+
+        start = time.perf_counter()
+        response = await self.run_llm_chat(prompt)
+        router_stats.record_miss(time.perf_counter() - start)
+        return response
+
+    async def run_llm_chat(self, prompt: str) -> str:
+        """
+        the async version of Chatbot.run_llm_chat, it runs the same agent loop
+        :param prompt: the users question
+        :return: the chatbots response
+        """
+        self.messages.append({'role': 'user', 'content': prompt})
+        deadline = time.perf_counter() + config['agent']['budget_seconds']
+
+        for step in itertools.count():
+            start = time.perf_counter()
+            response_message = (await self.create_completion(self.can_use_tools(step, deadline))).choices[0].message
+            self.messages.append(response_message)
+            if not response_message.tool_calls:
+                self.record_step(step, time.perf_counter() - start)
+                return response_message.content
+
+            reply = await self.handle_tool_calls(response_message.tool_calls, step, time.perf_counter() - start)
+            if reply is not None:
+                self.messages.append(self.get_local_completion(reply).choices[0].message)
+                return reply
+
+
+def _reset_after_fork() -> None:
+    # like the chatbot a forked worker makes its own async client
+    AsyncChatbot.shared_client = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
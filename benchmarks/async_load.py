@@ -0,0 +1,103 @@
+"""
+load test of the async chatbot against a local fake openai server
+every simulated customer asks for the status of one of their orders, which takes a tool call and two completions
+it compares the async chatbot holding every conversation on one event loop
+against the sync chatbot limited to a fixed number of workers, like the flask app
+run it from the project root with: python -m benchmarks.async_load --conversations 200 --latency 0.5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+from sqlalchemy import text
+from chatbot import config as chatbot_config
+from fake_openai_server import start_server_process
+from order_repository import get_engine
+
+
+def get_prompts(conversations: int) -> List[str]:
+    """
+    will build one order status question for every simulated customer
+    :param conversations: the number of customers
+    :return: the prompts
+    """
+    with get_engine().connect() as conn:
+        result = conn.execute(
+            text("SELECT order_id, customer_id FROM orders ORDER BY RANDOM() LIMIT :limit;"),
+            {'limit': conversations}
+        )
+        return [f'what is the status of my order with customer id {customer_id} and order id {order_id}'
+                for order_id, customer_id in result.all()]
+
+
+async def run_async(prompts: List[str]) -> Tuple[float, List[float]]:
+    """
+    will run every conversation concurrently on one event loop
+    :param prompts: the first message of every conversation
+    :return: the wall time and the latency of every conversation in seconds
+    """
+    from async_chatbot import AsyncChatbot
+
+    async def run_conversation(chatbot: AsyncChatbot, prompt: str) -> float:
+        conversation_start = time.perf_counter()
+        await chatbot.run_chat(prompt)
+        return time.perf_counter() - conversation_start
+
+    chatbots = [AsyncChatbot() for _ in prompts]
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*map(run_conversation, chatbots, prompts))
+    return time.perf_counter() - start, latencies
+
+
+def run_sync(prompts: List[str], workers: int) -> Tuple[float, List[float]]:
+    """
+    will run the conversations with the sync chatbot on a fixed number of worker threads
+    :param prompts: the first message of every conversation
+    :param workers: the number of workers
+    :return: the wall time and the latency of every conversation in seconds
+    """
+    from chatbot import Chatbot
+
+    def run_conversation(chatbot: Chatbot, prompt: str) -> float:
+        conversation_start = time.perf_counter()
+        chatbot.run_chat(prompt)
+        return time.perf_counter() - conversation_start
+
+    chatbots = [Chatbot() for _ in prompts]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        latencies = list(pool.map(run_conversation, chatbots, prompts))
+    return time.perf_counter() - start, latencies
+
+
+def report(name: str, wall_time: float, latencies: List[float]) -> None:
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f'{name:<16} {len(latencies) / wall_time:7.1f} conversations/s '
+          f'wall={wall_time:.2f}s p50={quantiles[49]:.2f}s p95={quantiles[94]:.2f}s')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--conversations', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds the fake openai server waits')
+    parser.add_argument('--workers', type=int, default=8, help='workers of the sync baseline')
+    args = parser.parse_args()
+
+    # the intent router would answer these prompts without openai, the load test is of the openai path
+    chatbot_config['router']['enabled'] = False
+
+    server, os.environ['OPENAI_BASE_URL'] = start_server_process(args.latency)
+    prompts = get_prompts(args.conversations)
+
+    try:
+        report('async', *asyncio.run(run_async(prompts)))
+        report(f'sync {args.workers} workers', *run_sync(prompts, args.workers))
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
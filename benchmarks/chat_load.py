@@ -0,0 +1,191 @@
+"""
+load test of the whole /chat pipeline, the flask app, the chatbot and the database,
+with a local fake openai server of configurable latency in place of the model
+every simulated customer is a browser session that runs a scripted conversation about one of the orders
+in dummy_data/clean_data, the customers run concurrently
+it reports the p50/p95/p99 latency of a request, the requests per second, how the time splits between
+the order lookups, the llm and the rest of the framework, the share of lookups the order index answered,
+the memory growth per session and the cache and router stats and writes them as json for regression tracking
+run it from the project root with: python -m benchmarks.chat_load --customers 50 --concurrency 10
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+CONVERSATION = [
+    'I would like to check the status of my order',
+    '{order_id}',
+    '{customer_id}',
+    'Can I return this',
+    'How will I get my refund for this order',
+    'what is the status of my order with my customer id {customer_id} and my order id {order_id}',
+]
+
+
+class StageTimer:
+    def __init__(self) -> None:
+        """
+        adds up the seconds spent in each stage of the pipeline over all requests
+        """
+        self.seconds: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def wrap(self, stage: str, func: Callable) -> Callable:
+        """
+        :param stage: the name of the stage
+        :param func: the function to time
+        :return: the function timed under the stage
+        """
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self.lock:
+                    self.seconds[stage] = self.seconds.get(stage, 0.0) + elapsed
+                    self.calls[stage] = self.calls.get(stage, 0) + 1
+        return timed
+
+
+def get_customers(customers: int, seed: int) -> List[Dict[str, str]]:
+    """
+    will pick the orders of the simulated customers from the clean orders csv
+    :param customers: the number of customers
+    :param seed: the random seed, so every run has the same customers
+    :return: the order_id and customer_id of every customer
+    """
+    with open('dummy_data/clean_data/orders.csv', newline='') as file:
+        orders = [{'order_id': row['order_id'], 'customer_id': row['customer_id']} for row in csv.DictReader(file)]
+    return random.Random(seed).sample(orders, customers)
+
+
+def get_max_rss_kb() -> int:
+    # linux reports the peak resident memory in kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def quantile(latencies: List[float], percent: int) -> float:
+    return statistics.quantiles(latencies, n=100)[percent - 1] if len(latencies) > 1 else latencies[0]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--customers', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=10, help='customers talking at the same time')
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds the fake openai server waits')
+    parser.add_argument('--jitter', type=float, default=0.1, help='seconds of random jitter on the latency')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmarks/results/chat_load.json')
+    args = parser.parse_args()
+
+    from fake_openai_server import start_server_process
+    server, os.environ['OPENAI_BASE_URL'] = start_server_process(args.latency, args.jitter)
+
+    # imported after OPENAI_BASE_URL is set, the stages are timed by wrapping the functions of each layer
+    from app import app
+    from chatbot import Chatbot
+    from completion_cache import get_completion_cache
+    from intent_router import router_stats
+    from metrics import ORDER_INDEX_EVENTS
+    from order_repository import OrderRepository, get_order_repository
+
+    timer = StageTimer()
+    # the db stage times the lookups of the repository the tools use, so the orders the order index answers
+    # are counted with the ones the queries answer, sql is the part of it spent in the queries
+    repository_type = type(get_order_repository())
+    for lookup in ('get_order_status', 'get_order_product_type', 'get_refund_policy', 'get_customer_orders'):
+        setattr(repository_type, lookup, timer.wrap('db', getattr(repository_type, lookup)))
+    OrderRepository.fetch_all = timer.wrap('sql', OrderRepository.fetch_all)
+    Chatbot.create_completion = timer.wrap('llm', Chatbot.create_completion)
+
+    customers = get_customers(args.customers, args.seed)
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def run_customer(customer: Dict[str, str]) -> None:
+        nonlocal errors
+        client = app.test_client()
+        for message in CONVERSATION:
+            start = time.perf_counter()
+            response = client.post('/chat', json={'message': message.format(**customer)})
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                errors += response.status_code != 200
+
+    rss_before = get_max_rss_kb()
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(run_customer, customers))
+    finally:
+        server.terminate()
+    wall_time = time.perf_counter() - start
+    rss_after = get_max_rss_kb()
+
+    request_seconds = sum(latencies)
+    db_seconds = timer.seconds.get('db', 0.0)
+    index_hits, index_misses = ORDER_INDEX_EVENTS.get(event='hit'), ORDER_INDEX_EVENTS.get(event='miss')
+    llm_seconds = timer.seconds.get('llm', 0.0)
+    cache = get_completion_cache()
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'parameters': vars(args),
+        'requests': len(latencies),
+        'errors': errors,
+        'wall_seconds': wall_time,
+        'requests_per_second': len(latencies) / wall_time,
+        'latency_seconds': {
+            'mean': statistics.mean(latencies),
+            'p50': quantile(latencies, 50),
+            'p95': quantile(latencies, 95),
+            'p99': quantile(latencies, 99),
+        },
+        # the db time of tool calls that ran concurrently is counted once per call
+        'stage_seconds_per_request': {
+            'db': db_seconds / len(latencies),
+            'sql': timer.seconds.get('sql', 0.0) / len(latencies),
+            'llm': llm_seconds / len(latencies),
+            'framework': max(0.0, request_seconds - db_seconds - llm_seconds) / len(latencies),
+        },
+        'stage_calls': timer.calls,
+        'order_index': {
+            'hits': index_hits,
+            'misses': index_misses,
+            'hit_rate': index_hits / (index_hits + index_misses) if index_hits + index_misses else None,
+        },
+        'memory_kb_per_session': (rss_after - rss_before) / args.customers,
+        'completion_cache': cache.stats() if cache else None,
+        'intent_router': router_stats.report(),
+    }
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        f.write(json.dumps(results, indent=2))
+
+    latency = results['latency_seconds']
+    stages = results['stage_seconds_per_request']
+    print(f'{results["requests"]} requests ({errors} errors) in {wall_time:.2f}s, '
+          f'{results["requests_per_second"]:.1f} requests/s')
+    print(f'latency p50={latency["p50"]:.3f}s p95={latency["p95"]:.3f}s p99={latency["p99"]:.3f}s')
+    print(f'per request: db={stages["db"] * 1000:.2f}ms (sql={stages["sql"] * 1000:.2f}ms) llm={stages["llm"] * 1000:.1f}ms '
+          f'framework={stages["framework"] * 1000:.2f}ms')
+    print(f'memory growth: {results["memory_kb_per_session"]:.1f}KB per session')
+    print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+benchmark of the cold start of a worker, it reports how long importing app.py takes and the modules that take
+the longest from python -X importtime, and the latency of the first /chat request of a fresh process for every
+warmup option of the startup section in the config file
+every measurement runs in a new python process against the local fake openai server
+--max-import-ms fails the run when the import of app.py is slower, so it can guard against a heavy import coming back
+run it from the project root with: python -m benchmarks.cold_start
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Dict, List
+from fake_openai_server import start_server_process
+
+WARMUP_MODES = ['import', 'background', 'first_request']
+
+# run in the worker process, the idle time is the gap between the worker starting and its first request
+FIRST_REQUEST_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+time.sleep(float(sys.argv[1]))
+client = app.app.test_client()
+request_start = time.perf_counter()
+response = client.post('/chat', json={'message': 'hi'})
+first_request = time.perf_counter()
+response = client.post('/chat', json={'message': 'hi'})
+second_request = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'first_request_ms': (first_request - request_start) * 1000,
+    'second_request_ms': (second_request - first_request) * 1000,
+    'status': response.status_code,
+}))
+'''
+
+
+def get_import_times(top: int) -> Dict:
+    """
+    will import app.py in a new process with python -X importtime
+    :param top: the number of the slowest modules to report
+    :return: the total import time and the slowest modules with their cumulative time in milliseconds
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                             capture_output=True, text=True, check=True)
+    modules = []
+    for line in process.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)', line)
+        if match:
+            # the indent of the name is the depth of the import, app.py and the modules it imports are reported
+            modules.append({'module': match.group(4), 'cumulative_ms': int(match.group(2)) / 1000,
+                            'depth': (len(match.group(3)) - 1) // 2})
+    total = next(module['cumulative_ms'] for module in modules if module['module'] == 'app')
+    slowest = sorted((module for module in modules if module['depth'] <= 1 and module['module'] != 'app'),
+                     key=lambda module: module['cumulative_ms'], reverse=True)[:top]
+    return {'total_ms': total, 'slowest': [{'module': module['module'], 'cumulative_ms': module['cumulative_ms']}
+                                           for module in slowest]}
+
+
+def time_first_request(warmup: str, base_url: str, idle: float) -> Dict:
+    """
+    will time the first requests of a new worker process
+    :param warmup: the warmup option of the worker
+    :param base_url: the url of the fake openai server
+    :param idle: the seconds between the import and the first request
+    :return: the import, first request and second request times in milliseconds
+    """
+    env = dict(os.environ, CHATBOT_WARMUP=warmup, OPENAI_BASE_URL=base_url)
+    env.pop('OPENAI_REPLAY', None)
+    process = subprocess.run([sys.executable, '-c', FIRST_REQUEST_SCRIPT, str(idle)],
+                             capture_output=True, text=True, check=True, env=env)
+    return json.loads(process.stdout.splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=3, help='new processes for every warmup option')
+    parser.add_argument('--idle', type=float, default=1.0, help='seconds between the import and the first request')
+    parser.add_argument('--top', type=int, default=10, help='the number of the slowest imports to report')
+    parser.add_argument('--max-import-ms', type=float, default=None,
+                        help='fail when importing app.py takes longer than this')
+    parser.add_argument('--output', default='benchmarks/results/cold_start.json')
+    args = parser.parse_args()
+
+    imports = get_import_times(args.top)
+    print(f'import app: {imports["total_ms"]:.1f}ms')
+    for module in imports['slowest']:
+        print(f'  {module["module"]:<30} {module["cumulative_ms"]:8.1f}ms')
+
+    server, base_url = start_server_process(latency=0)
+    try:
+        warmups = {}
+        for warmup in WARMUP_MODES:
+            runs: List[Dict] = [time_first_request(warmup, base_url, args.idle) for _ in range(args.runs)]
+            warmups[warmup] = {key: sum(run[key] for run in runs) / len(runs)
+                               for key in ['import_ms', 'first_request_ms', 'second_request_ms']}
+            print(f'{warmup:<14} import={warmups[warmup]["import_ms"]:7.1f}ms '
+                  f'first request={warmups[warmup]["first_request_ms"]:7.1f}ms '
+                  f'second request={warmups[warmup]["second_request_ms"]:7.1f}ms')
+    finally:
+        server.terminate()
+        server.wait()
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'idle_seconds': args.idle,
+        'runs': args.runs,
+        'import': imports,
+        'warmup': warmups,
+    }
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        f.write(json.dumps(results, indent=2))
+    print(f'results written to {args.output}')
+
+    if args.max_import_ms is not None and imports['total_ms'] > args.max_import_ms:
+        sys.exit(f'importing app.py took {imports["total_ms"]:.1f}ms, more than {args.max_import_ms:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+benchmark of the contact sinks, many threads put contact rows at the same time the way concurrent requests do
+it reports the rows per second of the csv and the sqlite sink until every row is written
+run it from the project root with: python -m benchmarks.contact_sink
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict
+from contact_sink import ContactSink, CSVContactSink, SQLiteContactSink
+
+
+def run_writers(sink: ContactSink, writers: int, rows_per_writer: int) -> Dict:
+    """
+    :param sink: the sink to put the rows on
+    :param writers: the number of threads putting rows
+    :param rows_per_writer: the rows every thread puts
+    :return: the seconds until every row was written and the rows per second
+    """
+    def write(writer: int) -> None:
+        for i in range(rows_per_writer):
+            sink.put([f'Customer {writer}, Number {i}', f'customer{writer}.{i}@gmail.com', f'({writer:03d}) {i:07d}'])
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=write, args=(writer,)) for writer in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sink.flush()
+    seconds = time.perf_counter() - start
+    sink.close()
+    return {'seconds': seconds, 'rows_per_second': writers * rows_per_writer / seconds}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--writers', type=int, default=16)
+    parser.add_argument('--rows-per-writer', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--output', default='benchmarks/results/contact_sink.json')
+    args = parser.parse_args()
+
+    runs = {}
+    with tempfile.TemporaryDirectory() as directory:
+        sinks = {
+            'csv': CSVContactSink(os.path.join(directory, 'contact_info.csv'), args.batch_size, 0.05),
+            'sqlite': SQLiteContactSink(f"sqlite:///{os.path.join(directory, 'contacts.db')}", args.batch_size, 0.05),
+        }
+        for name, sink in sinks.items():
+            runs[name] = run_writers(sink, args.writers, args.rows_per_writer)
+            print(f'{name:<7} {runs[name]["rows_per_second"]:.0f} rows/s with {args.writers} writers')
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'parameters': vars(args),
+        'sinks': runs,
+    }
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        f.write(json.dumps(results, indent=2))
+    print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+benchmark of the session stores, every simulated session gets a number of turns of four messages
+and every turn resumes the session and saves it again, the way a /chat request does
+it reports the latency of get and set of the sqlite and the log store and the bytes they wrote
+run it from the project root with: python -m benchmarks.conversation_store
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+import uuid
+from typing import Dict, List
+from conversation_store import ConversationStore, LogConversationStore, SQLiteConversationStore
+
+
+def get_turn(turn: int) -> List[Dict]:
+    return [
+        {'role': 'user', 'content': f'what is the status of my order, turn {turn}'},
+        {'role': 'assistant', 'tool_calls': [{'id': f'call_{turn}', 'type': 'function', 'function': {
+            'name': 'get_order_status', 'arguments': json.dumps({'order_id': 'a' * 32, 'customer_id': 'b' * 32})}}]},
+        {'tool_call_id': f'call_{turn}', 'role': 'tool', 'name': 'get_order_status',
+         'content': '{"order_status":["delivered"]}'},
+        {'role': 'assistant', 'content': 'The status of your order is: delivered.'},
+    ]
+
+
+def get_size(directory: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+
+def run_sessions(store: ConversationStore, sessions: int, turns: int, system_prompt: str) -> Dict:
+    """
+    :param store: the store to run the sessions on
+    :param sessions: the number of sessions
+    :param turns: the turns of every session
+    :param system_prompt: the first message of every session
+    :return: the latency of get and set in microseconds
+    """
+    session_ids = [uuid.uuid4().hex for _ in range(sessions)]
+    get_latencies, set_latencies = [], []
+    for turn in range(turns):
+        for session_id in session_ids:
+            start = time.perf_counter()
+            messages = store.get(session_id) or [{'role': 'system', 'content': system_prompt}]
+            get_latencies.append((time.perf_counter() - start) * 1_000_000)
+
+            start = time.perf_counter()
+            store.set(session_id, messages + get_turn(turn))
+            set_latencies.append((time.perf_counter() - start) * 1_000_000)
+
+    results = {}
+    for name, latencies in (('get_us', get_latencies), ('set_us', set_latencies)):
+        quantiles = statistics.quantiles(latencies, n=100)
+        results[name] = {'mean': statistics.mean(latencies), 'p50': quantiles[49], 'p99': quantiles[98]}
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sessions', type=int, default=200)
+    parser.add_argument('--turns', type=int, default=10)
+    parser.add_argument('--output', default='benchmarks/results/conversation_store.json')
+    args = parser.parse_args()
+
+    with open('config.json') as f:
+        system_prompt = json.loads(f.read())['prompts']['system'] * 40
+
+    runs = {}
+    with tempfile.TemporaryDirectory() as directory:
+        os.makedirs(os.path.join(directory, 'sqlite'))
+        stores = {
+            'sqlite': SQLiteConversationStore(f"sqlite:///{os.path.join(directory, 'sqlite', 'sessions.db')}", 3600),
+            'log': LogConversationStore(os.path.join(directory, 'log'), 3600, fsync_batch=64, fsync_seconds=0.5,
+                                        compact_seconds=3600, segment_bytes=16 * 1024 * 1024),
+        }
+        for name, store in stores.items():
+            runs[name] = run_sessions(store, args.sessions, args.turns, system_prompt)
+            if isinstance(store, LogConversationStore):
+                store.close()
+            runs[name]['bytes'] = get_size(os.path.join(directory, name))
+            print(f'{name:<7} get p50={runs[name]["get_us"]["p50"]:.0f}us p99={runs[name]["get_us"]["p99"]:.0f}us '
+                  f'set p50={runs[name]["set_us"]["p50"]:.0f}us p99={runs[name]["set_us"]["p99"]:.0f}us '
+                  f'{runs[name]["bytes"] / 1024:.0f}KB')
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'parameters': vars(args),
+        'stores': runs,
+    }
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        f.write(json.dumps(results, indent=2))
+    print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+micro-benchmark of the order lookups the chatbot functions run
+it compares the old path of building an engine and an f-string query on every call
+against the shared engine with the prepared statements of the order repository
+run it from the project root with: python -m benchmarks.db_lookups
+"""
+import argparse
+import json
+import statistics
+import time
+from typing import Callable, List, Tuple
+from sqlalchemy import create_engine, text
+from order_repository import OrderRepository, get_engine
+
+with open('config.json') as f:
+    config = json.loads(f.read())
+
+# the queries of the repository itself, get_order_repository answers from the order index when it is enabled
+# and that is timed by benchmarks/order_index.py
+repository = OrderRepository()
+
+
+def legacy_get_order_status(order_id: str, customer_id: str) -> str:
+    """
+    the lookup exactly the way chatbot_functions used to run it
+    :param order_id: the id of the order to check
+    :param customer_id: the id of the customer
+    :return: the rows as a string
+    """
+    engine = create_engine(config['database']['name'])
+    with engine.connect() as conn:
+        query = (f"SELECT order_status FROM orders "
+                 f"WHERE order_id=='{order_id}' AND customer_id=='{customer_id}';")
+        result = conn.execute(text(query))
+    return str(result.all())
+
+
+def repository_get_order_status(order_id: str, customer_id: str) -> str:
+    """
+    the lookup through the prepared statements of the repository on the shared engine
+    :param order_id: the id of the order to check
+    :param customer_id: the id of the customer
+    :return: the rows as a string
+    """
+    return str(repository.get_order_status(order_id, customer_id))
+
+
+def get_sample_ids(sample_size: int) -> List[Tuple[str, str]]:
+    """
+    will get random order and customer id pairs to look up
+    :param sample_size: the number of pairs
+    :return: the list of (order_id, customer_id)
+    """
+    with get_engine().connect() as conn:
+        result = conn.execute(
+            text("SELECT order_id, customer_id FROM orders ORDER BY RANDOM() LIMIT :limit;"),
+            {'limit': sample_size}
+        )
+        return [tuple(row) for row in result.all()]
+
+
+def time_calls(func: Callable[[str, str], str], ids: List[Tuple[str, str]]) -> List[float]:
+    """
+    will time every call of a lookup function
+    :param func: the lookup function
+    :param ids: the order and customer ids to look up
+    :return: the latency of every call in milliseconds
+    """
+    latencies = []
+    for order_id, customer_id in ids:
+        start = time.perf_counter()
+        func(order_id, customer_id)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def report(name: str, latencies: List[float]) -> None:
+    """
+    prints the latency summary of one lookup path
+    :param name: the name of the path
+    :param latencies: the latencies in milliseconds
+    :return: none
+    """
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f'{name:<12} mean={statistics.mean(latencies):.3f}ms '
+          f'p50={quantiles[49]:.3f}ms p95={quantiles[94]:.3f}ms p99={quantiles[98]:.3f}ms')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=1000, help='number of lookups per path')
+    args = parser.parse_args()
+
+    ids = get_sample_ids(args.calls)
+
+    # one warm up call each so the first connection isn't counted
+    legacy_get_order_status(*ids[0])
+    repository_get_order_status(*ids[0])
+
+    legacy = time_calls(legacy_get_order_status, ids)
+    prepared = time_calls(repository_get_order_status, ids)
+
+    report('legacy', legacy)
+    report('repository', prepared)
+    print(f'speedup: {statistics.mean(legacy) / statistics.mean(prepared):.1f}x')
+
+
+if __name__ == '__main__':
+    main()
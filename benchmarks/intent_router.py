@@ -0,0 +1,57 @@
+"""
+benchmark of the intent router on the kinds of messages the chatbot tests send
+it prints the share of messages the router answers without the llm and the latency of a routed answer
+--llm-latency is the seconds an llm turn takes, to estimate the time saved
+run it from the project root with: python -m benchmarks.intent_router
+"""
+import argparse
+import statistics
+import time
+from sqlalchemy import text
+from chatbot import Chatbot
+from order_repository import get_engine
+
+PROMPTS = [
+    'what is the status of my order with my customer id {customer_id} and my order id {order_id}',
+    'what is the product type of my order with my customer_id = {customer_id} and order_id = {order_id}',
+    'how will I get my refund with my customer_id = {customer_id} and order_id = {order_id}',
+    'can I return this item it is a table just say yes or no with no other words',
+    'I would like to speak to a person please',
+    'I would like to check the status of my order',
+    'where is my order? customer id {customer_id} order id {order_id}',
+    'can I return order_id {order_id}, my customer_id is {customer_id}',
+]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--orders', type=int, default=100)
+    parser.add_argument('--llm-latency', type=float, default=3.0)
+    args = parser.parse_args()
+
+    with get_engine().connect() as conn:
+        ids = conn.execute(
+            text("SELECT order_id, customer_id FROM orders ORDER BY RANDOM() LIMIT :limit;"),
+            {'limit': args.orders}
+        ).all()
+
+    routed = []
+    messages = 0
+    for order_id, customer_id in ids:
+        for prompt in PROMPTS:
+            chatbot = Chatbot()
+            start = time.perf_counter()
+            if chatbot.run_router(prompt.format(order_id=order_id, customer_id=customer_id)) is not None:
+                routed.append(time.perf_counter() - start)
+            messages += 1
+
+    hit_rate = len(routed) / messages
+    print(f'hit rate: {hit_rate:.1%} of {messages} messages')
+    print(f'routed latency: mean={statistics.mean(routed) * 1000:.3f}ms '
+          f'p95={statistics.quantiles(routed, n=100)[94] * 1000:.3f}ms')
+    print(f'estimated time saved: {hit_rate * args.llm_latency:.2f}s per message '
+          f'at {args.llm_latency}s per llm turn')
+
+
+if __name__ == '__main__':
+    main()
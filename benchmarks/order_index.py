@@ -0,0 +1,81 @@
+"""
+benchmark of the in memory order index against the sql queries it replaces
+it reports the load time and the memory of the index, and the latency of get_order_status, get_order_product_type
+and get_refund_policy for random orders from the index and from the database
+run it from the project root with: python -m benchmarks.order_index
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+from order_index import LOOKUPS, OrderIndex
+from order_repository import OrderRepository
+
+
+def time_lookups(lookup: Callable, keys: List[Tuple[str, str]]) -> Dict[str, float]:
+    """
+    :param lookup: the lookup to time
+    :param keys: the order_id and customer_id of every lookup
+    :return: the mean, p50 and p99 latency in microseconds
+    """
+    latencies = []
+    for order_id, customer_id in keys:
+        start = time.perf_counter()
+        lookup(order_id, customer_id)
+        latencies.append((time.perf_counter() - start) * 1_000_000)
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {'mean': statistics.mean(latencies), 'p50': quantiles[49], 'p99': quantiles[98]}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lookups', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmarks/results/order_index.json')
+    args = parser.parse_args()
+
+    index = OrderIndex(refresh_seconds=60)
+    repository = OrderRepository()
+    # the first connection of the pool is opened before anything is timed
+    repository.get_order_status('', '')
+
+    start = time.perf_counter()
+    index.load()
+    load_seconds = time.perf_counter() - start
+
+    # the records are read again under tracemalloc, it slows the read down too much to time it
+    tracemalloc.start()
+    records = index.read()
+    memory_mb = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    tracemalloc.stop()
+    del records
+
+    keys = random.Random(args.seed).choices(list(index.records), k=args.lookups)
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'orders': len(index.records),
+        'load_seconds': load_seconds,
+        'memory_mb': memory_mb,
+        'lookups': {},
+    }
+    print(f'{len(index.records)} orders loaded in {load_seconds:.2f}s, {memory_mb:.1f}MB')
+    for lookup in LOOKUPS:
+        index_latency = time_lookups(getattr(index, lookup), keys)
+        sql_latency = time_lookups(getattr(repository, lookup), keys)
+        results['lookups'][lookup] = {'index_us': index_latency, 'sql_us': sql_latency}
+        print(f'{lookup:<24} index p50={index_latency["p50"]:.1f}us p99={index_latency["p99"]:.1f}us '
+              f'sql p50={sql_latency["p50"]:.1f}us p99={sql_latency["p99"]:.1f}us '
+              f'({sql_latency["mean"] / index_latency["mean"]:.0f}x)')
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        f.write(json.dumps(results, indent=2))
+    print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
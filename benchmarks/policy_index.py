@@ -0,0 +1,84 @@
+"""
+benchmark of the return policy index, it reports how long it takes to build, save and load the index
+and the latency of check_return_policy for a list of products, with the verdict of every product
+run it from the project root with: python -m benchmarks.policy_index
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from typing import List
+from policy_index import PolicyIndex
+
+PRODUCTS = [
+    'table', 'computer', 'diapers', 'pizza', 'tooth_brush', 'toothbrush', 'shampoo', 'perfume bottle',
+    'baby clothes', 'office chair', 'watch', 'flowers', 'garden hose', 'phone case', 'guitar', 'mattress',
+]
+
+
+def time_checks(index: PolicyIndex, products: List[str], rounds: int) -> List[float]:
+    """
+    :param index: the index to search
+    :param products: the products to check
+    :param rounds: how many times every product is checked
+    :return: the latency of every check in microseconds
+    """
+    latencies = []
+    for _ in range(rounds):
+        for product in products:
+            start = time.perf_counter()
+            index.check(product)
+            latencies.append((time.perf_counter() - start) * 1_000_000)
+    return latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rounds', type=int, default=1000)
+    parser.add_argument('--output', default='benchmarks/results/policy_index.json')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = PolicyIndex.build()
+    build_ms = (time.perf_counter() - start) * 1000
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'policy_index.json')
+        start = time.perf_counter()
+        index.save(path)
+        save_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        index = PolicyIndex.load(path)
+        load_ms = (time.perf_counter() - start) * 1000
+        size_kb = os.path.getsize(path) / 1024
+
+    latencies = time_checks(index, PRODUCTS, args.rounds)
+    quantiles = statistics.quantiles(latencies, n=100)
+    verdicts = {product: {key: value for key, value in index.check(product).items() if key != 'policy'}
+                for product in PRODUCTS}
+    for product, verdict in verdicts.items():
+        print(f'{product:<16} {verdict["verdict"]:<15} {verdict.get("match", "")} {verdict.get("score", "")}')
+    print(f'{len(index.documents)} documents, {size_kb:.1f}KB, build={build_ms:.1f}ms save={save_ms:.1f}ms '
+          f'load={load_ms:.1f}ms')
+    print(f'check mean={statistics.mean(latencies):.1f}us p50={quantiles[49]:.1f}us p99={quantiles[98]:.1f}us')
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'documents': len(index.documents),
+        'size_kb': size_kb,
+        'build_ms': build_ms,
+        'save_ms': save_ms,
+        'load_ms': load_ms,
+        'check_us': {'mean': statistics.mean(latencies), 'p50': quantiles[49], 'p99': quantiles[98]},
+        'verdicts': verdicts,
+    }
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        f.write(json.dumps(results, indent=2))
+    print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+benchmark of the time it takes to create a Chatbot
+it compares building the tools, functions and system prompt for every chatbot against the cached setup
+run it from the project root with: python -m benchmarks.startup
+"""
+import argparse
+import statistics
+import time
+from typing import List
+from chatbot import Chatbot, invalidate_chatbot_setup
+
+
+def time_chatbots(chatbots: int, cached: bool) -> List[float]:
+    """
+    will time the creation of chatbots
+    :param chatbots: the number of chatbots to create
+    :param cached: if the setup cache is kept between chatbots
+    :return: the time of every creation in milliseconds
+    """
+    latencies = []
+    for _ in range(chatbots):
+        if not cached:
+            invalidate_chatbot_setup()
+        start = time.perf_counter()
+        Chatbot()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chatbots', type=int, default=200)
+    args = parser.parse_args()
+
+    # the first chatbot also creates the engine and the openai client, so it isn't counted
+    Chatbot()
+
+    for name, cached in [('uncached', False), ('cached', True)]:
+        latencies = time_chatbots(args.chatbots, cached)
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(f'{name:<10} mean={statistics.mean(latencies):.3f}ms '
+              f'p50={quantiles[49]:.3f}ms p95={quantiles[94]:.3f}ms')
+
+
+if __name__ == '__main__':
+    main()
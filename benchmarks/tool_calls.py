@@ -0,0 +1,73 @@
+"""
+benchmark of an assistant turn that asks for the status, product type and refund policy of an order at once
+it compares running the three tool calls one after the other against the tool executor
+--delay adds a sleep to every tool call to see the effect of a slower database
+run it from the project root with: python -m benchmarks.tool_calls
+"""
+import argparse
+import json
+import statistics
+import time
+from typing import Dict, List
+from sqlalchemy import text
+from openai.types.chat import ChatCompletionMessageToolCall
+from chatbot import Chatbot
+from order_repository import get_engine
+from tool_executor import get_tool_executor
+
+MULTI_TOOL_FUNCTIONS = ['get_order_status', 'get_order_product_type', 'get_refund_policy']
+
+
+def get_turns(turns: int) -> List[List[ChatCompletionMessageToolCall]]:
+    """
+    will build the tool calls of an assistant turn for random orders
+    :param turns: the number of turns
+    :return: the tool calls of every turn
+    """
+    with get_engine().connect() as conn:
+        result = conn.execute(
+            text("SELECT order_id, customer_id FROM orders ORDER BY RANDOM() LIMIT :limit;"),
+            {'limit': turns}
+        )
+        ids = result.all()
+
+    return [[
+        ChatCompletionMessageToolCall.model_validate({
+            'id': f'call_{i}_{name}',
+            'type': 'function',
+            'function': {'name': name, 'arguments': json.dumps({'order_id': order_id, 'customer_id': customer_id})}
+        }) for name in MULTI_TOOL_FUNCTIONS
+    ] for i, (order_id, customer_id) in enumerate(ids)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--turns', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds of extra latency in every tool call')
+    args = parser.parse_args()
+
+    chatbot = Chatbot()
+    executor = get_tool_executor()
+
+    def handle_tool_call(tool_call: ChatCompletionMessageToolCall) -> Dict[str, str]:
+        time.sleep(args.delay)
+        return chatbot.handle_tool_call(tool_call)
+
+    for name, run_turn in [
+        ('sequential', lambda tool_calls: list(map(handle_tool_call, tool_calls))),
+        ('executor', lambda tool_calls: executor.run(handle_tool_call, tool_calls)),
+    ]:
+        latencies = []
+        for tool_calls in get_turns(args.turns):
+            start = time.perf_counter()
+            responses = run_turn(tool_calls)
+            latencies.append((time.perf_counter() - start) * 1000)
+            assert [response['tool_call_id'] for response in responses] == [call.id for call in tool_calls]
+
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(f'{name:<12} mean={statistics.mean(latencies):.3f}ms '
+              f'p50={quantiles[49]:.3f}ms p95={quantiles[94]:.3f}ms')
+
+
+if __name__ == '__main__':
+    main()
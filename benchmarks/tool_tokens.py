@@ -0,0 +1,149 @@
+"""
+token accounting of the tool results, it runs the conversations of chatbot_tests.py twice,
+once with the tool results as prose and the repr of the rows like before and once as the compact json of tool_results,
+and reports the prompt tokens every conversation used from the usage of the completions
+the intent router is off by default so the single lookups reach the llm with their tool results, --router turns it on
+the tests run against the local fake openai server unless OPENAI_REPLAY is set, see chatbot_tests.py
+run it from the project root with: python -m benchmarks.tool_tokens
+"""
+import argparse
+import json
+import os
+import time
+import unittest
+from typing import Callable, Dict, List
+import chatbot
+import chatbot_tests
+from chatbot import Chatbot, invalidate_chatbot_setup
+from chatbot_functions import ChatBotFunctions
+from order_repository import get_order_repository
+
+# the tool results the way they were serialized before tool_results
+LEGACY_FUNCTIONS: Dict[str, Callable[[str, str], str]] = {
+    'get_order_status': lambda order_id, customer_id: 'here is the status of the order: ' + str(
+        get_order_repository().get_order_status(order_id, customer_id)),
+    'get_order_product_type': lambda order_id, customer_id: 'the product type is: ' + str(
+        get_order_repository().get_order_product_type(order_id, customer_id)),
+    'get_refund_policy': lambda order_id, customer_id: 'the payment_type and price of the order is the following: ' + str(
+        get_order_repository().get_refund_policy(order_id, customer_id)),
+}
+
+
+def run_conversations() -> Dict[str, Dict]:
+    """
+    will run every test of chatbot_tests.py and add up the prompt tokens of the chatbots each test made
+    :return: the prompt tokens, tool result characters and the result of every test by test id
+    """
+    chatbots: List[Chatbot] = []
+    chatbot_init = Chatbot.__init__
+
+    def init(self, *args, **kwargs) -> None:
+        chatbot_init(self, *args, **kwargs)
+        chatbots.append(self)
+
+    Chatbot.__init__ = init
+    try:
+        conversations = {}
+        suite = unittest.defaultTestLoader.loadTestsFromModule(chatbot_tests)
+        for test in get_tests(suite):
+            chatbots.clear()
+            result = unittest.TestResult()
+            test.run(result)
+            conversations[test.id().split('.')[-1]] = {
+                'prompt_tokens': sum(bot.stats['prompt_tokens'] for bot in chatbots),
+                'tool_result_chars': sum(len(message['content']) for bot in chatbots
+                                         for message in bot.messages
+                                         if isinstance(message, dict) and message.get('role') == 'tool'),
+                'passed': result.wasSuccessful(),
+            }
+        return conversations
+    finally:
+        Chatbot.__init__ = chatbot_init
+
+
+def get_tests(suite: unittest.TestSuite) -> List[unittest.TestCase]:
+    tests = []
+    for test in suite:
+        tests.extend(get_tests(test) if isinstance(test, unittest.TestSuite) else [test])
+    return tests
+
+
+def use_functions(functions: Dict[str, Callable]) -> None:
+    """
+    will swap the chatbot functions and rebuild the cached setup so new chatbots call them
+    :param functions: the functions by name
+    :return: none
+    """
+    for name, function in functions.items():
+        setattr(ChatBotFunctions, name, staticmethod(function))
+    invalidate_chatbot_setup()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='token accounting of the tool results')
+    parser.add_argument('--router', action='store_true', help='answer the simple lookups with the intent router')
+    parser.add_argument('--output', default='benchmarks/results/tool_tokens.json')
+    args = parser.parse_args()
+    chatbot.config['router']['enabled'] = args.router
+
+    chatbot_tests.setUpModule()
+    try:
+        compact_functions = {name: ChatBotFunctions.__dict__[name].__func__ for name in LEGACY_FUNCTIONS}
+        use_functions(LEGACY_FUNCTIONS)
+        legacy = run_conversations()
+        use_functions(compact_functions)
+        compact = run_conversations()
+    finally:
+        chatbot_tests.tearDownModule()
+
+    conversations = {}
+    for name in legacy:
+        saved = legacy[name]['prompt_tokens'] - compact[name]['prompt_tokens']
+        conversations[name] = {
+            'legacy': legacy[name],
+            'compact': compact[name],
+            'prompt_tokens_saved': saved,
+            'percent_saved': 100 * saved / legacy[name]['prompt_tokens'] if legacy[name]['prompt_tokens'] else 0.0,
+        }
+        print(f'{name:70} {legacy[name]["prompt_tokens"]:7} -> {compact[name]["prompt_tokens"]:7} '
+              f'({conversations[name]["percent_saved"]:5.1f}% saved)')
+
+    legacy_total = sum(conversation['prompt_tokens'] for conversation in legacy.values())
+    compact_total = sum(conversation['prompt_tokens'] for conversation in compact.values())
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'openai_replay': os.environ.get('OPENAI_REPLAY'),
+        'router': args.router,
+        'conversations': conversations,
+        'prompt_tokens': {
+            'legacy': legacy_total,
+            'compact': compact_total,
+            'saved': legacy_total - compact_total,
+            'percent_saved': 100 * (legacy_total - compact_total) / legacy_total if legacy_total else 0.0,
+        },
+        'tool_result_chars': {
+            'legacy': sum(conversation['tool_result_chars'] for conversation in legacy.values()),
+            'compact': sum(conversation['tool_result_chars'] for conversation in compact.values()),
+        },
+        'tests_passed': {
+            'legacy': sum(conversation['passed'] for conversation in legacy.values()),
+            'compact': sum(conversation['passed'] for conversation in compact.values()),
+            'total': len(conversations),
+        },
+    }
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        f.write(json.dumps(results, indent=2))
+
+    totals = results['prompt_tokens']
+    print(f'total prompt tokens: {totals["legacy"]} -> {totals["compact"]} '
+          f'({totals["saved"]} saved, {totals["percent_saved"]:.1f}%)')
+    print(f'tool result characters: {results["tool_result_chars"]["legacy"]} -> '
+          f'{results["tool_result_chars"]["compact"]}')
+    print(f'tests passed: {results["tests_passed"]}')
+    print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
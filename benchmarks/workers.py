@@ -0,0 +1,158 @@
+"""
+benchmark of how the served app scales with the number of worker processes
+for every worker count it starts python serve.py against the local fake openai server and runs the conversations
+of chat_load.py over http, every customer keeps its session id so its turns land on any worker
+it reports the requests per second and the latency of every worker count, and how long the server
+took to shut down gracefully on SIGTERM, and writes them as json
+run it from the project root with: python -m benchmarks.workers --workers 1 2 4
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+import httpx
+from benchmarks.chat_load import CONVERSATION, get_customers, quantile
+from fake_openai_server import start_server_process
+
+
+def start_app(workers: int, threads: int, asgi: bool, base_url: str) -> tuple:
+    """
+    will start the app with serve.py and wait until it accepts connections
+    :param workers: the number of worker processes
+    :param threads: the threads of every gunicorn worker
+    :param asgi: if the async app is served
+    :param base_url: the url of the fake openai server
+    :return: the server process and its url
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    command = [sys.executable, 'serve.py', '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+               '--threads', str(threads)]
+    process = subprocess.Popen(command + (['--asgi'] if asgi else []),
+                               env=dict(os.environ, OPENAI_BASE_URL=base_url),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    while True:
+        try:
+            httpx.get(url + '/metrics', timeout=1).raise_for_status()
+            return process, url
+        except httpx.HTTPError:
+            if process.poll() is not None:
+                raise RuntimeError(f'serve.py exited with {process.returncode}')
+            time.sleep(0.1)
+
+
+def run_load(url: str, customers: List[Dict[str, str]], concurrency: int) -> Dict:
+    """
+    will run the conversations of the customers against the app
+    :param url: the url of the app
+    :param customers: the order_id and customer_id of every customer
+    :param concurrency: the customers talking at the same time
+    :return: the requests, errors, wall time and latencies
+    """
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def run_customer(customer: Dict[str, str]) -> None:
+        nonlocal errors
+        session_id = None
+        with httpx.Client(base_url=url, timeout=60) as client:
+            for message in CONVERSATION:
+                start = time.perf_counter()
+                try:
+                    response = client.post('/chat', json={'message': message.format(**customer),
+                                                          'session_id': session_id})
+                    session_id = response.json()['session_id']
+                    failed = response.status_code != 200
+                except (httpx.HTTPError, ValueError):
+                    failed = True
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+                    errors += failed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(run_customer, customers))
+    wall_time = time.perf_counter() - start
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'wall_seconds': wall_time,
+        'requests_per_second': len(latencies) / wall_time,
+        'latency_seconds': {
+            'mean': statistics.mean(latencies),
+            'p50': quantile(latencies, 50),
+            'p95': quantile(latencies, 95),
+            'p99': quantile(latencies, 99),
+        },
+    }
+
+
+def stop_app(process: subprocess.Popen) -> float:
+    """
+    will stop the app the way a process manager does
+    :param process: the server process
+    :return: the seconds it took to exit
+    """
+    start = time.perf_counter()
+    process.send_signal(signal.SIGTERM)
+    process.wait()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, default=4, help='the threads of every gunicorn worker')
+    parser.add_argument('--customers', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=20, help='customers talking at the same time')
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds the fake openai server waits')
+    parser.add_argument('--jitter', type=float, default=0.05, help='seconds of random jitter on the latency')
+    parser.add_argument('--asgi', action='store_true', help='serve asgi_app.py with hypercorn')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmarks/results/workers.json')
+    args = parser.parse_args()
+
+    customers = get_customers(args.customers, args.seed)
+    server, base_url = start_server_process(args.latency, args.jitter)
+    runs = {}
+    try:
+        for workers in args.workers:
+            process, url = start_app(workers, args.threads, args.asgi, base_url)
+            try:
+                runs[workers] = run_load(url, customers, args.concurrency)
+            finally:
+                runs.setdefault(workers, {})['shutdown_seconds'] = stop_app(process)
+            run = runs[workers]
+            print(f'{workers} workers: {run["requests"]} requests ({run["errors"]} errors) '
+                  f'{run["requests_per_second"]:.1f} requests/s p50={run["latency_seconds"]["p50"]:.3f}s '
+                  f'p95={run["latency_seconds"]["p95"]:.3f}s shutdown={run["shutdown_seconds"]:.2f}s')
+    finally:
+        server.terminate()
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'parameters': vars(args),
+        # the workers only add throughput while there are cores for them
+        'cpus': os.cpu_count(),
+        'workers': runs,
+    }
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        f.write(json.dumps(results, indent=2))
+    print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
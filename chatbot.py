@@ -1,37 +1,90 @@
+# app.py and asgi_app.py import this module when they warm up, openai and sqlalchemy stay at the top here
+# because the tools, the repository, the caches and the scheduler it is built from import them too
 import openai
 import json
-from typing import List, Dict, Callable, Union
-from sqlalchemy import create_engine, text
+import logging
+import time
+import os
+import threading
+import uuid
+from typing import List, Dict, Callable, Union, Any, Generator, Iterator, Optional, Tuple
+from sqlalchemy import text, make_url
 import inspect
+import itertools
 from chatbot_functions import ChatBotFunctions
 from chatbot_tools import ChatBotTools
+from context_window import ContextWindow
+from conversation_store import message_to_dict
+from tool_executor import get_tool_executor
+from order_repository import get_engine
+from intent_router import IntentRouter, router_stats
+from completion_cache import get_completion_cache
+from completion_scheduler import get_scheduler, FOLLOW_UP, NEW_TURN
+from policy_index import render_verdict
+from openai_replay import wrap_client
+from metrics import (AGENT_EVENTS, AGENT_STEP_LATENCY, LLM_LATENCY, LLM_TOKENS, TIME_TO_FIRST_TOKEN, TOOL_LATENCY,
+                     TOOL_ROUND_LATENCY)
+from openai.types import CompletionUsage
 from openai.types.chat import ChatCompletionMessageToolCall, ChatCompletion, ChatCompletionMessage
 
 
 with open('config.json') as f:
     config = json.loads(f.read())
 
+logger = logging.getLogger(__name__)
+
 
 class Chatbot:
-    def __init__(self) -> None:
+    shared_client: Optional[openai.Client] = None
+
+    def __init__(self, messages: List[Union[Dict[str, str], ChatCompletionMessage]] = None) -> None:
         """
         the constructor will make the following members of the class
         tools: a list of tool dictionaries for the openai client
         available functions: a dictionary of all the functions to call with the openai tool calls
             the dictionary will be in the following format key = function name value is function object
+        system_prompt: the system prompt a new conversation starts with
         messages: a list of messages in the chat so far
         client: the openai client to talk with
+        router: answers simple order lookups without the llm
+        context_window: fits the messages into the token budget before every completion
+        tokens_saved: the prompt tokens the context window saved in this chatbot so far
+        stream_start and time_to_first_token: the timing of the last streamed response
+        stats: the llm calls, tokens, tool calls and agent steps of this chatbot for the request log
+        :param messages: the messages of a session to continue, a new session starts with the system message
         """
 
-        with open('tools.json') as f:
-            tools_dict = json.loads(f.read())
-        self.tools = list(map(lambda tool_name: ChatBotTools.get_tool(tool_name), tools_dict['tools']))
-        self.available_functions = self.get_available_functions()
-        self.messages = self.get_starting_messages()
-        self.client = openai.Client(
-            api_key=config['openai']['OPENAI_API_KEY'],
-            timeout=config['openai']['timeout'],
-            max_retries=config['openai']['max_retries'])
+        # the tools, functions and system prompt are the same for every chatbot, so they are built once and cached
+        setup = get_chatbot_setup()
+        self.tools = setup['tools']
+        self.available_functions = setup['available_functions']
+        self.system_prompt = setup['system_prompt']
+        self.messages = messages if messages is not None else self.get_starting_messages()
+        self.client = self.get_client()
+        self.router = IntentRouter(config['router']['min_confidence'])
+        self.context_window = ContextWindow(config['context']['max_prompt_tokens'])
+        self.tokens_saved = 0
+        self.stream_start = None
+        self.time_to_first_token = None
+        self.stats = {'llm_calls': 0, 'llm_seconds': 0.0, 'cache_hits': 0, 'prompt_tokens': 0,
+                      'completion_tokens': 0, 'tool_calls': 0, 'tool_seconds': 0.0, 'steps': []}
+
+    @classmethod
+    def get_client(cls) -> openai.Client:
+        """
+        will create the openai client from the config file the first time it is needed and reuse it after,
+        so every chatbot in the process shares its connection pool
+        when base_url is null the client uses the OPENAI_BASE_URL environment variable or the openai api
+        the client records or replays completions when the OPENAI_REPLAY environment variable is set
+        :return: the openai client
+        """
+        if cls.shared_client is None:
+            cls.shared_client = wrap_client(openai.Client(
+                api_key=config['openai']['OPENAI_API_KEY'],
+                base_url=config['openai']['base_url'],
+                timeout=config['openai']['timeout'],
+                max_retries=get_client_retries()))
+        return cls.shared_client
 
     @staticmethod
     def get_available_functions() -> Dict[str, Callable[[], str]]:
@@ -57,10 +110,9 @@ class Chatbot:
 
         # will add a table definition for each table
         for name in config['database']['tables_names']:
-            engine = create_engine(config['database']['name'])
 
             # querying the db for the table definition
-            with engine.connect() as conn:
+            with get_engine().connect() as conn:
                 query = f"PRAGMA table_info({name});"
                 result = conn.execute(text(query))
 
@@ -76,26 +128,30 @@ class Chatbot:
 
         return prompt
 
-    def get_function_definition_prompt(self) -> str:
+    @staticmethod
+    def get_function_definition_prompt(available_functions: Dict[str, Callable[[], str]]) -> str:
         """
         gets the name and args of the functions the chatbot can call
         this is put into the system prompt to reduce function name and arg name hallucinations
+        :param available_functions: the dictionary of functions the chatbot can call
         :return: the prompt of function definitions
         """
         prompt = config['prompts']['function_definitions']
 
-        for name, func in self.available_functions.items():
-            args = tuple(inspect.getfullargspec(self.available_functions[name]).args)
+        for name, func in available_functions.items():
+            args = tuple(inspect.getfullargspec(func).args)
             prompt += name+str(args)+'\n'
 
         return prompt+'\n'
 
-    def get_starting_messages(self) -> List[Union[Dict[str, str], ChatCompletionMessage]]:
+    @staticmethod
+    def get_system_prompt(available_functions: Dict[str, Callable[[], str]]) -> str:
         """
         This function will create the first prompt for the system role.
         It will tell the AI what it job is as an assistant for an ecommerce store also it knows the return policies
         for the store also it will get the function and table definitions
-        :return: a list of messages containing the initial system message
+        :param available_functions: the dictionary of functions the chatbot can call
+        :return: the system prompt
         """
 
         # this is the systems starting prompt to start a chatbot session
@@ -103,34 +159,125 @@ class Chatbot:
 
         # will add function definitions and table definitions to the system prompt
         # this helps the system not hallucinate names of tables and functions
-        prompt += self.get_function_definition_prompt()
-        prompt += self.get_table_definitions_prompt()
+        prompt += Chatbot.get_function_definition_prompt(available_functions)
+        prompt += Chatbot.get_table_definitions_prompt()
 
-        # the chatbot also will get the stores return policies
+        # the chatbot also will get the stores return policies,
+        # the clauses in the return policy index are left to the check_return_policy tool unless the config asks for them
+        index_config = config['return_policy_index']
         for k, v in config['prompts']['return_policy'].items():
-            prompt += v
+            if index_config['in_system_prompt'] or k not in index_config['clauses']:
+                prompt += v
+        if not index_config['in_system_prompt']:
+            prompt += config['prompts']['return_policy_tool']
 
-        messages = [{'role': 'system', 'content': prompt}]
+        return prompt
+
+    def get_starting_messages(self) -> List[Union[Dict[str, str], ChatCompletionMessage]]:
+        """
+        :return: a list of messages containing the initial system message
+        """
+        messages = [{'role': 'system', 'content': self.system_prompt}]
         return messages
 
-    def get_response_prompt(self) -> ChatCompletion:
+    def get_context_messages(self) -> List[Dict]:
         """
-        this is the basic procedure of working with openai chat completions
-        get a prompt and ask the client to send a response
-        :return: the chatbots response
+        will fit the messages into the token budget of the context section in the config file
+        and log how many tokens were saved for this request
+        :return: the messages to send to openai
         """
+        messages, prompt_tokens, tokens_saved = self.context_window.fit(self.messages)
+        self.tokens_saved += tokens_saved
+        logger.info('context window: sending %d prompt tokens, saved %d tokens', prompt_tokens, tokens_saved)
+        return messages
 
-        # creating the chat completion and receiving the response message
-        response = self.client.chat.completions.create(
-            model=config['openai']['model'],
-            messages=self.messages,
-            tools=self.tools,
-            tool_choice=config['openai']['tool_choice'],
-            temperature=config['openai']['temperature']
-        )
+    def get_completion_args(self, use_tools: bool) -> Dict[str, Any]:
+        """
+        will build the arguments of a chat completion request from the config file
+        :param use_tools: if the chatbot can answer with tool calls
+        :return: the arguments for client.chat.completions.create
+        """
+        args = {
+            'model': config['openai']['model'],
+            'messages': self.get_context_messages(),
+            'temperature': config['openai']['temperature']
+        }
+        if use_tools:
+            args['tools'] = self.tools
+            args['tool_choice'] = config['openai']['tool_choice']
+        return args
 
+    def create_completion(self, use_tools: bool) -> ChatCompletion:
+        """
+        will get a chat completion from the completion cache or from openai,
+        requests that touch customer data bypass the cache
+        :param use_tools: if the chatbot can answer with tool calls
+        :return: the completion
+        """
+        args = self.get_completion_args(use_tools)
+        cache = get_completion_cache()
+
+        start = time.perf_counter()
+        response = cache.get(args) if cache else None
+        source = 'cache' if response is not None else 'openai'
+        if response is None:
+            response, source = self.request_completion(args)
+        self.record_completion(use_tools, source, time.perf_counter() - start, response.usage)
+
+        if source == 'openai' and cache:
+            cache.put(args, response)
         return response
 
+    def get_priority(self) -> int:
+        """
+        the turns that answer tool results finish a conversation the user is waiting on,
+        so the scheduler sends them before the first completion of a new message
+        :return: FOLLOW_UP or NEW_TURN
+        """
+        last_message = self.messages[-1]
+        return FOLLOW_UP if isinstance(last_message, dict) and last_message['role'] == 'tool' else NEW_TURN
+
+    def request_completion(self, args: Dict[str, Any], **kwargs) -> Tuple[Any, str]:
+        """
+        will send the request to openai through the scheduler of the process when it is enabled
+        :param args: the arguments of the chat completion request
+        :param kwargs: the streaming arguments, a stream is never shared with another request
+        :return: the completion or the stream and its source, openai or coalesced when an identical request
+            in flight answered it
+        """
+        def create() -> Any:
+            return self.client.chat.completions.create(**args, **kwargs)
+
+        scheduler = get_scheduler()
+        if scheduler is None:
+            return create(), 'openai'
+        response, coalesced = scheduler.run(args, self.get_priority(), create, coalesce=not kwargs)
+        return response, 'coalesced' if coalesced else 'openai'
+
+    def record_completion(self, use_tools: bool, source: str, seconds: float,
+                          usage: Optional[CompletionUsage]) -> None:
+        """
+        will record the latency and token usage of a completion in the metrics and the stats of the chatbot,
+        a cached completion didn't use any tokens
+        :param use_tools: if the completion could answer with tool calls, the first call of a turn
+        :param source: openai, cache or coalesced
+        :param seconds: how long the completion took
+        :param usage: the token usage openai answered with
+        :return: none
+        """
+        LLM_LATENCY.observe(seconds, stage='tools' if use_tools else 'follow_up', source=source)
+        self.stats['llm_calls'] += 1
+        self.stats['llm_seconds'] += seconds
+
+        # a coalesced completion used the tokens of the request it shared
+        if source == 'cache':
+            self.stats['cache_hits'] += 1
+        elif source == 'openai' and usage is not None:
+            LLM_TOKENS.inc(usage.prompt_tokens, kind='prompt')
+            LLM_TOKENS.inc(usage.completion_tokens, kind='completion')
+            self.stats['prompt_tokens'] += usage.prompt_tokens
+            self.stats['completion_tokens'] += usage.completion_tokens
+
     def handle_tool_call(self, tool_call: ChatCompletionMessageToolCall) -> Dict[str, str]:
         """
         this function will handle any tool call the chatbot decides it needs
@@ -144,8 +291,14 @@ class Chatbot:
             ChatBotFunctions.function_not_found
         )
 
-        function_args = json.loads(tool_call.function.arguments)
-        function_response = function_to_call(**function_args)
+        try:
+            function_args = json.loads(tool_call.function.arguments)
+            with TOOL_LATENCY.time(function=tool_call.function.name):
+                function_response = function_to_call(**function_args)
+        except (ValueError, TypeError) as error:
+            # the llm can send arguments that aren't json or don't fit the function, it is told so and can try again
+            logger.warning('the tool call %s of %s has bad arguments: %s', tool_call.id, tool_call.function.name, error)
+            function_response = f'the function could not be called with these arguments: {error}'
 
         response = {
             'tool_call_id': tool_call.id,
@@ -156,24 +309,167 @@ class Chatbot:
 
         return response
 
-    def handle_tool_calls(self, tool_calls: List[ChatCompletionMessageToolCall]) -> ChatCompletion:
+    def handle_tool_calls(self, tool_calls: List[ChatCompletionMessageToolCall], step: int,
+                          llm_seconds: float) -> Optional[str]:
         """
-        this will handle all the tool_calls sequentially and get the chatbots response to them
+        this will handle all the tool_calls of a step of the agent loop concurrently
+        and add their results to the messages in order
         :param tool_calls: the list of tools to call
-        :return: the response message
+        :param step: the step of the agent loop the tool calls were made in
+        :param llm_seconds: how long the completion of the step took
+        :return: the reply when a return policy verdict is answered without the client, otherwise None
         """
+        start = time.perf_counter()
+        tool_messages = self.run_tool_calls(tool_calls)
+        self.messages += tool_messages
+        self.record_step(step, llm_seconds, tool_calls, time.perf_counter() - start)
+        return self.get_local_reply(tool_messages)
 
-        # will handle all chained tool calls sequentially and return the responses to the chatbot
-        self.messages += list(map(
-            lambda tool_call: self.handle_tool_call(tool_call),
-            tool_calls))
+    @staticmethod
+    def drop_unanswered_tool_calls(messages: List[Union[Dict, ChatCompletionMessage]]) \
+            -> List[Union[Dict, ChatCompletionMessage]]:
+        """
+        openai rejects a conversation with an assistant message whose tool calls don't all have a tool message,
+        so a turn that failed between them is cut back to before that assistant message when it is saved
+        :param messages: the messages of the chatbot
+        :return: the messages without the last assistant message with tool calls when one of them is unanswered
+        """
+        for index in range(len(messages) - 1, -1, -1):
+            message = message_to_dict(messages[index])
+            if message.get('tool_calls'):
+                answered = {message_to_dict(reply).get('tool_call_id') for reply in messages[index + 1:]}
+                if all(tool_call['id'] in answered for tool_call in message['tool_calls']):
+                    return messages
+                return messages[:index]
+        return messages
 
-        # will get the clients response to the tool calls
-        response = self.client.chat.completions.create(
-            model=config['openai']['model'],
-            messages=self.messages,
-            temperature=config['openai']['temperature']
-        )
+    @staticmethod
+    def can_use_tools(step: int, deadline: float) -> bool:
+        """
+        the llm can chain tool calls until it used max_steps rounds of them or the turn is past its budget,
+        then it gets the messages without the tools and has to answer with what it found
+        :param step: the step of the agent loop, the first completion of the turn is step 0
+        :param deadline: the perf_counter time the budget of the turn runs out at
+        :return: if the completion of the step gets the tools
+        """
+        if step >= config['agent']['max_steps']:
+            event = 'max_steps'
+        elif time.perf_counter() >= deadline:
+            event = 'budget'
+        else:
+            return True
+        AGENT_EVENTS.inc(event=event)
+        logger.info('agent loop stopped calling tools at step %d because of its %s', step, event)
+        return False
+
+    def record_step(self, step: int, llm_seconds: float,
+                    tool_calls: Optional[List[ChatCompletionMessageToolCall]] = None, tool_seconds: float = 0.0) -> None:
+        """
+        will record the timing of a step of the agent loop in the metrics and the steps of the request log
+        :param step: the step of the agent loop
+        :param llm_seconds: how long the completion of the step took
+        :param tool_calls: the tool calls the completion made
+        :param tool_seconds: how long the tool calls took together
+        :return: none
+        """
+        AGENT_STEP_LATENCY.observe(llm_seconds + tool_seconds, step=str(step))
+        self.stats['steps'].append({
+            'step': step,
+            'llm_seconds': round(llm_seconds, 6),
+            'tools': [tool_call.function.name for tool_call in tool_calls or []],
+            'tool_seconds': round(tool_seconds, 6),
+        })
+
+    @staticmethod
+    def get_local_reply(tool_messages: List[Dict[str, str]]) -> Optional[str]:
+        """
+        will write the reply to the tool results without the llm when they all are return policy verdicts
+        :param tool_messages: the tool messages of the round of tool calls
+        :return: the reply or None if the llm has to answer
+        """
+        if not all(message['name'] == 'check_return_policy' for message in tool_messages):
+            return None
+        replies = []
+        for message in tool_messages:
+            # a tool that timed out or failed returns plain text, the llm answers from it
+            try:
+                result = json.loads(message['content'])
+            except ValueError:
+                return None
+            if not isinstance(result, dict) or 'verdict' not in result:
+                return None
+            replies.append(render_verdict(result))
+        return ' '.join(replies) if None not in replies else None
+
+    @staticmethod
+    def get_local_completion(reply: str) -> ChatCompletion:
+        """
+        :param reply: the reply written without the llm
+        :return: the reply in a completion like the client returns
+        """
+        return ChatCompletion.model_validate({
+            'id': 'chatcmpl-local-' + uuid.uuid4().hex[:24],
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': config['openai']['model'],
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': reply}}],
+        })
+
+    def run_tool_calls(self, tool_calls: List[ChatCompletionMessageToolCall]) -> List[Dict[str, str]]:
+        """
+        will run the tool calls on the tool executor and record how long they took together
+        :param tool_calls: the list of tools to call
+        :return: the tool messages in the order of the tool calls
+        """
+        start = time.perf_counter()
+        tool_messages = get_tool_executor().run(self.handle_tool_call, tool_calls)
+        self.record_tool_calls(len(tool_calls), time.perf_counter() - start)
+        return tool_messages
+
+    def record_tool_calls(self, count: int, seconds: float) -> None:
+        """
+        :param count: how many tools were called
+        :param seconds: how long the tool calls took together
+        :return: none
+        """
+        TOOL_ROUND_LATENCY.observe(seconds)
+        self.stats['tool_calls'] += count
+        self.stats['tool_seconds'] += seconds
+
+    def run_router(self, prompt: str) -> Optional[str]:
+        """
+        will answer the prompt without the llm if the intent router is sure it is a simple order lookup
+        the messages get the same tool call and tool result the llm would have made,
+        so later turns know what was looked up
+        :param prompt: the users question
+        :return: the templated response or None if the llm has to answer
+        """
+        if not config['router']['enabled']:
+            return None
+
+        start = time.perf_counter()
+        route = self.router.route(prompt)
+        if route is None:
+            return None
+
+        function_name, arguments = route
+        tool_call = ChatCompletionMessageToolCall.model_validate({
+            'id': 'call_router_' + uuid.uuid4().hex[:24],
+            'type': 'function',
+            'function': {'name': function_name, 'arguments': json.dumps(arguments)}
+        })
+        response = self.router.render(function_name, arguments)
+
+        self.messages += [
+            {'role': 'user', 'content': prompt},
+            {'role': 'assistant', 'tool_calls': [tool_call.model_dump()]},
+            self.handle_tool_call(tool_call),
+            {'role': 'assistant', 'content': response},
+        ]
+
+        router_stats.record_hit(time.perf_counter() - start)
+        logger.info('intent router answered %s, stats: %s', function_name, router_stats.report())
         return response
 
     def run_chat(self, prompt: str) -> str:
@@ -181,18 +477,217 @@ class Chatbot:
         This is the main function of the chatbot that the flask app will interact with
         it receives a prompt from the user the generates a sequence of tool calls if any,
         and it outputs the response from the chatbot
+        simple order lookups are answered by the intent router without the llm
+        :param prompt: the users question
+        :return: the chatbots response
+        """
+        response = self.run_router(prompt)
+        if response is not None:
+            return response
+
+        start = time.perf_counter()
+        response = self.run_llm_chat(prompt)
+        router_stats.record_miss(time.perf_counter() - start)
+        return response
+
+    def run_llm_chat(self, prompt: str) -> str:
+        """
+        will send the prompt to the llm and run the agent loop, every step handles the tool calls of the last
+        completion and sends their results back with the tools, so the llm can chain lookups like the product type
+        of an order and its return policy in one turn
+        the loop ends at a completion without tool calls or a local reply, the agent section of the config file
+        limits the steps and the seconds of a turn
         :param prompt: the users question
         :return: the chatbots response
         """
         self.messages.append({'role': 'user', 'content': prompt})
-        response_message = self.get_response_prompt().choices[0].message
-        tool_calls = response_message.tool_calls
+        deadline = time.perf_counter() + config['agent']['budget_seconds']
 
-        if tool_calls:
+        for step in itertools.count():
+            start = time.perf_counter()
+            response_message = self.create_completion(self.can_use_tools(step, deadline)).choices[0].message
             self.messages.append(response_message)
-            response = self.handle_tool_calls(tool_calls).choices[0].message
-            self.messages.append(response)
-            return response.content
+            if not response_message.tool_calls:
+                self.record_step(step, time.perf_counter() - start)
+                return response_message.content
+
+            reply = self.handle_tool_calls(response_message.tool_calls, step, time.perf_counter() - start)
+            if reply is not None:
+                self.messages.append(self.get_local_completion(reply).choices[0].message)
+                return reply
+
+    def stream_completion(self, use_tools: bool) -> Generator[str, None, Dict]:
+        """
+        will stream a chat completion, the text deltas are yielded as they arrive
+        and the tool calls are put back together from their deltas
+        the time to the first token is measured from the start of stream_chat
+        :param use_tools: if the chatbot can answer with tool calls
+        :return: the full assistant message once the stream ends
+        """
+        start = time.perf_counter()
+        stream, _ = self.request_completion(self.get_completion_args(use_tools), stream=True,
+                                            stream_options={'include_usage': True})
+
+        content = []
+        tool_calls = {}
+        usage = None
+        for chunk in stream:
+            # the usage comes in a last chunk without choices
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+
+            if delta.content:
+                if self.time_to_first_token is None:
+                    self.time_to_first_token = time.perf_counter() - self.stream_start
+                    TIME_TO_FIRST_TOKEN.observe(self.time_to_first_token)
+                    logger.info('time to first token: %.3fs', self.time_to_first_token)
+                content.append(delta.content)
+                yield delta.content
+
+            # the id and name come in the first delta of a tool call, the arguments are split over the rest
+            for tool_call_delta in delta.tool_calls or []:
+                tool_call = tool_calls.setdefault(tool_call_delta.index, {
+                    'id': None,
+                    'type': 'function',
+                    'function': {'name': '', 'arguments': ''}
+                })
+                if tool_call_delta.id:
+                    tool_call['id'] = tool_call_delta.id
+                if tool_call_delta.function and tool_call_delta.function.name:
+                    tool_call['function']['name'] += tool_call_delta.function.name
+                if tool_call_delta.function and tool_call_delta.function.arguments:
+                    tool_call['function']['arguments'] += tool_call_delta.function.arguments
+
+        self.record_completion(use_tools, 'openai', time.perf_counter() - start, usage)
+
+        message = {'role': 'assistant', 'content': ''.join(content) or None}
+        if tool_calls:
+            message['tool_calls'] = [tool_calls[index] for index in sorted(tool_calls)]
+        return message
+
+    def stream_chat(self, prompt: str) -> Iterator[str]:
+        """
+        the streaming version of run_chat, it yields the text of the response as it arrives
+        and logs the time to the first token
+        :param prompt: the users question
+        :return: the text deltas of the chatbots response
+        """
+        self.stream_start = time.perf_counter()
+        self.time_to_first_token = None
+
+        response = self.run_router(prompt)
+        if response is not None:
+            self.time_to_first_token = time.perf_counter() - self.stream_start
+            yield response
+            return
 
-        self.messages.append(response_message)
-        return response_message.content
+        self.messages.append({'role': 'user', 'content': prompt})
+        deadline = self.stream_start + config['agent']['budget_seconds']
+
+        # the same agent loop as run_llm_chat, the text of every step is streamed as it arrives
+        for step in itertools.count():
+            start = time.perf_counter()
+            response_message = yield from self.stream_completion(self.can_use_tools(step, deadline))
+            self.messages.append(response_message)
+            if not response_message.get('tool_calls'):
+                self.record_step(step, time.perf_counter() - start)
+                break
+
+            tool_calls = list(map(ChatCompletionMessageToolCall.model_validate, response_message['tool_calls']))
+            reply = self.handle_tool_calls(tool_calls, step, time.perf_counter() - start)
+            if reply is not None:
+                yield reply
+                self.messages.append({'role': 'assistant', 'content': reply})
+                break
+
+        router_stats.record_miss(time.perf_counter() - self.stream_start)
+        logger.info('streamed response in %.3fs', time.perf_counter() - self.stream_start)
+
+
+# the key the setup was built for and the setup, swapped together so a reader never pairs a key with another setup
+_setup_cache: Optional[Tuple[Tuple[int, ...], Dict[str, Any]]] = None
+_setup_lock = threading.Lock()
+
+
+def get_setup_key() -> Tuple[int, ...]:
+    """
+    the setup is built from the prompts of the config file, the tools file and the database schema,
+    so it is rebuilt when any of them is modified
+    :return: the modification times of the files
+    """
+    database = make_url(config['database']['name']).database
+    return tuple(os.stat(path).st_mtime_ns if os.path.exists(path) else 0
+                 for path in ('config.json', 'tools.json', database))
+
+
+def build_chatbot_setup() -> Dict[str, Any]:
+    """
+    will build the tools, the available functions and the system prompt of a chatbot
+    :return: the setup dictionary
+    """
+
+    # the prompts and tools are reread, since the cache is rebuilt when they change,
+    # only the prompts of the config file are reloaded, the other sections are read once at import
+    # and the modules that use them need a restart to pick up a change
+    with open('config.json') as f:
+        config['prompts'] = json.loads(f.read())['prompts']
+    with open('tools.json') as f:
+        tools_dict = json.loads(f.read())
+
+    available_functions = Chatbot.get_available_functions()
+    return {
+        'tools': list(map(lambda tool_name: ChatBotTools.get_tool(tool_name, tools_dict), tools_dict['tools'])),
+        'available_functions': available_functions,
+        'system_prompt': Chatbot.get_system_prompt(available_functions),
+    }
+
+
+def get_chatbot_setup() -> Dict[str, Any]:
+    """
+    will get the cached setup shared by every chatbot in the process, it is rebuilt if one of its files changed
+    :return: the setup dictionary with the keys tools, available_functions and system_prompt
+    """
+    global _setup_cache
+
+    key = get_setup_key()
+    cache = _setup_cache
+    if cache is not None and cache[0] == key:
+        return cache[1]
+    with _setup_lock:
+        cache = _setup_cache
+        if cache is None or cache[0] != key:
+            cache = _setup_cache = (key, build_chatbot_setup())
+    return cache[1]
+
+
+def invalidate_chatbot_setup() -> None:
+    """
+    will drop the cached setup so the next chatbot rebuilds it
+    :return: none
+    """
+    global _setup_cache
+
+    with _setup_lock:
+        _setup_cache = None
+
+
+def get_client_retries() -> int:
+    """
+    the scheduler retries the requests itself so a rate limit pauses every request of the process,
+    the client only retries when the scheduler is off
+    :return: the max_retries of the openai client
+    """
+    return 0 if config['scheduler']['enabled'] else config['openai']['max_retries']
+
+
+def _reset_after_fork() -> None:
+    # the connection pool of the openai client belongs to the parent, a forked worker makes its own client,
+    # the cached setup is read only so the workers keep sharing the one built before the fork
+    Chatbot.shared_client = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
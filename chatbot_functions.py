@@ -1,6 +1,9 @@
-import csv
 import json
-from sqlalchemy import create_engine, text
+from typing import Optional
+from contact_sink import get_contact_sink
+from order_repository import get_order_repository
+from policy_index import get_policy_index
+from tool_results import dumps, serialize_rows
 
 with open('config.json') as f:
     config = json.loads(f.read())
@@ -41,17 +44,12 @@ class ChatBotFunctions:
         will query the database for the order status
         :param order_id: the id of the order to check
         :param customer_id: the id of the customer
-        :return: the status of the order
+        :return: the status of the order as json
         """
 
-        engine = create_engine(config['database']['name'])
-        with engine.connect() as conn:
-            query = (f"SELECT order_status FROM orders "
-                     f"WHERE order_id=='{order_id}' AND customer_id=='{customer_id}';")
-            result = conn.execute(text(query))
-
-        prompt = 'here is the status of the order: ' + str(result.all())
-        return prompt
+        rows = get_order_repository().get_order_status(order_id, customer_id)
+        # the status is repeated for every payment row of the order
+        return serialize_rows(rows, dedupe=True)
 
     @staticmethod
     def get_human_representative() -> str:
@@ -66,16 +64,15 @@ class ChatBotFunctions:
     @staticmethod
     def get_contact_info(full_name: str, email: str, phone_number: str) -> str:
         """
-        will get the users contact information and save it to a csv file
+        will get the users contact information and queue it for the contact sink,
+        which writes it to the csv file or the database in the background
         :param full_name: users full name
         :param email: users email
         :param phone_number: users phone number
         :return: the prompt
         """
-        with open('contact_info.csv', 'a') as file:
-            writer = csv.writer(file)
-            writer.writerow([full_name, email, phone_number])
-            prompt = 'We saved your contact info and a human representative will reach you soon'
+        get_contact_sink().put([full_name, email, phone_number])
+        prompt = 'We saved your contact info and a human representative will reach you soon'
         return prompt
 
     @staticmethod
@@ -89,6 +86,16 @@ class ChatBotFunctions:
                   'or you can input the order_id of a specific product')
         return prompt
 
+    @staticmethod
+    def check_return_policy(product: str) -> str:
+        """
+        will look the product up in the return policy index, so the chatbot doesn't have to
+        map the product onto the items that can't be returned itself
+        :param product: the name or type of the product
+        :return: the verdict, returnable, non_returnable or unknown, and the policy clauses that apply as json
+        """
+        return dumps(get_policy_index().check(product))
+
     @staticmethod
     def get_order_product_type(order_id: str, customer_id: str) -> str:
         """
@@ -96,17 +103,11 @@ class ChatBotFunctions:
         this can help determine if the item is returnable
         :param order_id: the id of the order to check
         :param customer_id: the id of the customer
-        :return:
+        :return: the product categories of the order as json, every category once
         """
-        engine = create_engine(config['database']['name'])
-        with engine.connect() as conn:
-            query = (f"SELECT product_category_name FROM order_items "
-                     f"INNER JOIN orders ON order_items.order_id == orders.order_id "
-                     f"WHERE order_items.order_id=='{order_id}' AND orders.customer_id=='{customer_id}';")
-            result = conn.execute(text(query))
-
-        prompt = 'the product type is: ' + str(result.all())
-        return prompt
+        rows = get_order_repository().get_order_product_type(order_id, customer_id)
+        # the join repeats a category for every payment row and every item of it
+        return serialize_rows(rows, dedupe=True)
 
     @staticmethod
     def get_refund_policy(order_id: str, customer_id: str) -> str:
@@ -115,13 +116,39 @@ class ChatBotFunctions:
         this will help tell the user how he / she will be refunded
         :param order_id: the id of the order to check
         :param customer_id: the id of the customer
-        :return:
+        :return: the payment types and values of the order as json
         """
-        engine = create_engine(config['database']['name'])
-        with engine.connect() as conn:
-            query = (f"SELECT payment_type, payment_value FROM orders "
-                     f"WHERE order_id=='{order_id}' AND customer_id=='{customer_id}';")
-            result = conn.execute(text(query))
+        rows = get_order_repository().get_refund_policy(order_id, customer_id)
+        return serialize_rows(rows)
 
-        prompt = 'the payment_type and price of the order is the following: ' + str(result.all())
-        return prompt
+    @staticmethod
+    def get_customer_orders(customer_id: str, limit: Optional[int] = None, offset: int = 0) -> str:
+        """
+        will get the status, product categories and payments of all the orders of a customer in one query,
+        so the chatbot doesn't need a tool call for every order, customers with many orders get them in pages
+        :param customer_id: the id of the customer
+        :param limit: the most orders to return, defaults to the limit in the config file and is capped by max_limit
+        :param offset: how many orders to skip to get the next page
+        :return: the orders as compact json
+        """
+        orders_config = config['tools']['customer_orders']
+        limit = min(max(int(limit or orders_config['limit']), 1), orders_config['max_limit'])
+        offset = max(int(offset or 0), 0)
+
+        # one extra row tells if there is another page
+        rows = get_order_repository().get_customer_orders(customer_id, limit + 1, offset)
+        orders = [{
+            'order_id': order_id,
+            'status': order_status,
+            'purchased_at': order_purchase_timestamp,
+            'product_categories': [category for category in json.loads(product_categories) if category],
+            'payments': [{'type': payment_type, 'value': payment_value}
+                         for payment_type, payment_value in json.loads(payments)],
+        } for order_id, order_status, order_purchase_timestamp, product_categories, payments in rows[:limit]]
+
+        return dumps({
+            'customer_id': customer_id,
+            'orders': orders,
+            'offset': offset,
+            'has_more': len(rows) > limit,
+        })
@@ -1,16 +1,58 @@
 import json
+import os
 import unittest
 from parameterized import parameterized
 import csv
+from functools import lru_cache
+# the samples of the parameterized tests are made when the module is collected, so pandas is needed at import
 import pandas as pd
-from sklearn.model_selection import train_test_split
 from typing import List, Tuple
+from unittest import mock
+import chatbot as chatbot_module
+import completion_cache
 from chatbot import Chatbot
+from openai.types.chat import ChatCompletionMessageToolCall
+from contact_sink import get_contact_sink
+from fake_openai_server import FakeOpenAIServer
+from intent_router import IntentRouter
 
 
 with open('config.json') as f:
     config = json.loads(f.read())
     sample_size = config['sample_size']
+    random_state = config['random_state']
+
+fake_server = None
+
+
+def setUpModule() -> None:
+    """
+    the tests replay recorded completions and ask the local fake openai server for the rest, so they run offline
+    run them with OPENAI_REPLAY=record to ask openai and record new cassettes, or OPENAI_REPLAY=off to only ask openai
+    every test has to reach the model, so the completion cache is turned off
+    :return: none
+    """
+    global fake_server
+
+    completion_cache.config['completion_cache']['enabled'] = False
+    if os.environ.setdefault('OPENAI_REPLAY', 'replay') == 'replay':
+        fake_server = FakeOpenAIServer().start()
+        os.environ['OPENAI_BASE_URL'] = fake_server.base_url
+
+
+def tearDownModule() -> None:
+    if fake_server is not None:
+        fake_server.stop()
+
+
+@lru_cache(maxsize=None)
+def read_clean_data(name: str) -> pd.DataFrame:
+    """
+    every test sample reads the clean csv files, so each is read once
+    :param name: the name of the table
+    :return: the clean data frame, it is shared so it must not be modified
+    """
+    return pd.read_csv('dummy_data/clean_data/' + name + '.csv')
 
 
 def get_data() -> Tuple[str, str, str, str, str]:
@@ -18,8 +60,8 @@ def get_data() -> Tuple[str, str, str, str, str]:
     will get a full single row of data for test_chaining_questions
     :return: the data below
     """
-    df_1 = pd.read_csv('dummy_data/clean_data/order_items.csv')
-    df_2 = pd.read_csv('dummy_data/clean_data/orders.csv')
+    df_1 = read_clean_data('order_items')
+    df_2 = read_clean_data('orders')
 
     df = df_1.join(df_2.set_index('order_id'), on='order_id').dropna(axis=0).iloc[0, :]
     columns = ['customer_id', 'order_id', 'order_status', 'product_category_name', 'payment_type']
@@ -33,25 +75,27 @@ def generate_sample_data(df_1_name: str, df_2_name: str = None, target_column: s
     """
     this will generate a sample data set, the original data has over 100k rows
     feel free to make the samples as large as you want
+    the samples are the same on every run, so the recorded completions can be replayed
     :param df_1_name: first dataframe to load
     :param df_2_name: second dataframe to load if join is needed
     :param target_column: the column to stratify samples from some samples are much more prevalent than others
     :return: the customer_ids, order_ids, and target column for the tests
     """
-    df = pd.read_csv('dummy_data/clean_data/' + df_1_name + '.csv').dropna(axis=0)
+    df = read_clean_data(df_1_name).dropna(axis=0)
     if df_2_name:  # will read df_2 if passed and join it to df_1 on the shared key order_id
-        df_2 = pd.read_csv('dummy_data/clean_data/' + df_2_name + '.csv')
+        df_2 = read_clean_data(df_2_name)
         df = df.join(df_2.set_index('order_id'), on='order_id').dropna(axis=0)
     if target_column:
-        # just using the sklearn train_test_split to stratify the data and get 100 rows
-        _, sample_df = train_test_split(df, stratify=df[target_column], test_size=100)
+        # a stratified sample of about 100 rows, every value of the target keeps its share of the rows,
+        # done with pandas since importing sklearn for it was most of the import time of the tests
+        sample_df = df.groupby(target_column).sample(frac=100 / len(df), random_state=random_state)
 
-        # will get a much smaller sample sklearn doesn't let sample size < number of classes
-        sample_df = sample_df.sample(sample_size)
+        # will get a much smaller sample from it
+        sample_df = sample_df.sample(sample_size, random_state=random_state)
         target = list(sample_df[target_column])
     else:
         # if no target just reduce the size
-        sample_df = df.sample(sample_size)
+        sample_df = df.sample(sample_size, random_state=random_state)
         target = None
 
     customer_ids = list(sample_df['customer_id'])
@@ -186,6 +230,23 @@ class ChatbotTest(unittest.TestCase):
         prompt = f'how will I get my refund with my customer_id = {customer_id} and order_id = {order_id}'
         self.assertTrue(self.check_refund_policy(chatbot, prompt, payment_type))
 
+    @parameterized.expand(generate_sample_data('orders', target_column='order_status'))
+    def test_get_customer_orders(self, customer_id: str, order_id: str, order_status: str) -> None:
+        """
+        will check if the chatbot gets all the orders of a customer with one tool call
+        :param customer_id: the customer id to check
+        :param order_id: an order id of the customer
+        :param order_status: the order status of the order
+        :return: none
+        """
+        chatbot = Chatbot()
+        prompt = f'What is the status of all my orders? customer id: {customer_id}'
+        response = chatbot.run_chat(prompt)
+
+        self.assertEqual(chatbot.messages[-2]['name'], 'get_customer_orders')
+        self.assertIn(order_id, response)
+        self.assertIn(order_status.replace('_', ' '), response.lower().replace('_', ' '))
+
     @staticmethod
     def check_contact_information(chatbot: Chatbot, prompt: str, name: str, email: str, phone_number: str) -> bool:
         """
@@ -203,15 +264,21 @@ class ChatbotTest(unittest.TestCase):
         # checking if correct tool_call was called
         if chatbot.messages[-2]['name'] == 'get_human_representative':
 
+            # counting the rows first, tests running in parallel can write rows at the same time
+            get_contact_sink().flush()
+            with open('contact_info.csv', newline='') as file:
+                rows_before = len(list(csv.reader(file)))
+
             # then it gives the chatbot the contact information
             prompt = f'My name is {name} my email is {email} and my phone number is {phone_number}'
             chatbot.run_chat(prompt)
             contact_info = (name, email, phone_number)
 
-            # finally it checks if the chatbot wrote it to the csv file
-            with open('contact_info.csv') as file:
-                contact_info_data = tuple(list(csv.reader(file))[-2])
-                return contact_info == contact_info_data
+            # finally it checks if the chatbot wrote it to the csv file, the sink writes in the background
+            get_contact_sink().flush()
+            with open('contact_info.csv', newline='') as file:
+                new_rows = list(map(tuple, list(csv.reader(file))[rows_before:]))
+                return contact_info in new_rows
         return False
 
     @parameterized.expand([
@@ -258,6 +325,91 @@ class ChatbotTest(unittest.TestCase):
 
         self.assertTrue(order_status and return_policy and refund_policy and contact_information)
 
+    @parameterized.expand([
+        (4,),
+        (1,),
+    ])
+    def test_agent_loop(self, max_steps: int) -> None:
+        """
+        a question about returning an order chains the product type of the order and the return policy of every
+        category it has in one turn, with one step the chatbot has to answer with the product type it found
+        :param max_steps: the max_steps of the agent section in the config file
+        :return: none
+        """
+        customer_id, order_id, _, product_type, _ = get_data()
+        order_items = read_clean_data('order_items')
+        categories = order_items[order_items['order_id'] == order_id]['product_category_name'].dropna().unique()
+        step_tools = [['get_order_product_type'], ['check_return_policy'] * len(categories) if max_steps > 1 else []]
+
+        chatbot = Chatbot()
+        prompt = f'can I return my order with customer_id = {customer_id} and order_id = {order_id}'
+        with mock.patch.dict(chatbot_module.config['agent'], {'max_steps': max_steps}):
+            response = chatbot.run_chat(prompt)
+
+        self.assertEqual([step['tools'] for step in chatbot.stats['steps']], step_tools)
+        self.assertIn(product_type.replace('_', ' '), response.lower().replace('_', ' '))
+
+    def test_tool_error(self) -> None:
+        """
+        a tool that raises or gets arguments that aren't json is answered with an error tool message,
+        so every tool call of the assistant message still has its tool message
+        :return: none
+        """
+        customer_id, order_id, _, _, _ = get_data()
+        chatbot = Chatbot()
+        prompt = f'can I return my order with customer_id = {customer_id} and order_id = {order_id}'
+
+        def fail(**_) -> str:
+            raise RuntimeError('the database is gone')
+
+        with mock.patch.dict(chatbot.available_functions, {'get_order_product_type': fail}):
+            response = ''.join(chatbot.stream_chat(prompt))
+        self.assertTrue(response)
+        self.assertIn({'tool_call_id': chatbot.messages[2]['tool_calls'][0]['id'], 'role': 'tool',
+                       'name': 'get_order_product_type', 'content': 'the function failed, please try again later'},
+                      chatbot.messages)
+
+        tool_call = ChatCompletionMessageToolCall.model_validate({
+            'id': 'call_1', 'type': 'function', 'function': {'name': 'get_order_status', 'arguments': '{"order_id'}})
+        self.assertTrue(chatbot.handle_tool_call(tool_call)['content'].startswith('the function could not be called'))
+
+    def test_failed_stream_session(self) -> None:
+        """
+        a stream that fails between the tool calls and their tool messages saves the session without the tool calls,
+        so the next turn of the session is still accepted, the fake server rejects unanswered tool calls like openai
+        :return: none
+        """
+        # the app is only needed here, importing it warms it up
+        from app import app
+        customer_id, order_id, _, _, _ = get_data()
+        client = app.test_client()
+        session_id = 'e' * 32
+        prompt = f'can I return my order with customer_id = {customer_id} and order_id = {order_id}'
+
+        with mock.patch.object(Chatbot, 'run_tool_calls', side_effect=RuntimeError('the tool executor is gone')):
+            response = client.post('/chat/stream', json={'message': prompt, 'session_id': session_id})
+        self.assertIn('"error"', response.get_data(as_text=True))
+
+        response = client.post('/chat/stream', json={'message': 'what is the status of my order',
+                                                     'session_id': session_id})
+        self.assertIn('"done": true', response.get_data(as_text=True))
+    @parameterized.expand([
+        ('get_order_status', {'order_status': None}, 'is: unknown'),
+        ('get_refund_policy', {'payment_type': None, 'payment_value': None}, 'paid with unknown for a total of 0.00'),
+    ])
+    def test_router_missing_values(self, function_name: str, row: dict, reply: str) -> None:
+        """
+        an order with missing values in the database is answered by the router like the tools answer it
+        :param function_name: the function of the intent
+        :param row: the row the repository returns
+        :param reply: the part of the reply the missing values are in
+        :return: none
+        """
+        repository = mock.Mock(**{f'{function_name}.return_value': [mock.Mock(**row)]})
+        with mock.patch('intent_router.get_order_repository', return_value=repository):
+            response = IntentRouter.render(function_name, {'order_id': 'order', 'customer_id': 'customer'})
+        self.assertIn(reply, response)
+
 
 if __name__ == '__main__':
     unittest.main()
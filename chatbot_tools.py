@@ -26,14 +26,15 @@ class ChatBotTools:
         return properties
 
     @staticmethod
-    def get_tool(tool_name: str) -> Dict:
+    def get_tool(tool_name: str, tools_dict: Dict = None) -> Dict:
         """
         this function will get the name, description args, and required args of a tool from the tools in the config file
         and will build the tool dictionary according to the openai specs
         :param tool_name: the name of the tool to build
+        :param tools_dict: the contents of the tools file, defaults to the file read at import
         :return: the tool as a dictionary in the correct format for openai
         """
-        tool_confing = tools['tools'][tool_name]
+        tool_confing = (tools_dict or tools)['tools'][tool_name]
         name = tool_confing['name']
         description = tool_confing['description']
         args = tool_confing['args']
@@ -0,0 +1,262 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from sqlalchemy import create_engine, event, text
+from openai.types.chat import ChatCompletion
+from conversation_store import message_to_dict
+from metrics import CACHE_EVENTS
+
+with open('config.json') as f:
+    config = json.loads(f.read())
+
+# a conversation that has any of these in a user message is about a specific customer, so it isn't cached
+CUSTOMER_DATA_PATTERNS = [
+    re.compile(r'[0-9a-f]{32}'),  # customer_id and order_id
+    re.compile(r'[\w.+-]+@[\w-]+\.[\w.]+'),  # email
+    re.compile(r'\d[\d\s().-]{6,}\d'),  # phone number
+]
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+_cache: Optional['CompletionCache'] = None
+_lock = threading.Lock()
+
+
+def normalize_messages(messages: List[Dict]) -> List[Dict]:
+    """
+    will normalize the messages so the same question asked a bit differently gets the same key
+    the text is lower case with single spaces and the random tool call ids are left out
+    :param messages: the messages of the request
+    :return: the normalized messages
+    """
+    normalized = []
+    for message in map(message_to_dict, messages):
+        content = message.get('content')
+        normalized.append({
+            'role': message['role'],
+            'content': WHITESPACE_PATTERN.sub(' ', content).strip().lower() if content else None,
+            'tool_calls': [
+                [tool_call['function']['name'], tool_call['function']['arguments']]
+                for tool_call in message.get('tool_calls') or []
+            ],
+        })
+    return normalized
+
+
+def get_cache_key(args: Dict[str, Any]) -> str:
+    """
+    :param args: the arguments of the chat completion request
+    :return: the hash of the model, tools and normalized messages of the request
+    """
+    key = {
+        'model': args['model'],
+        'temperature': args['temperature'],
+        'tools': args.get('tools'),
+        'tool_choice': args.get('tool_choice'),
+        'messages': normalize_messages(args['messages']),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def is_cacheable(args: Dict[str, Any]) -> bool:
+    """
+    only answers that don't depend on a customer are cached, so a request is bypassed when
+    the model is sampling, a tool was called in the conversation or the user wrote ids, an email or a phone number
+    :param args: the arguments of the chat completion request
+    :return: if the response to the request can be cached
+    """
+    if args['temperature'] != 0:
+        return False
+
+    for message in map(message_to_dict, args['messages']):
+        if message['role'] == 'tool' or message.get('tool_calls'):
+            return False
+        if message['role'] == 'user' and any(
+                pattern.search(message.get('content') or '') for pattern in CUSTOMER_DATA_PATTERNS):
+            return False
+    return True
+
+
+class MemoryCacheTier:
+    def __init__(self, max_entries: int, ttl_seconds: float) -> None:
+        """
+        the first tier of the cache, a least recently used dictionary in process memory
+        :param max_entries: the most completions to keep
+        :param ttl_seconds: the seconds a completion is kept
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries: OrderedDict[str, tuple] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, response = entry
+            if expires_at <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return response
+
+    def put(self, key: str, response: str, expires_at: Optional[float] = None) -> None:
+        with self.lock:
+            self.entries[key] = (expires_at or time.time() + self.ttl_seconds, response)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class SQLiteCacheTier:
+    def __init__(self, database: str, ttl_seconds: float) -> None:
+        """
+        the second tier of the cache, a sqlite table shared by the worker processes that survives restarts
+        :param database: the sqlalchemy url of the database
+        :param ttl_seconds: the seconds a completion is kept
+        """
+        self.ttl_seconds = ttl_seconds
+        self.engine = create_engine(database)
+
+        @event.listens_for(self.engine, 'connect')
+        def set_pragmas(dbapi_connection, _) -> None:
+            dbapi_connection.execute('PRAGMA journal_mode=WAL;')
+            dbapi_connection.execute('PRAGMA synchronous=NORMAL;')
+
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, expires_at REAL NOT NULL);"
+            ))
+
+    def get(self, key: str) -> Optional[tuple]:
+        """
+        :param key: the cache key
+        :return: the response and the time it expires or None
+        """
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                text("SELECT response, expires_at FROM completions WHERE key = :key AND expires_at > :now;"),
+                {'key': key, 'now': time.time()}
+            ).first()
+        return tuple(row) if row else None
+
+    def put(self, key: str, response: str) -> float:
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        with self.engine.begin() as conn:
+            conn.execute(
+                text("INSERT OR REPLACE INTO completions (key, response, expires_at) "
+                     "VALUES (:key, :response, :expires_at);"),
+                {'key': key, 'response': response, 'expires_at': expires_at}
+            )
+            conn.execute(text("DELETE FROM completions WHERE expires_at <= :now;"), {'now': now})
+        return expires_at
+
+
+class CompletionCache:
+    def __init__(self, memory: MemoryCacheTier, sqlite: Optional[SQLiteCacheTier]) -> None:
+        """
+        caches chat completions by the hash of their request, in memory first and then in sqlite
+        :param memory: the in memory tier
+        :param sqlite: the sqlite tier, None to only cache in memory
+        """
+        self.memory = memory
+        self.sqlite = sqlite
+        self.counts = {'memory_hits': 0, 'sqlite_hits': 0, 'misses': 0, 'bypasses': 0}
+        self.lock = threading.Lock()
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.counts[name] += 1
+        CACHE_EVENTS.inc(result=name)
+
+    def get(self, args: Dict[str, Any]) -> Optional[ChatCompletion]:
+        """
+        :param args: the arguments of the chat completion request
+        :return: the cached completion or None if it isn't cached or the request bypasses the cache
+        """
+        if not is_cacheable(args):
+            self.count('bypasses')
+            return None
+
+        key = get_cache_key(args)
+        response = self.memory.get(key)
+        if response is not None:
+            self.count('memory_hits')
+            return ChatCompletion.model_validate_json(response)
+
+        if self.sqlite is not None:
+            entry = self.sqlite.get(key)
+            if entry is not None:
+                self.count('sqlite_hits')
+                response, expires_at = entry
+                self.memory.put(key, response, expires_at)
+                return ChatCompletion.model_validate_json(response)
+
+        self.count('misses')
+        return None
+
+    def put(self, args: Dict[str, Any], completion: ChatCompletion) -> None:
+        """
+        will cache the completion if the request can be cached
+        :param args: the arguments of the chat completion request
+        :param completion: the completion openai answered with
+        :return: none
+        """
+        if not is_cacheable(args):
+            return
+
+        key = get_cache_key(args)
+        response = completion.model_dump_json()
+        expires_at = self.sqlite.put(key, response) if self.sqlite is not None else None
+        self.memory.put(key, response, expires_at)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        :return: the hit, miss and bypass counts and the hit rate of the cacheable requests
+        """
+        with self.lock:
+            stats = dict(self.counts)
+        hits = stats['memory_hits'] + stats['sqlite_hits']
+        stats['hit_rate'] = hits / (hits + stats['misses']) if hits + stats['misses'] else 0.0
+        return stats
+
+
+def _reset_after_fork() -> None:
+    # the sqlite connections of the parent can't be used in a forked worker
+    global _cache
+    if _cache is not None and _cache.sqlite is not None:
+        _cache.sqlite.engine.dispose(close=False)
+    _cache = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_completion_cache() -> Optional[CompletionCache]:
+    """
+    will get the completion cache shared by the whole process, built from the completion_cache section of the config
+    :return: the completion cache or None if it is disabled
+    """
+    global _cache
+
+    cache_config = config['completion_cache']
+    if not cache_config['enabled']:
+        return None
+
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                memory = MemoryCacheTier(cache_config['max_entries'], cache_config['ttl_seconds'])
+                sqlite = SQLiteCacheTier(cache_config['database'], cache_config['ttl_seconds']) \
+                    if cache_config['database'] else None
+                _cache = CompletionCache(memory, sqlite)
+    return _cache
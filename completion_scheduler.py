@@ -0,0 +1,399 @@
+import asyncio
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import openai
+from conversation_store import message_to_dict
+from metrics import SCHEDULER_EVENTS, SCHEDULER_QUEUE_DEPTH, SCHEDULER_WAIT
+
+with open('config.json') as f:
+    config = json.loads(f.read())
+
+logger = logging.getLogger(__name__)
+
+# the lower priority goes first, a turn that already has tool results is finishing a conversation the user waits on
+FOLLOW_UP = 0
+NEW_TURN = 1
+PRIORITY_NAMES = {FOLLOW_UP: 'follow_up', NEW_TURN: 'new_turn'}
+
+# the errors that go away when the request is sent again later
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+# how often an async request that isn't first in the queue looks again
+POLL_SECONDS = 0.01
+
+# the environment variable with the number of worker processes the rate limits of the account are split across
+WORKERS_ENV = 'CHATBOT_WORKERS'
+
+Ticket = Tuple[int, int]
+
+_scheduler: Optional['CompletionScheduler'] = None
+_lock = threading.Lock()
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float) -> None:
+        """
+        a bucket that refills at per_minute a minute and holds up to a minute of it
+        :param per_minute: the limit a minute
+        """
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.available = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def get_wait(self, amount: float, now: float) -> float:
+        """
+        :param amount: the amount to take, more than the capacity waits for a full bucket
+        :param now: the monotonic time
+        :return: the seconds until the amount is available
+        """
+        self.refill(now)
+        missing = min(amount, self.capacity) - self.available
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount: float) -> None:
+        self.available -= min(amount, self.capacity)
+
+    def give_back(self, amount: float) -> None:
+        # a negative amount takes what was used over the estimate, the bucket can go below zero
+        self.available = min(self.capacity, self.available + amount)
+
+
+def get_request_key(args: Dict[str, Any]) -> str:
+    """
+    :param args: the arguments of the chat completion request
+    :return: the hash of the exact request, only the same request gets the same key
+    """
+    request = {**args, 'messages': list(map(message_to_dict, args['messages']))}
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+
+def estimate_tokens(args: Dict[str, Any]) -> int:
+    """
+    the tokens a request counts against the limit before its usage is known,
+    about 4 characters a token for the prompt and the tools and the expected completion
+    :param args: the arguments of the chat completion request
+    :return: the estimated tokens
+    """
+    prompt = json.dumps({'messages': list(map(message_to_dict, args['messages'])), 'tools': args.get('tools')})
+    return len(prompt) // 4 + config['scheduler']['completion_tokens']
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """
+    :param error: the error of the request
+    :return: the seconds the retry-after headers of the response ask to wait or None if there are none
+    """
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if 'retry-after-ms' in headers:
+            return float(headers['retry-after-ms']) / 1000
+        if 'retry-after' in headers:
+            return float(headers['retry-after'])
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(headers['retry-after']).timestamp() - time.time())
+        except (KeyError, TypeError, ValueError):
+            return None
+    return None
+
+
+class CompletionScheduler:
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, max_retries: int,
+                 backoff_seconds: float, max_backoff_seconds: float, coalesce: bool) -> None:
+        """
+        every openai request of the process waits here for its turn, the requests go out in priority order
+        as fast as the requests and tokens a minute allow, a rate limit pauses every request until it passes
+        and identical requests in flight at the same time share one response
+        :param requests_per_minute: the request limit of the openai account
+        :param tokens_per_minute: the token limit of the openai account
+        :param max_retries: how many times a failed request is sent again
+        :param backoff_seconds: the first backoff, it doubles with every retry
+        :param max_backoff_seconds: the longest backoff
+        :param coalesce: if identical requests share one response
+        """
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.coalesce = coalesce
+        self.queue: List[Ticket] = []
+        self.sequence = itertools.count()
+        self.blocked_until = 0.0
+        self.in_flight: Dict[str, Future] = {}
+        self.condition = threading.Condition()
+
+    def enqueue(self, priority: int) -> Ticket:
+        ticket = (priority, next(self.sequence))
+        with self.condition:
+            heapq.heappush(self.queue, ticket)
+            self.record_queue_depth()
+        return ticket
+
+    def remove(self, ticket: Ticket) -> None:
+        # a request that gave up waiting leaves the queue
+        with self.condition:
+            if ticket in self.queue:
+                self.queue.remove(ticket)
+                heapq.heapify(self.queue)
+                self.record_queue_depth()
+                self.condition.notify_all()
+
+    def record_queue_depth(self) -> None:
+        for priority, name in PRIORITY_NAMES.items():
+            SCHEDULER_QUEUE_DEPTH.set(sum(ticket[0] == priority for ticket in self.queue), priority=name)
+
+    def try_take(self, ticket: Ticket, tokens: int) -> Optional[float]:
+        """
+        will let the ticket go when it is first in the queue and the limits allow it, the lock must be held
+        :param ticket: the ticket of the request
+        :param tokens: the estimated tokens of the request
+        :return: None when the request can go, otherwise the seconds to wait or inf when it isn't first
+        """
+        if self.queue[0] != ticket:
+            return float('inf')
+        now = time.monotonic()
+        wait = max(self.blocked_until - now, self.requests.get_wait(1, now), self.tokens.get_wait(tokens, now))
+        if wait > 0:
+            return wait
+        heapq.heappop(self.queue)
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        self.record_queue_depth()
+        self.condition.notify_all()
+        return None
+
+    def acquire(self, priority: int, tokens: int) -> None:
+        """
+        will wait until the request can be sent
+        :param priority: FOLLOW_UP or NEW_TURN
+        :param tokens: the estimated tokens of the request
+        :return: none
+        """
+        start = time.perf_counter()
+        ticket = self.enqueue(priority)
+        try:
+            with self.condition:
+                while True:
+                    wait = self.try_take(ticket, tokens)
+                    if wait is None:
+                        break
+                    self.condition.wait(None if wait == float('inf') else wait)
+        except BaseException:
+            self.remove(ticket)
+            raise
+        SCHEDULER_WAIT.observe(time.perf_counter() - start, priority=PRIORITY_NAMES[priority])
+
+    async def acquire_async(self, priority: int, tokens: int) -> None:
+        """
+        the async version of acquire, it sleeps on the event loop instead of blocking it
+        :param priority: FOLLOW_UP or NEW_TURN
+        :param tokens: the estimated tokens of the request
+        :return: none
+        """
+        start = time.perf_counter()
+        ticket = self.enqueue(priority)
+        try:
+            while True:
+                with self.condition:
+                    wait = self.try_take(ticket, tokens)
+                if wait is None:
+                    break
+                await asyncio.sleep(min(wait, POLL_SECONDS) if wait == float('inf') else wait)
+        except BaseException:
+            self.remove(ticket)
+            raise
+        SCHEDULER_WAIT.observe(time.perf_counter() - start, priority=PRIORITY_NAMES[priority])
+
+    def settle(self, tokens: int, response: Any) -> None:
+        """
+        will correct the token bucket with the usage of the response once it is known
+        :param tokens: the estimated tokens of the request
+        :param response: the response of the request
+        :return: none
+        """
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            return
+        with self.condition:
+            self.tokens.give_back(tokens - usage.total_tokens)
+            self.condition.notify_all()
+
+    def get_backoff(self, error: Exception, attempt: int) -> float:
+        """
+        a jittered exponential backoff, at least as long as the response asked for,
+        a rate limit makes every request of the process wait for it
+        :param error: the error of the request
+        :param attempt: how many times the request failed before
+        :return: the seconds to wait before the next try
+        """
+        backoff = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt)
+        delay = random.uniform(backoff / 2, backoff)
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if isinstance(error, openai.RateLimitError):
+            SCHEDULER_EVENTS.inc(event='rate_limited')
+            with self.condition:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        SCHEDULER_EVENTS.inc(event='retried')
+        logger.warning('openai request failed with %s, retrying in %.2fs', type(error).__name__, delay)
+        return delay
+
+    def join(self, args: Dict[str, Any], coalesce: bool) -> Tuple[Optional[str], Future, bool]:
+        """
+        :param args: the arguments of the chat completion request
+        :param coalesce: if the request can share a response, only the requests that aren't sampled can
+        :return: the key of the request, the future of its response and if this request sends it
+        """
+        if not (coalesce and self.coalesce and args.get('temperature') == 0):
+            return None, Future(), True
+        key = get_request_key(args)
+        with self.condition:
+            future = self.in_flight.get(key)
+            if future is not None:
+                SCHEDULER_EVENTS.inc(event='coalesced')
+                return key, future, False
+            future = self.in_flight[key] = Future()
+        return key, future, True
+
+    def finish(self, key: Optional[str], future: Future, response: Any = None,
+               error: Optional[BaseException] = None) -> None:
+        if key is not None:
+            with self.condition:
+                self.in_flight.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(response)
+
+    def run(self, args: Dict[str, Any], priority: int, create: Callable[[], Any],
+            coalesce: bool = True) -> Tuple[Any, bool]:
+        """
+        will send a request when its turn comes and retry it when it fails with an error that can go away
+        :param args: the arguments of the chat completion request
+        :param priority: FOLLOW_UP or NEW_TURN
+        :param create: sends the request
+        :param coalesce: if the request can share the response of an identical request in flight
+        :return: the response and if it was shared with another request
+        """
+        key, future, leader = self.join(args, coalesce)
+        if not leader:
+            return future.result(), True
+
+        tokens = estimate_tokens(args)
+        try:
+            for attempt in itertools.count():
+                self.acquire(priority, tokens)
+                try:
+                    response = create()
+                    break
+                except RETRYABLE_ERRORS as error:
+                    if attempt >= self.max_retries:
+                        raise
+                    time.sleep(self.get_backoff(error, attempt))
+        except BaseException as error:
+            self.finish(key, future, error=error)
+            raise
+        self.settle(tokens, response)
+        self.finish(key, future, response)
+        return response, False
+
+    async def run_async(self, args: Dict[str, Any], priority: int, create: Callable[[], Awaitable],
+                        coalesce: bool = True) -> Tuple[Any, bool]:
+        """
+        the async version of run
+        :param args: the arguments of the chat completion request
+        :param priority: FOLLOW_UP or NEW_TURN
+        :param create: makes the coroutine that sends the request
+        :param coalesce: if the request can share the response of an identical request in flight
+        :return: the response and if it was shared with another request
+        """
+        key, future, leader = self.join(args, coalesce)
+        if not leader:
+            return await asyncio.wrap_future(future), True
+
+        tokens = estimate_tokens(args)
+        try:
+            for attempt in itertools.count():
+                await self.acquire_async(priority, tokens)
+                try:
+                    response = await create()
+                    break
+                except RETRYABLE_ERRORS as error:
+                    if attempt >= self.max_retries:
+                        raise
+                    await asyncio.sleep(self.get_backoff(error, attempt))
+        except BaseException as error:
+            self.finish(key, future, error=error)
+            raise
+        self.settle(tokens, response)
+        self.finish(key, future, response)
+        return response, False
+
+
+def _reset_after_fork() -> None:
+    # the queue and the requests in flight belong to the parent, a forked worker has its own limits
+    global _scheduler
+    _scheduler = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_worker_count() -> int:
+    """
+    serve.py and gunicorn.conf.py set CHATBOT_WORKERS to the number of worker processes before they start them
+    :return: the number of worker processes that share the openai account, 1 when it isn't set
+    """
+    try:
+        return max(1, int(os.environ.get(WORKERS_ENV, '1')))
+    except ValueError:
+        logger.warning('%s is not a number, the rate limits are not split', WORKERS_ENV)
+        return 1
+
+
+def get_scheduler() -> Optional[CompletionScheduler]:
+    """
+    will get the scheduler shared by the whole process, built from the scheduler section of the config,
+    the limits of the config are the ones of the openai account, so every worker process gets its share of them
+    :return: the scheduler or None if it is disabled
+    """
+    global _scheduler
+
+    scheduler_config = config['scheduler']
+    if not scheduler_config['enabled']:
+        return None
+
+    if _scheduler is None:
+        with _lock:
+            if _scheduler is None:
+                workers = get_worker_count()
+                _scheduler = CompletionScheduler(
+                    scheduler_config['requests_per_minute'] / workers,
+                    scheduler_config['tokens_per_minute'] / workers,
+                    scheduler_config['max_retries'],
+                    scheduler_config['backoff_seconds'],
+                    scheduler_config['max_backoff_seconds'],
+                    scheduler_config['coalesce'],
+                )
+    return _scheduler
@@ -0,0 +1,231 @@
+import atexit
+import csv
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import List, Optional
+from sqlalchemy import create_engine, event, text
+
+try:
+    import fcntl
+except ImportError:
+    # windows has no fcntl, the appends of one process are still batched by its writer thread
+    fcntl = None
+
+with open('config.json') as f:
+    config = json.loads(f.read())
+
+logger = logging.getLogger(__name__)
+
+ContactRow = List[str]
+
+# markers the writer thread gets on the queue next to the rows
+_FLUSH = object()
+_STOP = object()
+
+_sink: Optional['ContactSink'] = None
+_lock = threading.Lock()
+
+
+class ContactSink(ABC):
+    """
+    the base of the sinks that save the contact requests of the customers
+    rows are put on a queue and a background thread writes them in batches,
+    a batch is written when it has batch_size rows or flush_seconds after its first row
+    """
+    def __init__(self, batch_size: int, flush_seconds: float) -> None:
+        """
+        :param batch_size: the most rows to write at once
+        :param flush_seconds: the longest a row waits on the queue before it is written
+        """
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.queue: queue.Queue = queue.Queue()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name='contact-sink', daemon=True)
+        self.thread.start()
+
+    def put(self, row: ContactRow) -> None:
+        """
+        will queue a row to be written by the writer thread
+        :param row: the full name, email and phone number
+        :return: none
+        """
+        if self.closed:
+            raise RuntimeError('the contact sink is closed')
+        self.queue.put(row)
+
+    def flush(self) -> None:
+        """
+        will write the rows queued so far without waiting for the batch to fill up and wait until they are written
+        :return: none
+        """
+        if not self.closed:
+            self.queue.put(_FLUSH)
+            self.queue.join()
+
+    def close(self) -> None:
+        """
+        will write the queued rows and stop the writer thread
+        :return: none
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(_STOP)
+        self.thread.join()
+
+    def get_batch(self) -> list:
+        """
+        will wait for the first item and then take items until the batch is full,
+        its time is up or a marker comes
+        :return: the items of the batch, markers included
+        """
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size and batch[-1] is not _FLUSH and batch[-1] is not _STOP:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self) -> None:
+        # the writer thread, a failed write is logged so the thread keeps serving the rows after it
+        while True:
+            batch = self.get_batch()
+            rows = [item for item in batch if item is not _FLUSH and item is not _STOP]
+            try:
+                if rows:
+                    self.write_rows(rows)
+            except Exception:
+                logger.exception('could not write %d contact rows', len(rows))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if batch[-1] is _STOP:
+                return
+
+    @abstractmethod
+    def write_rows(self, rows: List[ContactRow]) -> None:
+        """
+        :param rows: the rows to save in one write
+        :return: none
+        """
+        raise NotImplementedError
+
+
+class CSVContactSink(ContactSink):
+    def __init__(self, path: str, batch_size: int, flush_seconds: float) -> None:
+        """
+        appends the rows to a csv file, every batch is one locked append so the rows of
+        different worker processes never interleave
+        :param path: the csv file
+        :param batch_size: the most rows to write at once
+        :param flush_seconds: the longest a row waits on the queue before it is written
+        """
+        self.path = path
+        super().__init__(batch_size, flush_seconds)
+
+    def write_rows(self, rows: List[ContactRow]) -> None:
+        with open(self.path, 'a', newline='') as file:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                csv.writer(file).writerows(rows)
+                file.flush()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(file, fcntl.LOCK_UN)
+
+
+class SQLiteContactSink(ContactSink):
+    def __init__(self, database: str, batch_size: int, flush_seconds: float) -> None:
+        """
+        inserts the rows into the contact_requests table of a sqlite database, one transaction a batch
+        :param database: the sqlalchemy url of the database
+        :param batch_size: the most rows to write at once
+        :param flush_seconds: the longest a row waits on the queue before it is written
+        """
+        self.engine = create_engine(database)
+
+        @event.listens_for(self.engine, 'connect')
+        def set_pragmas(dbapi_connection, _) -> None:
+            dbapi_connection.execute('PRAGMA journal_mode=WAL;')
+            dbapi_connection.execute('PRAGMA synchronous=NORMAL;')
+            dbapi_connection.execute('PRAGMA busy_timeout=5000;')
+
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS contact_requests ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, full_name TEXT, email TEXT, phone_number TEXT, "
+                "created_at REAL NOT NULL);"
+            ))
+        super().__init__(batch_size, flush_seconds)
+
+    def write_rows(self, rows: List[ContactRow]) -> None:
+        now = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(
+                text("INSERT INTO contact_requests (full_name, email, phone_number, created_at) "
+                     "VALUES (:full_name, :email, :phone_number, :created_at);"),
+                [{'full_name': full_name, 'email': email, 'phone_number': phone_number, 'created_at': now}
+                 for full_name, email, phone_number in rows]
+            )
+
+
+def make_contact_sink() -> ContactSink:
+    """
+    will create the sink the contacts config asks for
+    :return: the contact sink
+    """
+    contacts_config = config['contacts']
+    if contacts_config['backend'] == 'csv':
+        return CSVContactSink(contacts_config['path'], contacts_config['batch_size'],
+                              contacts_config['flush_seconds'])
+    if contacts_config['backend'] == 'sqlite':
+        return SQLiteContactSink(contacts_config['database'], contacts_config['batch_size'],
+                                 contacts_config['flush_seconds'])
+    raise ValueError(f"unknown contacts backend {contacts_config['backend']}")
+
+
+def close_contact_sink() -> None:
+    """
+    will write the queued rows of the process before it exits
+    :return: none
+    """
+    if _sink is not None:
+        _sink.close()
+
+
+def _reset_after_fork() -> None:
+    # the writer thread doesn't exist in a forked worker, the rows queued in the parent are written by the parent
+    global _sink
+    _sink = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+atexit.register(close_contact_sink)
+
+
+def get_contact_sink() -> ContactSink:
+    """
+    will get the contact sink shared by the whole process
+    :return: the contact sink
+    """
+    global _sink
+
+    if _sink is None:
+        with _lock:
+            if _sink is None:
+                _sink = make_contact_sink()
+    return _sink
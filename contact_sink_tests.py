@@ -0,0 +1,138 @@
+import csv
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from typing import List
+from parameterized import parameterized
+from sqlalchemy import create_engine, text
+from contact_sink import ContactSink, CSVContactSink, SQLiteContactSink, ContactRow, fcntl
+
+WRITERS = 16
+ROWS_PER_WRITER = 500
+
+
+def get_rows(writer: int, count: int) -> List[ContactRow]:
+    # the names have commas and quotes, so a row split by another write would not parse back the same
+    return [[f'Customer "{writer}", Number {i}', f'customer{writer}.{i}@gmail.com', f'({writer:03d}) {i:07d}']
+            for i in range(count)]
+
+
+def write_in_process(path: str, writer: int) -> None:
+    """
+    every worker process has its own sink appending to the same file
+    :param path: the csv file
+    :param writer: the number of the writer
+    :return: none
+    """
+    sink = CSVContactSink(path, batch_size=50, flush_seconds=0.05)
+    for row in get_rows(writer, ROWS_PER_WRITER):
+        sink.put(row)
+    sink.close()
+
+
+class ContactSinkTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def make_sink(self, backend: str, batch_size: int = 100, flush_seconds: float = 0.05) -> ContactSink:
+        if backend == 'csv':
+            return CSVContactSink(os.path.join(self.directory, 'contact_info.csv'), batch_size, flush_seconds)
+        return SQLiteContactSink(f"sqlite:///{os.path.join(self.directory, 'contacts.db')}", batch_size,
+                                 flush_seconds)
+
+    def read_rows(self, backend: str) -> List[tuple]:
+        if backend == 'csv':
+            path = os.path.join(self.directory, 'contact_info.csv')
+            if not os.path.exists(path):
+                return []
+            with open(path, newline='') as file:
+                return list(map(tuple, csv.reader(file)))
+
+        engine = create_engine(f"sqlite:///{os.path.join(self.directory, 'contacts.db')}")
+        with engine.connect() as conn:
+            rows = conn.execute(text("SELECT full_name, email, phone_number FROM contact_requests;")).all()
+        engine.dispose()
+        return list(map(tuple, rows))
+
+    @parameterized.expand([('csv',), ('sqlite',)])
+    def test_concurrent_writers(self, backend: str) -> None:
+        """
+        many threads put rows at the same time, every row has to be written once and whole
+        :param backend: the sink to test
+        :return: none
+        """
+        sink = self.make_sink(backend)
+
+        def write(writer: int) -> None:
+            for row in get_rows(writer, ROWS_PER_WRITER):
+                sink.put(row)
+
+        threads = [threading.Thread(target=write, args=(writer,)) for writer in range(WRITERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        sink.flush()
+        sink.close()
+
+        rows = self.read_rows(backend)
+        expected = [tuple(row) for writer in range(WRITERS) for row in get_rows(writer, ROWS_PER_WRITER)]
+        self.assertEqual(len(rows), len(expected))
+        self.assertEqual(set(rows), set(expected))
+
+    @unittest.skipIf(fcntl is None, 'the appends of different processes are only locked with fcntl')
+    def test_concurrent_processes(self) -> None:
+        """
+        worker processes append to the same csv file, their batches must not interleave
+        :return: none
+        """
+        path = os.path.join(self.directory, 'contact_info.csv')
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=write_in_process, args=(path, writer)) for writer in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        rows = self.read_rows('csv')
+        expected = [tuple(row) for writer in range(4) for row in get_rows(writer, ROWS_PER_WRITER)]
+        self.assertEqual(sorted(rows), sorted(expected))
+
+    def test_time_threshold(self) -> None:
+        """
+        a batch that never fills up is still written once flush_seconds have passed
+        :return: none
+        """
+        sink = self.make_sink('csv', batch_size=100, flush_seconds=0.05)
+        sink.put(['John Doe', 'johndoe@gmail.com', '(818) 123-4567'])
+
+        deadline = time.monotonic() + 5
+        while not self.read_rows('csv') and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.read_rows('csv'), [('John Doe', 'johndoe@gmail.com', '(818) 123-4567')])
+        sink.close()
+
+    def test_close_writes_queued_rows(self) -> None:
+        """
+        the rows still on the queue are written when the sink is closed, like the atexit hook does
+        :return: none
+        """
+        sink = self.make_sink('csv', batch_size=1000, flush_seconds=60)
+        for row in get_rows(0, 10):
+            sink.put(row)
+        sink.close()
+
+        self.assertEqual(self.read_rows('csv'), list(map(tuple, get_rows(0, 10))))
+        with self.assertRaises(RuntimeError):
+            sink.put(['Jane Smith', 'janesmith@aol.com', '(747) 234-5678'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import json
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from conversation_store import Messages, message_to_dict
+
+with open('config.json') as f:
+    config = json.loads(f.read())
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+ID_PATTERN = r'[0-9a-f]{32}'
+PINNED_ID_PATTERNS = {
+    'customer_id': re.compile(r'customer[ _]?id\W*(' + ID_PATTERN + ')', re.IGNORECASE),
+    'order_id': re.compile(r'order[ _]?id\W*(' + ID_PATTERN + ')', re.IGNORECASE),
+}
+
+# every message costs a few tokens for its role and separators on top of its content
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=None)
+def get_encoding():
+    """
+    will get the tokenizer of the model once per process when tiktoken is installed
+    :return: the encoding or None to count with the 4 characters a token estimate
+    """
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(config['openai']['model'])
+    except Exception:
+        # unknown model or the encoding can't be downloaded
+        return None
+
+
+@lru_cache(maxsize=config['context']['token_cache_size'])
+def count_text_tokens(text: str) -> int:
+    """
+    the counts are shared by every chatbot of the process, the system prompt and the turns of a session
+    are counted again for every completion of every request
+    :param text: the text of a message
+    :return: the number of tokens of the text
+    """
+    encoding = get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+class ContextWindow:
+    def __init__(self, max_prompt_tokens: int) -> None:
+        """
+        fits the messages of a conversation into a token budget before they are sent to openai
+        the system message is always kept, the oldest turns are dropped first and the ids the user gave
+        in the dropped turns are pinned in a short summary message
+        :param max_prompt_tokens: the most tokens of messages to send
+        """
+        self.max_prompt_tokens = max_prompt_tokens
+
+    @staticmethod
+    def count_tokens(message: Dict) -> int:
+        """
+        will count the tokens of a message, the content and the tool call arguments
+        :param message: the message as a dictionary
+        :return: the number of tokens
+        """
+        text = (message.get('content') or '') + ''.join(
+            tool_call['function']['name'] + tool_call['function']['arguments']
+            for tool_call in message.get('tool_calls') or []
+        )
+        return count_text_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+
+    @staticmethod
+    def get_turns(messages: List[Dict]) -> List[List[Dict]]:
+        """
+        will split the messages after the system message into turns, every turn starts with a user message
+        so an assistant tool call is never separated from its tool results
+        :param messages: the messages without the system message
+        :return: the list of turns
+        """
+        turns = []
+        for message in messages:
+            if message['role'] == 'user' or not turns:
+                turns.append([])
+            turns[-1].append(message)
+        return turns
+
+    @staticmethod
+    def get_pinned_facts(turns: List[List[Dict]]) -> Dict[str, str]:
+        """
+        will find the last customer_id and order_id of the dropped turns,
+        from the arguments of the tool calls or from what the user wrote
+        :param turns: the turns that are dropped
+        :return: a dictionary of the id name and its value
+        """
+        facts = {}
+        for message in (message for turn in turns for message in turn):
+            for tool_call in message.get('tool_calls') or []:
+                arguments = json.loads(tool_call['function']['arguments'] or '{}')
+                facts.update({name: arguments[name] for name in PINNED_ID_PATTERNS if arguments.get(name)})
+            if message['role'] == 'user':
+                for name, pattern in PINNED_ID_PATTERNS.items():
+                    match = pattern.findall(message.get('content') or '')
+                    if match:
+                        facts[name] = match[-1]
+        return facts
+
+    @staticmethod
+    def get_summary_message(dropped_turns: List[List[Dict]], facts: Dict[str, str]) -> Dict[str, str]:
+        """
+        will write the short system message that replaces the dropped turns
+        :param dropped_turns: the turns that are dropped
+        :param facts: the pinned ids
+        :return: the summary message
+        """
+        tool_names = sorted({
+            tool_call['function']['name']
+            for turn in dropped_turns for message in turn for tool_call in message.get('tool_calls') or []
+        })
+        content = f'{len(dropped_turns)} earlier turns of this conversation were removed to save space.'
+        if tool_names:
+            content += ' In them you called: ' + ', '.join(tool_names) + '.'
+        if facts:
+            content += ' The user already gave you: ' + ', '.join(f'{k}={v}' for k, v in facts.items()) + '.'
+        return {'role': 'system', 'content': content}
+
+    def fit(self, messages: Messages) -> Tuple[List[Dict], int, int]:
+        """
+        will keep the system message and as many of the newest turns as fit in the budget,
+        the newest turn is always kept even if it alone is over the budget
+        :param messages: all the messages of the conversation, the first one is the system message
+        :return: the messages to send, the tokens they take and the tokens saved by dropping turns
+        """
+        messages = list(map(message_to_dict, messages))
+        system_message, turns = messages[0], self.get_turns(messages[1:])
+        total_tokens = sum(map(self.count_tokens, messages))
+        if total_tokens <= self.max_prompt_tokens:
+            return messages, total_tokens, 0
+
+        budget = self.max_prompt_tokens - self.count_tokens(system_message)
+        kept_turns: List[List[Dict]] = []
+        summary: Optional[Dict] = None
+        for i in range(len(turns) - 1, -1, -1):
+            dropped_turns = turns[:i]
+            summary = self.get_summary_message(dropped_turns, self.get_pinned_facts(dropped_turns))
+            turn_tokens = sum(map(self.count_tokens, turns[i]))
+            if kept_turns and turn_tokens + self.count_tokens(summary) > budget:
+                summary = self.get_summary_message(turns[:i + 1], self.get_pinned_facts(turns[:i + 1]))
+                break
+            kept_turns.insert(0, turns[i])
+            budget -= turn_tokens
+        else:
+            summary = None
+
+        fitted = [system_message] + ([summary] if summary else []) + [m for turn in kept_turns for m in turn]
+        fitted_tokens = sum(map(self.count_tokens, fitted))
+        return fitted, fitted_tokens, total_tokens - fitted_tokens
@@ -0,0 +1,509 @@
+import atexit
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+import weakref
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
+from sqlalchemy import create_engine, event, text, Engine
+from openai.types.chat import ChatCompletionMessage
+
+try:
+    import fcntl
+except ImportError:
+    # windows has no fcntl, the log of a session is then only safe with one worker process
+    fcntl = None
+
+with open('config.json') as f:
+    config = json.loads(f.read())
+
+logger = logging.getLogger(__name__)
+
+Messages = List[Union[Dict, ChatCompletionMessage]]
+
+SESSION_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+# the engines of the sqlite stores, a store made in a preloaded server process is inherited by every worker
+_engines: 'weakref.WeakSet[Engine]' = weakref.WeakSet()
+# the log stores of the process, their writer threads are started again in a forked worker
+_log_stores: 'weakref.WeakSet[LogConversationStore]' = weakref.WeakSet()
+
+
+def message_to_dict(message: Union[Dict, ChatCompletionMessage]) -> Dict:
+    """
+    the assistant messages are openai objects, this turns them into plain dictionaries that can be saved as json
+    :param message: the message from Chatbot.messages
+    :return: the message as a dictionary
+    """
+    if isinstance(message, dict):
+        return message
+    return message.model_dump(exclude_none=True)
+
+
+def get_session_id(*candidates: Optional[str]) -> str:
+    """
+    will pick the session id of a request, from the cookie or the request body
+    :param candidates: the session ids the request sent in order of preference
+    :return: the first well-formed session id or a new one
+    """
+    for session_id in candidates:
+        if session_id and SESSION_ID_PATTERN.fullmatch(session_id):
+            return session_id
+    return uuid.uuid4().hex
+
+
+class ConversationStore(ABC):
+    """
+    the base of the stores that keep the messages of every session between requests
+    """
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[Messages]:
+        """
+        :param session_id: the id of the session
+        :return: the messages of the session or None if there is no live session with that id
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def set(self, session_id: str, messages: Messages) -> None:
+        """
+        :param session_id: the id of the session
+        :param messages: all the messages of the session
+        :return: none
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        raise NotImplementedError
+
+
+class MemoryConversationStore(ConversationStore):
+    def __init__(self, max_sessions: int, ttl_seconds: float) -> None:
+        """
+        keeps the sessions in process memory, the least recently used session is evicted
+        when there are more than max_sessions and a session expires ttl_seconds after its last use
+        :param max_sessions: the most sessions to keep
+        :param ttl_seconds: the seconds a session lives without being used
+        """
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.sessions: OrderedDict[str, tuple] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def evict_expired(self, now: float) -> None:
+        # the sessions are ordered by last use, so the expired ones are all at the start
+        while self.sessions:
+            session_id, (last_used, _) = next(iter(self.sessions.items()))
+            if now - last_used < self.ttl_seconds:
+                break
+            del self.sessions[session_id]
+
+    def get(self, session_id: str) -> Optional[Messages]:
+        now = time.monotonic()
+        with self.lock:
+            self.evict_expired(now)
+            session = self.sessions.get(session_id)
+            if session is None:
+                return None
+            self.sessions.move_to_end(session_id)
+            return list(session[1])
+
+    def set(self, session_id: str, messages: Messages) -> None:
+        now = time.monotonic()
+        with self.lock:
+            self.sessions[session_id] = (now, list(messages))
+            self.sessions.move_to_end(session_id)
+            self.evict_expired(now)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+    def delete(self, session_id: str) -> None:
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+
+class SQLiteConversationStore(ConversationStore):
+    def __init__(self, database: str, ttl_seconds: float) -> None:
+        """
+        keeps the sessions in a sqlite database, so they survive restarts and every worker process sees them
+        :param database: the sqlalchemy url of the database
+        :param ttl_seconds: the seconds a session lives without being used
+        """
+        self.ttl_seconds = ttl_seconds
+        self.engine = create_engine(database)
+
+        # WAL lets the workers read sessions while another worker writes one
+        @event.listens_for(self.engine, 'connect')
+        def set_pragmas(dbapi_connection, _) -> None:
+            dbapi_connection.execute('PRAGMA journal_mode=WAL;')
+            dbapi_connection.execute('PRAGMA synchronous=NORMAL;')
+
+        _engines.add(self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, messages TEXT NOT NULL, updated_at REAL NOT NULL);"
+            ))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_sessions_updated_at ON sessions (updated_at);"))
+
+    def get(self, session_id: str) -> Optional[Messages]:
+        with self.engine.connect() as conn:
+            messages = conn.execute(
+                text("SELECT messages FROM sessions WHERE session_id = :session_id AND updated_at > :expires;"),
+                {'session_id': session_id, 'expires': time.time() - self.ttl_seconds}
+            ).scalar()
+        return json.loads(messages) if messages is not None else None
+
+    def set(self, session_id: str, messages: Messages) -> None:
+        now = time.time()
+        messages = json.dumps(list(map(message_to_dict, messages)), separators=(',', ':'))
+        with self.engine.begin() as conn:
+            conn.execute(
+                text("INSERT INTO sessions (session_id, messages, updated_at) "
+                     "VALUES (:session_id, :messages, :updated_at) "
+                     "ON CONFLICT (session_id) DO UPDATE SET "
+                     "messages = excluded.messages, updated_at = excluded.updated_at;"),
+                {'session_id': session_id, 'messages': messages, 'updated_at': now}
+            )
+            conn.execute(text("DELETE FROM sessions WHERE updated_at <= :expires;"),
+                         {'expires': now - self.ttl_seconds})
+
+    def delete(self, session_id: str) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(text("DELETE FROM sessions WHERE session_id = :session_id;"), {'session_id': session_id})
+
+
+def dumps_line(record: Dict) -> str:
+    return json.dumps(record, separators=(',', ':'), ensure_ascii=False) + '\n'
+
+
+class LogConversationStore(ConversationStore):
+    def __init__(self, directory: str, ttl_seconds: float, fsync_batch: int, fsync_seconds: float,
+                 compact_seconds: float, segment_bytes: int) -> None:
+        """
+        keeps every session in an append-only log of newline-delimited json, one file per session,
+        a turn appends only the messages that are new since the last one and a session is resumed
+        by reading its one file, so the sessions survive a crash and every worker process sees them
+        the appends are written right away and a background thread fsyncs them in batches,
+        it also compacts the logs of the sessions that were rewritten and rolls the expired sessions over
+        into the archive segments, one json line a session for analytics
+        :param directory: the directory of the logs, the archive segments are in its archive folder
+        :param ttl_seconds: the seconds a session lives without being used
+        :param fsync_batch: the most appends to wait for before they are fsynced
+        :param fsync_seconds: the longest an append waits for its fsync
+        :param compact_seconds: how often the logs are compacted and the expired sessions are rolled over
+        :param segment_bytes: the size an archive segment is rolled over at
+        """
+        self.directory = directory
+        self.archive_directory = os.path.join(directory, 'archive')
+        self.ttl_seconds = ttl_seconds
+        self.fsync_batch = fsync_batch
+        self.fsync_seconds = fsync_seconds
+        self.compact_seconds = compact_seconds
+        self.segment_bytes = segment_bytes
+        os.makedirs(self.archive_directory, exist_ok=True)
+
+        # the sessions this process rewrote, their logs are compacted
+        self.rewritten = set()
+        self.start()
+        _log_stores.add(self)
+
+    def start(self) -> None:
+        # the files waiting for their fsync and the writer thread, a forked worker starts them again
+        self.pending: List[int] = []
+        self.closed = False
+        self.lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name='session-log', daemon=True)
+        self.thread.start()
+
+    def get_path(self, session_id: str) -> str:
+        # the logs are spread over folders by the start of the session id, so no folder gets too big
+        return os.path.join(self.directory, session_id[:2], session_id + '.jsonl')
+
+    @staticmethod
+    def read_log(path: str) -> Tuple[Messages, int]:
+        """
+        will replay a log, a reset record drops the messages after its position
+        :param path: the log of a session
+        :return: the messages of the session and the bytes of the whole lines they were read from
+        """
+        messages = []
+        size = 0
+        with open(path, 'rb') as file:
+            for line in file:
+                # the last line of a crashed process can be cut short, the turn it belongs to is lost
+                if not line.endswith(b'\n'):
+                    break
+                size += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a cut short line the next append was written after
+                    continue
+                if 'reset' in record:
+                    del messages[record['reset']:]
+                else:
+                    messages.append(record)
+        return messages, size
+
+    @staticmethod
+    def open_locked(path: str, flags: int) -> Optional[int]:
+        """
+        will open a log and lock it, the compaction replaces a log with a new file
+        so the file is opened again when it was replaced while this process waited for the lock
+        :param path: the log of a session
+        :param flags: the flags to open it with
+        :return: the locked file descriptor or None if the log doesn't exist and isn't created
+        """
+        while True:
+            try:
+                fd = os.open(path, flags, 0o644)
+            except FileNotFoundError:
+                return None
+            if fcntl is None:
+                return fd
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def get(self, session_id: str) -> Optional[Messages]:
+        path = self.get_path(session_id)
+        try:
+            if time.time() - os.stat(path).st_mtime > self.ttl_seconds:
+                self.roll_over(path)
+            return self.read_log(path)[0]
+        except FileNotFoundError:
+            return None
+
+    def set(self, session_id: str, messages: Messages) -> None:
+        path = self.get_path(session_id)
+        records = [message_to_dict(message) for message in messages]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = self.open_locked(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        try:
+            # the log is read again under its lock, another turn of the session in this or another worker
+            # can have written to it since these messages were read
+            logged, size = self.read_log(path)
+            common = 0
+            for logged_record, record in zip(logged, records):
+                if logged_record != record:
+                    break
+                common += 1
+
+            # the chatbot only appends messages, a session that got shorter or that another turn wrote
+            # different messages to is written again from where they differ after a reset record
+            if common == len(logged):
+                lines = records[common:]
+            else:
+                lines = [{'reset': common}] + records[common:]
+                with self.lock:
+                    self.rewritten.add(session_id)
+            data = ''.join(map(dumps_line, lines)).encode('utf-8')
+            # a line cut short by a crashed process is ended first, so the new lines start on lines of their own
+            if data and os.fstat(fd).st_size > size:
+                data = b'\n' + data
+            # one write for all the lines, so the appends of different workers never interleave
+            if data:
+                os.write(fd, data)
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        except BaseException:
+            os.close(fd)
+            raise
+        if not data:
+            os.close(fd)
+            return
+        with self.condition:
+            self.pending.append(fd)
+            if len(self.pending) >= self.fsync_batch:
+                self.condition.notify()
+
+    def delete(self, session_id: str) -> None:
+        try:
+            os.remove(self.get_path(session_id))
+        except FileNotFoundError:
+            pass
+
+    def sync(self) -> None:
+        """
+        will fsync the appends waiting for it, the file descriptors are closed after their fsync
+        :return: none
+        """
+        with self.condition:
+            fds, self.pending = self.pending, []
+        for fd in fds:
+            try:
+                os.fsync(fd)
+            except OSError:
+                logger.exception('could not fsync a session log')
+            finally:
+                os.close(fd)
+
+    def run(self) -> None:
+        # the writer thread, the compaction is done between the fsyncs and a failed one is tried again next time
+        next_compaction = time.monotonic() + self.compact_seconds
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.closed or len(self.pending) >= self.fsync_batch,
+                                        timeout=self.fsync_seconds)
+                closed = self.closed
+            self.sync()
+            if closed:
+                return
+            if time.monotonic() >= next_compaction:
+                next_compaction = time.monotonic() + self.compact_seconds
+                try:
+                    self.compact()
+                except Exception:
+                    logger.exception('could not compact the session logs')
+
+    def close(self) -> None:
+        """
+        will fsync the appends of the process and stop the writer thread
+        :return: none
+        """
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.sync()
+
+    def compact(self) -> None:
+        """
+        will write the logs of the sessions that were rewritten again without their old messages
+        and roll the expired sessions over into the archive
+        :return: none
+        """
+        with self.lock:
+            rewritten, self.rewritten = self.rewritten, set()
+        for session_id in rewritten:
+            self.rewrite(self.get_path(session_id))
+
+        now = time.time()
+        for folder in os.scandir(self.directory):
+            if not folder.is_dir() or folder.path == self.archive_directory:
+                continue
+            for entry in os.scandir(folder.path):
+                try:
+                    if entry.name.endswith('.jsonl') and now - entry.stat().st_mtime > self.ttl_seconds:
+                        self.roll_over(entry.path)
+                except FileNotFoundError:
+                    # another worker rolled it over first
+                    continue
+
+    def rewrite(self, path: str) -> None:
+        """
+        will replace a log with one that only has the messages of the session, in one rename
+        :param path: the log of a session
+        :return: none
+        """
+        fd = self.open_locked(path, os.O_RDONLY)
+        if fd is None:
+            return
+        try:
+            messages = self.read_log(path)[0]
+            with open(path + '.tmp', 'w', encoding='utf-8') as file:
+                file.write(''.join(map(dumps_line, messages)))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(path + '.tmp', path)
+        finally:
+            os.close(fd)
+
+    def get_segment(self) -> str:
+        """
+        :return: the archive segment to append to, a new one once the last one is segment_bytes long
+        """
+        segments = sorted(name for name in os.listdir(self.archive_directory) if name.endswith('.jsonl'))
+        number = int(segments[-1].split('.')[0]) if segments else 0
+        path = os.path.join(self.archive_directory, f'{number:08d}.jsonl')
+        if os.path.exists(path) and os.path.getsize(path) >= self.segment_bytes:
+            path = os.path.join(self.archive_directory, f'{number + 1:08d}.jsonl')
+        return path
+
+    def roll_over(self, path: str) -> None:
+        """
+        will move an expired session into the archive, the archive line is fsynced before the log is removed
+        :param path: the log of a session
+        :return: none
+        """
+        fd = self.open_locked(path, os.O_RDONLY)
+        if fd is None:
+            return
+        try:
+            # a turn can have been appended while this process waited for the lock
+            if time.time() - os.fstat(fd).st_mtime <= self.ttl_seconds:
+                return
+            line = dumps_line({
+                'session_id': os.path.basename(path)[:-len('.jsonl')],
+                'closed_at': time.time(),
+                'messages': self.read_log(path)[0],
+            })
+            archive_fd = self.open_locked(self.get_segment(), os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+            try:
+                os.write(archive_fd, line.encode('utf-8'))
+                os.fsync(archive_fd)
+            finally:
+                os.close(archive_fd)
+            os.remove(path)
+        finally:
+            os.close(fd)
+
+
+def close_conversation_stores() -> None:
+    """
+    will fsync the session logs of the process before it exits
+    :return: none
+    """
+    for store in list(_log_stores):
+        store.close()
+
+
+def _reset_after_fork() -> None:
+    # a forked worker can't use the sqlite connections of its parent, it opens its own on the next request
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+    # the writer threads of the log stores don't exist in a forked worker,
+    # the parent fsyncs the appends it made and the worker closes its copies of them
+    for store in list(_log_stores):
+        for fd in store.pending:
+            os.close(fd)
+        store.start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+atexit.register(close_conversation_stores)
+
+
+def get_conversation_store() -> ConversationStore:
+    """
+    will create the store the sessions config asks for
+    :return: the conversation store
+    """
+    sessions_config = config['sessions']
+    if sessions_config['backend'] == 'sqlite':
+        return SQLiteConversationStore(sessions_config['database'], sessions_config['ttl_seconds'])
+    if sessions_config['backend'] == 'log':
+        log_config = sessions_config['log']
+        return LogConversationStore(log_config['directory'], sessions_config['ttl_seconds'],
+                                    log_config['fsync_batch'], log_config['fsync_seconds'],
+                                    log_config['compact_seconds'], log_config['segment_bytes'])
+    if sessions_config['backend'] == 'memory':
+        return MemoryConversationStore(sessions_config['max_sessions'], sessions_config['ttl_seconds'])
+    raise ValueError(f"unknown sessions backend {sessions_config['backend']}")
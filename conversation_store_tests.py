@@ -0,0 +1,132 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from openai.types.chat import ChatCompletionMessage
+from conversation_store import LogConversationStore
+
+SESSION_ID = 'f' * 32
+
+MESSAGES = [
+    {'role': 'system', 'content': 'you are an conversational agent'},
+    {'role': 'user', 'content': 'where is my order'},
+    ChatCompletionMessage.model_validate({
+        'role': 'assistant', 'content': None,
+        'tool_calls': [{'id': 'call_1', 'type': 'function', 'function': {'name': 'get_order_id', 'arguments': '{}'}}],
+    }),
+    {'tool_call_id': 'call_1', 'role': 'tool', 'name': 'get_order_id', 'content': 'what is the order_id'},
+    ChatCompletionMessage.model_validate({'role': 'assistant', 'content': 'what is the order_id of your order'}),
+]
+
+
+class LogConversationStoreTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.stores = []
+
+    def tearDown(self) -> None:
+        for store in self.stores:
+            store.close()
+        shutil.rmtree(self.directory)
+
+    def make_store(self, ttl_seconds: float = 3600) -> LogConversationStore:
+        store = LogConversationStore(self.directory, ttl_seconds=ttl_seconds, fsync_batch=8, fsync_seconds=0.05,
+                                     compact_seconds=3600, segment_bytes=1024 * 1024)
+        self.stores.append(store)
+        return store
+
+    def read_lines(self) -> list:
+        with open(os.path.join(self.directory, SESSION_ID[:2], SESSION_ID + '.jsonl')) as file:
+            return [json.loads(line) for line in file]
+
+    def test_resume(self) -> None:
+        """
+        a session is appended turn by turn and another store, like a worker started after a crash, resumes it
+        :return: none
+        """
+        store = self.make_store()
+        self.assertIsNone(store.get(SESSION_ID))
+        store.set(SESSION_ID, MESSAGES[:2])
+        store.set(SESSION_ID, store.get(SESSION_ID) + MESSAGES[2:])
+
+        expected = [message if isinstance(message, dict) else message.model_dump(exclude_none=True)
+                    for message in MESSAGES]
+        self.assertEqual(self.make_store().get(SESSION_ID), expected)
+        # every message was written once
+        self.assertEqual(self.read_lines(), expected)
+
+    def test_cut_short_line(self) -> None:
+        """
+        the last line of a process that crashed while it wrote is left out
+        :return: none
+        """
+        store = self.make_store()
+        store.set(SESSION_ID, MESSAGES[:2])
+        with open(os.path.join(self.directory, SESSION_ID[:2], SESSION_ID + '.jsonl'), 'a') as file:
+            file.write('{"role":"user","content":"whe')
+        self.assertEqual(self.make_store().get(SESSION_ID), MESSAGES[:2])
+
+    def test_compaction(self) -> None:
+        """
+        a session that got shorter is cut by a reset record and the compaction drops the old messages
+        :return: none
+        """
+        store = self.make_store()
+        store.set(SESSION_ID, MESSAGES[:4])
+        store.set(SESSION_ID, MESSAGES[:2])
+        self.assertEqual(store.get(SESSION_ID), MESSAGES[:2])
+        self.assertEqual(self.read_lines()[4:], [{'reset': 2}])
+
+        store.compact()
+        self.assertEqual(self.read_lines(), MESSAGES[:2])
+        self.assertEqual(store.get(SESSION_ID), MESSAGES[:2])
+
+    def test_concurrent_turns(self) -> None:
+        """
+        two turns of a session resumed at the same time, by one worker or two, don't duplicate messages,
+        the turn saved last is the session
+        :return: none
+        """
+        store = self.make_store()
+        store.set(SESSION_ID, MESSAGES[:2])
+        first_turn = store.get(SESSION_ID) + MESSAGES[2:4]
+        second_turn = store.get(SESSION_ID) + [{'role': 'user', 'content': 'where is my refund'}]
+        for saving_store in (store, self.make_store()):
+            saving_store.set(SESSION_ID, first_turn)
+            saving_store.set(SESSION_ID, second_turn)
+            self.assertEqual(self.make_store().get(SESSION_ID), second_turn)
+
+    def test_cut_short_line_then_append(self) -> None:
+        """
+        the next turn after a crash while writing starts on a new line, so the log still reads back
+        :return: none
+        """
+        store = self.make_store()
+        store.set(SESSION_ID, MESSAGES[:2])
+        with open(os.path.join(self.directory, SESSION_ID[:2], SESSION_ID + '.jsonl'), 'a') as file:
+            file.write('{"role":"user","content":"whe')
+        store.set(SESSION_ID, MESSAGES[:3])
+        self.assertEqual(self.make_store().get(SESSION_ID), [MESSAGES[0], MESSAGES[1],
+                                                             MESSAGES[2].model_dump(exclude_none=True)])
+
+    def test_roll_over(self) -> None:
+        """
+        an expired session is moved into the archive and a new session with its id starts empty
+        :return: none
+        """
+        store = self.make_store(ttl_seconds=0.05)
+        store.set(SESSION_ID, MESSAGES[:2])
+        time.sleep(0.1)
+        store.compact()
+
+        self.assertIsNone(store.get(SESSION_ID))
+        with open(os.path.join(self.directory, 'archive', '00000000.jsonl')) as file:
+            archived = [json.loads(line) for line in file]
+        self.assertEqual([(session['session_id'], session['messages']) for session in archived],
+                         [(SESSION_ID, MESSAGES[:2])])
+
+
+if __name__ == '__main__':
+    unittest.main()
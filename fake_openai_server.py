@@ -0,0 +1,461 @@
+"""
+a local stand-in for the openai chat completions api
+it answers with recorded cassettes or scripted tool calls and replies after a configurable delay,
+so the chatbot can be tested and load tested without network calls or cost
+run it with: python fake_openai_server.py --port 8000 --latency 0.5 --cassettes cassettes
+and point the chatbot at it with OPENAI_BASE_URL=http://127.0.0.1:8000/v1
+"""
+import argparse
+import json
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from openai_replay import load_cassette
+
+ORDER_ID_PATTERN = re.compile(r'order[ _]?id\W*([0-9a-f]{32})', re.IGNORECASE)
+CUSTOMER_ID_PATTERN = re.compile(r'customer[ _]?id\W*([0-9a-f]{32})', re.IGNORECASE)
+BARE_ID_PATTERN = re.compile(r'\s*([0-9a-f]{32})\s*')
+ITEM_PATTERN = re.compile(r'it is an? (?P<product>.+?)(?: just say|[.,?!]|$)', re.IGNORECASE)
+CONTACT_PATTERN = re.compile(
+    r'my name is (?P<full_name>.+?),? my email is (?P<email>\S+?),? and my phone number is (?P<phone_number>.+)$',
+    re.IGNORECASE
+)
+
+# the scripted intents in the order they are checked, with the words that point to them
+SCRIPTED_INTENTS = [
+    ('get_human_representative', ['person', 'human', 'representative']),
+    ('return_item', ['it is a']),
+    ('get_order_product_type', ['product type', 'type of product', 'return']),
+    ('get_refund_policy', ['refund']),
+    ('get_customer_orders', ['all my orders', 'all of my orders']),
+    ('get_order_status', ['status', 'where is']),
+]
+
+# the items of the return policy that can't be returned, perishable goods and personal care items
+NON_RETURNABLE_WORDS = [
+    'pizza', 'food', 'fruit', 'milk', 'bread', 'cake', 'flower', 'perishable',
+    'diaper', 'tooth', 'shampoo', 'soap', 'perfume', 'makeup', 'razor', 'deodorant', 'clearance',
+]
+
+
+class FakeHTTPServer(ThreadingHTTPServer):
+    # the default queue of 5 pending connections drops connections under load
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class FakeOpenAIServer:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 cassette_dir: Optional[str] = None, jitter: float = 0.0) -> None:
+        """
+        :param host: the host to listen on
+        :param port: the port to listen on, 0 picks a free port
+        :param latency: the seconds to wait before every response, to simulate the model
+        :param cassette_dir: the folder of recorded completions to answer with before the scripted ones
+        :param jitter: up to this many seconds are randomly added to or taken from the latency
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.cassette_dir = cassette_dir
+        self.requests_served = 0
+        self.http_server = FakeHTTPServer((host, port), self.get_handler())
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.http_server.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self) -> 'FakeOpenAIServer':
+        """
+        will serve in a background thread
+        :return: the server
+        """
+        self.thread = threading.Thread(target=self.http_server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+    def get_handler(self) -> type:
+        """
+        will build the request handler class bound to this server
+        :return: the handler class
+        """
+        fake_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self) -> None:
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                time.sleep(max(0.0, fake_server.latency + random.uniform(-fake_server.jitter, fake_server.jitter)))
+                error = fake_server.get_request_error(body.get('messages') or [])
+                if error is not None:
+                    payload = json.dumps({'error': {'message': error, 'type': 'invalid_request_error',
+                                                    'param': 'messages', 'code': None}}).encode()
+                    self.send_response(400)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                    return
+                completion = fake_server.respond(body)
+                fake_server.requests_served += 1
+
+                if body.get('stream'):
+                    self.send_stream(completion, body.get('stream_options') or {})
+                    return
+
+                payload = json.dumps(completion).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def send_stream(self, completion: Dict, stream_options: Dict) -> None:
+                """
+                will send a completion as server-sent events in chunked transfer encoding like the openai api
+                :param completion: the completion to send
+                :param stream_options: the stream options of the request
+                :return: none
+                """
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+
+                for chunk in fake_server.get_chunks(completion, stream_options.get('include_usage', False)):
+                    event = f'data: {json.dumps(chunk)}\n\n'.encode()
+                    self.wfile.write(f'{len(event):x}\r\n'.encode() + event + b'\r\n')
+                    self.wfile.flush()
+                done = b'data: [DONE]\n\n'
+                self.wfile.write(f'{len(done):x}\r\n'.encode() + done + b'\r\n0\r\n\r\n')
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        return Handler
+
+    @staticmethod
+    def get_request_error(messages: List[Dict]) -> Optional[str]:
+        """
+        openai rejects the messages when an assistant message with tool calls isn't followed
+        by a tool message for every one of them, the fake server does too
+        :param messages: the messages of the request
+        :return: the error message or None when the messages are valid
+        """
+        for index, message in enumerate(messages):
+            if not message.get('tool_calls'):
+                continue
+            answered = set()
+            for reply in messages[index + 1:]:
+                if reply.get('role') != 'tool':
+                    break
+                answered.add(reply.get('tool_call_id'))
+            for tool_call in message['tool_calls']:
+                if tool_call['id'] not in answered:
+                    return ("An assistant message with 'tool_calls' must be followed by tool messages responding "
+                            f"to each 'tool_call_id'. The following tool_call_ids did not have response messages: "
+                            f"{tool_call['id']}")
+        return None
+
+    def respond(self, body: Dict) -> Dict:
+        """
+        will answer a chat completions request with its recorded cassette if there is one,
+        otherwise with the scripted answer
+        :param body: the json body of the request
+        :return: the chat completion
+        """
+        if self.cassette_dir:
+            completion = load_cassette(body, self.cassette_dir)
+            if completion is not None:
+                return completion.model_dump()
+        return self.respond_scripted(body)
+
+    @staticmethod
+    def get_conversation_state(messages: List[Dict]) -> Tuple[Dict[str, str], Optional[str]]:
+        """
+        will follow the conversation to find the ids the user gave and what the user last asked for
+        a bare id the user sends is the id the last get_order_id or get_customer_id tool call asked for
+        :param messages: the messages of the request
+        :return: the ids and the last intent
+        """
+        ids = {}
+        intent = None
+        asked_for = None
+        for message in messages:
+            if message['role'] == 'tool' and message.get('name') in ('get_order_id', 'get_customer_id'):
+                asked_for = message['name'][len('get_'):]
+            for tool_call in message.get('tool_calls') or []:
+                arguments = json.loads(tool_call['function']['arguments'] or '{}')
+                ids.update({name: arguments[name] for name in ('order_id', 'customer_id') if name in arguments})
+            if message['role'] != 'user':
+                continue
+
+            content = message.get('content') or ''
+            bare_id = BARE_ID_PATTERN.fullmatch(content)
+            if bare_id and asked_for:
+                ids[asked_for] = bare_id.group(1)
+            for name, pattern in (('order_id', ORDER_ID_PATTERN), ('customer_id', CUSTOMER_ID_PATTERN)):
+                match = pattern.search(content)
+                if match:
+                    ids[name] = match.group(1)
+
+            if CONTACT_PATTERN.search(content):
+                intent = 'get_contact_info'
+                continue
+            for name, words in SCRIPTED_INTENTS:
+                if any(word in content.lower() for word in words):
+                    intent = name
+                    break
+        return ids, intent
+
+    def respond_scripted(self, body: Dict) -> Dict:
+        """
+        will script the assistant message for a chat completions request the way the chatbot tests expect
+        the lookups ask for a missing order_id or customer_id before they call the lookup tool,
+        tool results get a reply that repeats them, the product types of an order the user wants to return
+        get their return policy checked in the next step and return questions about an item check the return policy,
+        or get a yes or no when the request has no check_return_policy tool
+        :param body: the json body of the request
+        :return: the chat completion
+        """
+        messages = body['messages']
+        last_message = messages[-1]
+        tool_names = {tool['function']['name'] for tool in body.get('tools', [])}
+
+        if last_message['role'] == 'tool':
+            tool_calls = self.get_chained_tool_calls(messages, tool_names)
+            if tool_calls:
+                return self.get_completion(body, tool_calls=tool_calls)
+            return self.get_completion(body, content=self.get_tool_reply(messages))
+
+        ids, intent = self.get_conversation_state(messages)
+        content = last_message.get('content') or ''
+
+        if intent == 'return_item' and 'check_return_policy' in tool_names and ITEM_PATTERN.search(content):
+            arguments = {'product': ITEM_PATTERN.search(content).group('product')}
+            return self.get_completion(body, tool_calls=[self.get_tool_call('check_return_policy', arguments)])
+        if intent == 'return_item':
+            returnable = not any(word in content.lower() for word in NON_RETURNABLE_WORDS)
+            return self.get_completion(body, content='yes' if returnable else 'no')
+
+        if intent == 'get_contact_info' and intent in tool_names:
+            arguments = CONTACT_PATTERN.search(content).groupdict()
+            return self.get_completion(body, tool_calls=[self.get_tool_call(intent, arguments)])
+
+        if intent == 'get_human_representative' and intent in tool_names:
+            return self.get_completion(body, tool_calls=[self.get_tool_call(intent, {})])
+
+        if intent == 'get_customer_orders' and intent in tool_names:
+            if 'customer_id' not in ids:
+                return self.get_completion(body, tool_calls=[self.get_tool_call('get_customer_id', {})])
+            arguments = {'customer_id': ids['customer_id']}
+            return self.get_completion(body, tool_calls=[self.get_tool_call(intent, arguments)])
+
+        if intent in ('get_order_status', 'get_order_product_type', 'get_refund_policy') and intent in tool_names:
+            if 'order_id' not in ids:
+                return self.get_completion(body, tool_calls=[self.get_tool_call('get_order_id', {})])
+            if 'customer_id' not in ids:
+                return self.get_completion(body, tool_calls=[self.get_tool_call('get_customer_id', {})])
+            return self.get_completion(body, tool_calls=[self.get_tool_call(intent, ids)])
+
+        return self.get_completion(body, content='what is your customer_id and order_id')
+
+    @staticmethod
+    def get_chained_tool_calls(messages: List[Dict], tool_names: set) -> List[Dict]:
+        """
+        a question about returning an order gets the product type of the order first,
+        when the tools are sent with its result the return policy of every category is checked next
+        :param messages: the messages of the request, the last ones are tool results
+        :param tool_names: the tools of the request
+        :return: the check_return_policy tool calls or nothing when the results are answered
+        """
+        if 'check_return_policy' not in tool_names:
+            return []
+        user_message = next(message for message in reversed(messages) if message['role'] == 'user')
+        if 'return' not in (user_message.get('content') or '').lower():
+            return []
+
+        categories = []
+        for message in reversed(messages):
+            if message['role'] != 'tool':
+                break
+            if message.get('name') == 'get_order_product_type':
+                # a tool that failed or timed out answers with plain text
+                try:
+                    result = json.loads(message['content'])
+                except ValueError:
+                    continue
+                categories += result.get('product_category_name') or []
+        return [FakeOpenAIServer.get_tool_call('check_return_policy', {'product': category})
+                for category in dict.fromkeys(categories) if category]
+
+    @staticmethod
+    def get_tool_reply(messages: List[Dict]) -> str:
+        """
+        will repeat the results of the last tool calls, a payment type also gets its refund policy
+        :param messages: the messages of the request, the last ones are tool results
+        :return: the reply
+        """
+        tool_results = []
+        for message in reversed(messages):
+            if message['role'] != 'tool':
+                break
+            tool_results.insert(0, message['content'])
+            # the verdicts the chatbot doesn't answer itself are answered the way the model would
+            if message.get('name') == 'check_return_policy':
+                try:
+                    verdict = json.loads(message['content']).get('verdict')
+                except ValueError:
+                    verdict = None
+                answer = {'returnable': 'Yes, it can be returned.', 'non_returnable': "No, it can't be returned."}
+                if verdict in answer:
+                    tool_results.insert(0, answer[verdict])
+        reply = 'here is what I found: ' + ' '.join(tool_results)
+
+        # an order paid in parts can have both kinds of payment
+        if any(payment_type in reply for payment_type in ('credit_card', 'debit_card')):
+            reply += ' If an item was purchased with a card, the refund will be credited to your card.'
+        if any(payment_type in reply for payment_type in ("'cash'", "'check'", '"cash"', '"check"')):
+            reply += ' If an item was purchased with cash or a check the refund will be in cash.'
+        return reply
+
+    @staticmethod
+    def get_chunks(completion: Dict, include_usage: bool = False) -> List[Dict]:
+        """
+        will split a completion into the chunks of a streamed completion,
+        the content word by word and the tool call arguments a few characters at a time
+        :param completion: the completion to split
+        :param include_usage: if a last chunk without choices has the token usage, like stream_options asks for
+        :return: the chunks
+        """
+        message = completion['choices'][0]['message']
+        deltas = [{'role': 'assistant', 'content': ''}]
+
+        for word in (message['content'] or '').split(' '):
+            deltas.append({'content': word if len(deltas) == 1 else ' ' + word})
+
+        for index, tool_call in enumerate(message.get('tool_calls', [])):
+            deltas.append({'tool_calls': [{
+                'index': index,
+                'id': tool_call['id'],
+                'type': 'function',
+                'function': {'name': tool_call['function']['name'], 'arguments': ''}
+            }]})
+            arguments = tool_call['function']['arguments']
+            for i in range(0, len(arguments), 16):
+                deltas.append({'tool_calls': [{'index': index, 'function': {'arguments': arguments[i:i + 16]}}]})
+
+        chunks = [{
+            'id': completion['id'],
+            'object': 'chat.completion.chunk',
+            'created': completion['created'],
+            'model': completion['model'],
+            'choices': [{'index': 0, 'delta': delta, 'finish_reason': None, 'logprobs': None}]
+        } for delta in deltas]
+        chunks[-1]['choices'][0]['finish_reason'] = completion['choices'][0]['finish_reason']
+        if include_usage:
+            chunks.append({**chunks[-1], 'choices': [], 'usage': completion['usage']})
+        return chunks
+
+    @staticmethod
+    def get_tool_call(name: str, arguments: Dict) -> Dict:
+        return {
+            'id': 'call_' + uuid.uuid4().hex[:24],
+            'type': 'function',
+            'function': {'name': name, 'arguments': json.dumps(arguments)}
+        }
+
+    @staticmethod
+    def count_tokens(message: Dict) -> int:
+        text = (message.get('content') or '') + ''.join(
+            tool_call['function']['name'] + tool_call['function']['arguments']
+            for tool_call in message.get('tool_calls') or []
+        )
+        return len(text) // 4 + 4
+
+    @staticmethod
+    def get_completion(body: Dict, content: Optional[str] = None, tool_calls: Optional[List[Dict]] = None) -> Dict:
+        """
+        will wrap an assistant message in the chat completion format of the openai api
+        :param body: the json body of the request
+        :param content: the text of the message
+        :param tool_calls: the tool calls of the message
+        :return: the chat completion
+        """
+        message = {'role': 'assistant', 'content': content}
+        if tool_calls:
+            message['tool_calls'] = tool_calls
+
+        # roughly 4 characters a token and a few tokens a message, close enough for a fake
+        prompt_tokens = sum(map(FakeOpenAIServer.count_tokens, body['messages']))
+        completion_tokens = FakeOpenAIServer.count_tokens(message)
+        return {
+            'id': 'chatcmpl-' + uuid.uuid4().hex[:24],
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body['model'],
+            'choices': [{
+                'index': 0,
+                'message': message,
+                'finish_reason': 'tool_calls' if tool_calls else 'stop',
+                'logprobs': None
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens
+            }
+        }
+
+
+def start_server_process(latency: float, jitter: float = 0.0) -> Tuple[subprocess.Popen, str]:
+    """
+    will start the fake openai server in its own process, so it doesn't compete with the chatbot for the gil
+    :param latency: the seconds the server waits before every response
+    :param jitter: up to this many seconds are randomly added to or taken from the latency
+    :return: the server process and its base url
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    process = subprocess.Popen(
+        [sys.executable, 'fake_openai_server.py', '--port', str(port),
+         '--latency', str(latency), '--jitter', str(jitter)],
+        stdout=subprocess.DEVNULL
+    )
+
+    # waiting until the server accepts connections
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, f'http://127.0.0.1:{port}/v1'
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds to wait before every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='seconds randomly added to or taken from latency')
+    parser.add_argument('--cassettes', default=None, help='folder of recorded completions to answer with')
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(args.host, args.port, args.latency, args.cassettes, args.jitter)
+    print(f'serving a fake openai api on {server.base_url}')
+    server.http_server.serve_forever()
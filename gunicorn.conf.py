@@ -0,0 +1,57 @@
+# gunicorn.conf.py
+# the gunicorn settings of the flask app, they come from the server section in the config file
+# run it with: gunicorn app:app or python serve.py, the options on the command line take precedence
+import gc
+import json
+import os
+import sys
+
+# gunicorn reads every setting of this file by name and config is one of them, so only the server section is kept
+with open('config.json') as f:
+    server_config = json.loads(f.read())['server']
+
+bind = server_config['bind']
+workers = server_config['workers']
+# the requests wait on openai most of the time, so every worker serves a few of them on threads
+worker_class = 'gthread'
+threads = server_config['threads']
+timeout = server_config['timeout']
+graceful_timeout = server_config['graceful_timeout']
+preload_app = server_config['preload']
+
+if preload_app:
+    # the app warms up in the server process before the workers are forked, so they share the tools and
+    # the system prompt, a warmup thread must not be running when the server forks
+    os.environ['CHATBOT_WARMUP'] = 'import'
+
+
+def when_ready(server) -> None:
+    """
+    the preloaded app is in memory and the workers are about to be forked,
+    the garbage collector would write to every object it tracks and copy the shared pages into every worker,
+    so the objects made so far are moved out of its reach
+    :param server: the gunicorn arbiter
+    :return: none
+    """
+    if preload_app:
+        gc.freeze()
+    # the workers split the openai rate limits of the scheduler section between them
+    os.environ['CHATBOT_WORKERS'] = str(server.num_workers)
+    server.log.info('serving with %d workers', server.num_workers)
+
+
+def worker_exit(server, worker) -> None:
+    """
+    a worker exits once its requests are done or the graceful timeout is up,
+    it writes the contact requests it has queued and fsyncs its session logs before it goes
+    :param server: the gunicorn arbiter
+    :param worker: the worker that exits
+    :return: none
+    """
+    contact_sink = sys.modules.get('contact_sink')
+    if contact_sink is not None:
+        contact_sink.close_contact_sink()
+    conversation_store = sys.modules.get('conversation_store')
+    if conversation_store is not None:
+        conversation_store.close_conversation_stores()
+    server.log.info('worker %s exited', worker.pid)
@@ -0,0 +1,164 @@
+import json
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import Row
+from context_window import PINNED_ID_PATTERNS
+from metrics import ROUTER_EVENTS
+from order_repository import get_order_repository
+
+with open('config.json') as f:
+    config = json.loads(f.read())
+
+# the keywords of every intent the router can answer, with how strongly they point to it
+INTENT_KEYWORDS = {
+    'get_order_status': {
+        'status': 2.0, 'where is': 1.5, 'track': 1.5, 'shipped': 1.0, 'delivered': 1.0, 'arrive': 1.0,
+    },
+    'get_order_product_type': {
+        'product type': 2.0, 'type of product': 2.0, 'category': 2.0, 'what did i order': 1.5, 'what is in': 1.0,
+    },
+    'get_refund_policy': {
+        'refund': 2.0, 'money back': 1.5, 'paid': 1.0, 'payment': 1.0,
+    },
+}
+
+# words that mean the user wants something the router can't answer, so the llm gets the message
+FALLBACK_KEYWORDS = ['return', 'human', 'person', 'representative', 'cancel', 'and also', ' or ']
+
+WORD_PATTERN = re.compile(r'[a-z]+(?: [a-z]+)*')
+
+
+class RouterStats:
+    def __init__(self) -> None:
+        """
+        counts how many messages the router answered and how long the routed and llm turns took,
+        the time saved is estimated from the average llm turn
+        """
+        self.hits = 0
+        self.misses = 0
+        self.routed_seconds = 0.0
+        self.llm_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def record_hit(self, seconds: float) -> None:
+        with self.lock:
+            self.hits += 1
+            self.routed_seconds += seconds
+        ROUTER_EVENTS.inc(result='hit')
+
+    def record_miss(self, seconds: float) -> None:
+        with self.lock:
+            self.misses += 1
+            self.llm_seconds += seconds
+        ROUTER_EVENTS.inc(result='miss')
+
+    def report(self) -> Dict[str, float]:
+        """
+        :return: the hit rate, the average latency of both paths and the estimated seconds saved
+        """
+        with self.lock:
+            total = self.hits + self.misses
+            average_llm = self.llm_seconds / self.misses if self.misses else 0.0
+            average_routed = self.routed_seconds / self.hits if self.hits else 0.0
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'average_llm_seconds': average_llm,
+                'average_routed_seconds': average_routed,
+                'seconds_saved': max(0.0, average_llm - average_routed) * self.hits,
+            }
+
+
+router_stats = RouterStats()
+
+
+class IntentRouter:
+    def __init__(self, min_confidence: float) -> None:
+        """
+        answers simple order lookups without the llm when it is sure what the user wants
+        :param min_confidence: the share of the keyword score the best intent needs to be answered here
+        """
+        self.min_confidence = min_confidence
+
+    @staticmethod
+    def get_ids(prompt: str) -> Optional[Dict[str, str]]:
+        """
+        will find the customer_id and order_id the user wrote, they have to be named so they aren't mixed up
+        :param prompt: the users message
+        :return: the ids or None if one is missing or there is more than one of either
+        """
+        ids = {}
+        for name, pattern in PINNED_ID_PATTERNS.items():
+            matches = set(pattern.findall(prompt))
+            if len(matches) != 1:
+                return None
+            ids[name] = matches.pop()
+        return ids
+
+    def classify(self, prompt: str) -> Tuple[Optional[str], float]:
+        """
+        will score every intent by the keywords found in the message
+        :param prompt: the users message
+        :return: the best intent and its share of the total score
+        """
+        text = prompt.lower()
+        if any(keyword in text for keyword in FALLBACK_KEYWORDS):
+            return None, 0.0
+
+        scores = {
+            intent: sum(weight for keyword, weight in keywords.items() if keyword in text)
+            for intent, keywords in INTENT_KEYWORDS.items()
+        }
+        total = sum(scores.values())
+        if not total:
+            return None, 0.0
+
+        intent = max(scores, key=scores.get)
+        return intent, scores[intent] / total
+
+    def route(self, prompt: str) -> Optional[Tuple[str, Dict[str, str]]]:
+        """
+        :param prompt: the users message
+        :return: the function to call and its arguments, or None to let the llm answer
+        """
+        ids = self.get_ids(prompt)
+        if ids is None:
+            return None
+
+        intent, confidence = self.classify(prompt)
+        if intent is None or confidence < self.min_confidence:
+            return None
+        return intent, {'order_id': ids['order_id'], 'customer_id': ids['customer_id']}
+
+    @staticmethod
+    def render(function_name: str, arguments: Dict[str, str]) -> str:
+        """
+        will look up the order and fill in the reply template of the intent
+        :param function_name: the function of the intent
+        :param arguments: the order_id and customer_id
+        :return: the reply for the user
+        """
+        templates = config['router']['templates']
+        rows: List[Row] = getattr(get_order_repository(), function_name)(**arguments)
+        if not rows:
+            return templates['not_found'].format(**arguments)
+
+        if function_name == 'get_order_status':
+            status = (rows[0].order_status or 'unknown').replace('_', ' ')
+            return templates[function_name].format(status=status, **arguments)
+
+        if function_name == 'get_order_product_type':
+            categories = sorted({(row.product_category_name or 'unknown').replace('_', ' ') for row in rows})
+            return templates[function_name].format(categories=', '.join(categories), **arguments)
+
+        payment_types = sorted({row.payment_type or 'unknown' for row in rows})
+        refunds = [templates['refunds'].get(payment_type, templates['refunds']['cash']) for payment_type in payment_types]
+        return templates[function_name].format(
+            payment_types=', '.join(payment_type.replace('_', ' ') for payment_type in payment_types),
+            payment_value=f'{sum(row.payment_value or 0 for row in rows):.2f}',
+            refund=' '.join(refunds),
+            **arguments
+        )
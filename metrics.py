@@ -0,0 +1,181 @@
+"""
+the counters and histograms of the chatbot, rendered in the prometheus text format by the /metrics route
+the values are kept per process
+"""
+import bisect
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+with open('config.json') as f:
+    config = json.loads(f.read())
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ROW_BUCKETS = (0, 1, 2, 5, 10, 50, 100, 500)
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()) -> None:
+        """
+        :param name: the name of the metric
+        :param description: the help text of the metric
+        :param label_names: the names of the labels every value has
+        """
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def get_label_values(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def format_labels(self, label_values: Tuple[str, ...], extra: Dict[str, str] = None) -> str:
+        pairs = list(zip(self.label_names, label_values)) + list((extra or {}).items())
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()) -> None:
+        super().__init__(name, description, label_names)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, value: float = 1, **labels: str) -> None:
+        key = self.get_label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def get(self, **labels: str) -> float:
+        return self.values.get(self.get_label_values(labels), 0)
+
+    def render(self) -> List[str]:
+        with self.lock:
+            values = dict(self.values)
+        return super().render() + [f'{self.name}{self.format_labels(key)} {value}' for key, value in values.items()]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels: str) -> None:
+        with self.lock:
+            self.values[self.get_label_values(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(buckets)
+        self.values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self.get_label_values(labels)
+        with self.lock:
+            # the counts of every bucket, then the sum and the count of the values
+            counts = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """
+        will observe the seconds the block takes
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        with self.lock:
+            values = {key: list(counts) for key, counts in self.values.items()}
+
+        lines = super().render()
+        for key, counts in values.items():
+            cumulative = 0
+            for bucket, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{self.format_labels(key, {"le": str(bucket)})} {cumulative}')
+            lines.append(f'{self.name}_bucket{self.format_labels(key, {"le": "+Inf"})} {counts[-1]}')
+            lines.append(f'{self.name}_sum{self.format_labels(key)} {counts[-2]}')
+            lines.append(f'{self.name}_count{self.format_labels(key)} {counts[-1]}')
+        return lines
+
+
+registry: List[Metric] = []
+
+
+def render_metrics() -> str:
+    """
+    :return: every metric in the prometheus text format
+    """
+    return '\n'.join(line for metric in registry for line in metric.render()) + '\n'
+
+
+def record_request(route: str, session_id: str, seconds: float, stats: Dict[str, Any]) -> None:
+    """
+    will record the latency of a chat request and log it as one json line if json_logs is on in the config file
+    :param route: the route of the request
+    :param session_id: the session of the request
+    :param seconds: how long the request took
+    :param stats: the stats of the chatbot that answered the request
+    :return: none
+    """
+    REQUEST_LATENCY.observe(seconds, route=route)
+    if config['metrics']['json_logs']:
+        logger.info(json.dumps({'route': route, 'session_id': session_id, 'seconds': round(seconds, 6), **stats}))
+
+
+REQUEST_LATENCY = Histogram(
+    'chatbot_request_seconds', 'latency of the chat routes', ['route'])
+LLM_LATENCY = Histogram(
+    'chatbot_llm_request_seconds', 'latency of the openai chat completions', ['stage', 'source'])
+LLM_TOKENS = Counter(
+    'chatbot_llm_tokens_total', 'tokens used by the openai chat completions', ['kind'])
+TIME_TO_FIRST_TOKEN = Histogram(
+    'chatbot_time_to_first_token_seconds', 'time to the first token of a streamed response')
+TOOL_LATENCY = Histogram(
+    'chatbot_tool_call_seconds', 'latency of a tool call', ['function'])
+TOOL_ROUND_LATENCY = Histogram(
+    'chatbot_tool_calls_seconds', 'latency of all the tool calls of one assistant message')
+AGENT_STEP_LATENCY = Histogram(
+    'chatbot_agent_step_seconds', 'latency of a step of the agent loop, its completion and its tool calls', ['step'])
+AGENT_EVENTS = Counter(
+    'chatbot_agent_events_total', 'turns the agent loop stopped offering the tools in, by the limit it hit', ['event'])
+DB_LATENCY = Histogram(
+    'chatbot_db_query_seconds', 'latency of the order queries', ['query'])
+DB_ROWS = Histogram(
+    'chatbot_db_rows', 'rows returned by the order queries', ['query'], buckets=ROW_BUCKETS)
+ORDER_INDEX_EVENTS = Counter(
+    'chatbot_order_index_events_total', 'order index lookups by result and loads of the index', ['event'])
+CACHE_EVENTS = Counter(
+    'chatbot_cache_events_total', 'completion cache lookups by result', ['result'])
+ROUTER_EVENTS = Counter(
+    'chatbot_router_events_total', 'messages answered by the intent router or the llm', ['result'])
+SCHEDULER_QUEUE_DEPTH = Gauge(
+    'chatbot_scheduler_queue_depth', 'openai requests waiting for their turn', ['priority'])
+SCHEDULER_WAIT = Histogram(
+    'chatbot_scheduler_wait_seconds', 'time an openai request waited for its turn', ['priority'])
+SCHEDULER_EVENTS = Counter(
+    'chatbot_scheduler_events_total', 'openai requests that were coalesced, retried or rate limited', ['event'])
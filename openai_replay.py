@@ -0,0 +1,130 @@
+"""
+record and replay of openai chat completions, so the tests can run without the openai api
+the mode comes from the OPENAI_REPLAY environment variable:
+    record: every completion is requested from openai and saved as a cassette file
+    replay: completions are read from the cassettes, a request without a cassette goes to the client,
+            which the tests point at the local fake openai server
+    off or unset: the client is used as is
+"""
+import json
+import os
+from typing import Any, Dict, Optional
+from openai.types.chat import ChatCompletion
+from completion_cache import get_cache_key
+
+with open('config.json') as f:
+    config = json.loads(f.read())
+
+MODES = ('record', 'replay')
+
+
+def get_replay_mode() -> Optional[str]:
+    mode = os.environ.get('OPENAI_REPLAY', 'off')
+    return mode if mode in MODES else None
+
+
+def get_cassette_path(args: Dict[str, Any], cassette_dir: str) -> str:
+    """
+    :param args: the arguments of the chat completion request
+    :param cassette_dir: the folder of the cassettes
+    :return: the path of the cassette of the request
+    """
+    return os.path.join(cassette_dir, get_cache_key(args) + '.json')
+
+
+def load_cassette(args: Dict[str, Any], cassette_dir: str) -> Optional[ChatCompletion]:
+    """
+    :param args: the arguments of the chat completion request
+    :param cassette_dir: the folder of the cassettes
+    :return: the recorded completion or None if the request wasn't recorded
+    """
+    path = get_cassette_path(args, cassette_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return ChatCompletion.model_validate(json.loads(f.read())['response'])
+
+
+def save_cassette(args: Dict[str, Any], completion: ChatCompletion, cassette_dir: str) -> None:
+    """
+    will save the completion with the last message of the request, so a cassette can be read to see what it is for
+    :param args: the arguments of the chat completion request
+    :param completion: the completion to save
+    :param cassette_dir: the folder of the cassettes
+    :return: none
+    """
+    os.makedirs(cassette_dir, exist_ok=True)
+    path = get_cassette_path(args, cassette_dir)
+    last_message = args['messages'][-1]
+    cassette = {
+        'request': {
+            'model': args['model'],
+            'last_message': last_message if isinstance(last_message, dict) else last_message.model_dump(),
+        },
+        'response': completion.model_dump(),
+    }
+
+    # written to a temporary file first so a test running in parallel never reads half a cassette
+    with open(path + '.tmp', 'w') as f:
+        f.write(json.dumps(cassette, indent=2))
+    os.replace(path + '.tmp', path)
+
+
+class ReplayCompletions:
+    def __init__(self, completions, mode: str, cassette_dir: str) -> None:
+        """
+        wraps client.chat.completions of an openai client
+        :param completions: the completions resource of the wrapped client
+        :param mode: record or replay
+        :param cassette_dir: the folder of the cassettes
+        """
+        self.completions = completions
+        self.mode = mode
+        self.cassette_dir = cassette_dir
+
+    def create(self, **args) -> ChatCompletion:
+        # streamed completions aren't recorded
+        if args.get('stream'):
+            return self.completions.create(**args)
+
+        if self.mode == 'replay':
+            completion = load_cassette(args, self.cassette_dir)
+            if completion is not None:
+                return completion
+
+        completion = self.completions.create(**args)
+        if self.mode == 'record':
+            save_cassette(args, completion, self.cassette_dir)
+        return completion
+
+
+class ReplayChat:
+    def __init__(self, completions: ReplayCompletions) -> None:
+        self.completions = completions
+
+
+class ReplayClient:
+    def __init__(self, client, mode: str, cassette_dir: str) -> None:
+        """
+        an openai client whose chat completions are recorded or replayed, everything else goes to the wrapped client
+        :param client: the openai client to wrap
+        :param mode: record or replay
+        :param cassette_dir: the folder of the cassettes
+        """
+        self.client = client
+        self.chat = ReplayChat(ReplayCompletions(client.chat.completions, mode, cassette_dir))
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
+
+
+def wrap_client(client):
+    """
+    will wrap the client for recording or replaying if the OPENAI_REPLAY environment variable asks for it
+    :param client: the openai client
+    :return: the wrapped client or the same client
+    """
+    mode = get_replay_mode()
+    if mode is None:
+        return client
+    return ReplayClient(client, mode, config['replay']['cassette_dir'])
@@ -0,0 +1,263 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import Engine
+from metrics import ORDER_INDEX_EVENTS
+from order_repository import OrderRepository, get_engine
+
+with open('config.json') as f:
+    config = json.loads(f.read())
+
+logger = logging.getLogger(__name__)
+
+# a full scan of both tables, the rows of an order come in rowid order like the lookups by order_id and customer_id
+ORDERS_SCAN_QUERY = "SELECT order_id, customer_id, order_status, payment_type, payment_value FROM orders;"
+
+ORDER_ITEMS_SCAN_QUERY = "SELECT order_id, product_category_name FROM order_items ORDER BY order_id, order_item_id;"
+
+# the lookups of one order the index answers
+LOOKUPS = ['get_order_status', 'get_order_product_type', 'get_refund_policy']
+
+# the rows have the columns of the queries they replace, so the tool results serialize them the same way
+OrderStatusRow = namedtuple('OrderStatusRow', ['order_status'])
+ProductTypeRow = namedtuple('ProductTypeRow', ['product_category_name'])
+RefundPolicyRow = namedtuple('RefundPolicyRow', ['payment_type', 'payment_value'])
+
+_index: Optional['OrderIndex'] = None
+_lock = threading.Lock()
+
+
+class OrderRecord:
+    # one record per order, the statuses, payment types and categories are tuples shared by every order that has them
+    __slots__ = ('statuses', 'payment_types', 'payment_values', 'categories')
+
+    def __init__(self) -> None:
+        self.statuses: tuple = ()
+        self.payment_types: tuple = ()
+        self.payment_values: tuple = ()
+        self.categories: tuple = ()
+
+
+def get_file_version(path: Optional[str]) -> Optional[tuple]:
+    """
+    a sync writes to the wal file until sqlite checkpoints it into the database file, so both are checked
+    :param path: the database file
+    :return: the modification time and size of the database and its wal file, None when it isn't a file
+    """
+    if path is None:
+        return None
+    version = []
+    for name in (path, path + '-wal'):
+        try:
+            stat = os.stat(name)
+        except FileNotFoundError:
+            continue
+        version.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(version)
+
+
+class OrderIndex:
+    def __init__(self, refresh_seconds: float, engine: Optional[Engine] = None) -> None:
+        """
+        the orders and their items held in memory, keyed by order_id and customer_id,
+        so the lookups of one order don't go through sqlite
+        it is loaded again in the background when the database file changes, the lookups keep using
+        the old records until the new ones are ready
+        :param refresh_seconds: how often a lookup checks the database file for changes
+        :param engine: the engine to read the orders with, defaults to the shared process engine
+        """
+        self.engine = engine
+        self.refresh_seconds = refresh_seconds
+        self.records: Optional[Dict[Tuple[str, str], OrderRecord]] = None
+        self.version: Optional[tuple] = None
+        self.checked_at = 0.0
+        self.loading = False
+        self.lock = threading.Lock()
+
+    def get_engine(self) -> Engine:
+        # the shared engine is looked up on every load, a forked worker replaces it
+        return self.engine or get_engine()
+
+    def get_path(self) -> Optional[str]:
+        url = self.get_engine().url
+        if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+            return None
+        return url.database
+
+    def read(self) -> Dict[Tuple[str, str], OrderRecord]:
+        """
+        will read both tables into records, the categorical values and the tuples made of them are interned
+        so the hundred thousand orders share a few hundred of them
+        :return: the record of every order_id and customer_id
+        """
+        interned: Dict[tuple, tuple] = {}
+
+        def intern(values: list) -> tuple:
+            values = tuple(values)
+            shared = interned.get(values)
+            if shared is None:
+                shared = interned[values] = tuple(sys.intern(value) if isinstance(value, str) else value
+                                                  for value in values)
+            return shared
+
+        orders: Dict[Tuple[str, str], list] = {}
+        keys_by_order: Dict[str, List[Tuple[str, str]]] = {}
+        with self.get_engine().connect() as conn:
+            # the rows are read with the driver cursor, building a sqlalchemy row for each of them doubles the load time
+            cursor = conn.connection.cursor()
+            for order_id, customer_id, order_status, payment_type, payment_value in cursor.execute(ORDERS_SCAN_QUERY):
+                key = (order_id, customer_id)
+                rows = orders.get(key)
+                if rows is None:
+                    rows = orders[key] = [[], [], [], []]
+                    keys_by_order.setdefault(order_id, []).append(key)
+                if order_status not in rows[0]:
+                    rows[0].append(order_status)
+                rows[1].append(payment_type)
+                rows[2].append(payment_value)
+
+            # the product query joins the items with the orders, so an order has them under every customer_id it has
+            for order_id, category in cursor.execute(ORDER_ITEMS_SCAN_QUERY):
+                for key in keys_by_order.get(order_id, ()):
+                    categories = orders[key][3]
+                    if category not in categories:
+                        categories.append(category)
+            cursor.close()
+
+        records = {}
+        for key, (statuses, payment_types, payment_values, categories) in orders.items():
+            record = OrderRecord()
+            record.statuses = intern(statuses)
+            record.payment_types = intern(payment_types)
+            record.payment_values = tuple(payment_values)
+            record.categories = intern(categories)
+            records[key] = record
+        return records
+
+    def load(self) -> None:
+        """
+        will read the records and swap them in, the version is taken first so a write during the read
+        is picked up by the next refresh
+        :return: none
+        """
+        start = time.perf_counter()
+        version = get_file_version(self.get_path())
+        records = self.read()
+        self.records, self.version, self.checked_at = records, version, time.monotonic()
+        ORDER_INDEX_EVENTS.inc(event='load')
+        logger.info('loaded %d orders into the order index in %.3fs', len(records), time.perf_counter() - start)
+
+    def reload(self) -> None:
+        try:
+            self.load()
+        except Exception:
+            logger.exception('failed to reload the order index, the old records are kept')
+        finally:
+            self.loading = False
+
+    def refresh(self) -> None:
+        """
+        will start a reload in the background when the database file changed since the records were read,
+        the file is checked at most once every refresh_seconds
+        :return: none
+        """
+        now = time.monotonic()
+        if now - self.checked_at < self.refresh_seconds:
+            return
+        with self.lock:
+            if self.loading or now - self.checked_at < self.refresh_seconds:
+                return
+            self.checked_at = now
+            if get_file_version(self.get_path()) == self.version:
+                return
+            self.loading = True
+        threading.Thread(target=self.reload, name='order-index', daemon=True).start()
+
+    def get_record(self, order_id: str, customer_id: str) -> Optional[OrderRecord]:
+        """
+        :param order_id: the id of the order
+        :param customer_id: the id of the customer
+        :return: the record of the order, None when it isn't in the index and the database has to be asked
+        """
+        self.refresh()
+        record = self.records.get((order_id, customer_id))
+        ORDER_INDEX_EVENTS.inc(event='hit' if record is not None else 'miss')
+        return record
+
+    def get_order_status(self, order_id: str, customer_id: str) -> Optional[List[OrderStatusRow]]:
+        record = self.get_record(order_id, customer_id)
+        return None if record is None else [OrderStatusRow(status) for status in record.statuses]
+
+    def get_order_product_type(self, order_id: str, customer_id: str) -> Optional[List[ProductTypeRow]]:
+        record = self.get_record(order_id, customer_id)
+        return None if record is None else [ProductTypeRow(category) for category in record.categories]
+
+    def get_refund_policy(self, order_id: str, customer_id: str) -> Optional[List[RefundPolicyRow]]:
+        record = self.get_record(order_id, customer_id)
+        if record is None:
+            return None
+        return [RefundPolicyRow(payment_type, payment_value)
+                for payment_type, payment_value in zip(record.payment_types, record.payment_values)]
+
+
+class IndexedOrderRepository(OrderRepository):
+    def __init__(self, index: OrderIndex, engine: Optional[Engine] = None) -> None:
+        """
+        the repository answers the lookups of one order from the order index and reads through to the database
+        for the orders that aren't in it, an order added since the last load is found by its query
+        :param index: the loaded order index
+        :param engine: the engine to run the queries on, defaults to the shared process engine
+        """
+        super().__init__(engine)
+        self.index = index
+
+    def get_order_status(self, order_id: str, customer_id: str) -> list:
+        rows = self.index.get_order_status(order_id, customer_id)
+        return rows if rows is not None else super().get_order_status(order_id, customer_id)
+
+    def get_order_product_type(self, order_id: str, customer_id: str) -> list:
+        rows = self.index.get_order_product_type(order_id, customer_id)
+        return rows if rows is not None else super().get_order_product_type(order_id, customer_id)
+
+    def get_refund_policy(self, order_id: str, customer_id: str) -> list:
+        rows = self.index.get_refund_policy(order_id, customer_id)
+        return rows if rows is not None else super().get_refund_policy(order_id, customer_id)
+
+
+def _reset_after_fork() -> None:
+    """
+    a worker keeps the records loaded before the fork, they are shared with the parent until written,
+    but a reload that was running in the parent doesn't exist in the worker
+    :return: none
+    """
+    global _lock
+
+    _lock = threading.Lock()
+    if _index is not None:
+        _index.lock = threading.Lock()
+        _index.loading = False
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_order_index() -> OrderIndex:
+    """
+    will load the order index once per process, the warmup loads it before the first request
+    :return: the order index
+    """
+    global _index
+
+    if _index is None:
+        with _lock:
+            if _index is None:
+                index = OrderIndex(config['order_index']['refresh_seconds'])
+                index.load()
+                _index = index
+    return _index
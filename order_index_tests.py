@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from parameterized import parameterized
+from sqlalchemy import create_engine, text
+from order_index import LOOKUPS, IndexedOrderRepository, OrderIndex
+from order_repository import OrderRepository
+from tool_results import serialize_rows
+
+ORDERS = [
+    # order_id, customer_id, order_status, payment_sequential, payment_type, payment_value
+    ('order-1', 'customer-1', 'delivered', 1, 'credit_card', 99.9),
+    ('order-2', 'customer-1', 'shipped', 2, 'voucher', 10.0),
+    ('order-2', 'customer-1', 'shipped', 1, 'credit_card', 45.5),
+    ('order-2', 'customer-1', 'shipped', 3, 'voucher', 10.0),
+    ('order-3', 'customer-2', 'canceled', 1, 'credit_card', 12.0),
+]
+
+ORDER_ITEMS = [
+    # order_id, order_item_id, product_category_name
+    ('order-1', 1, 'furniture_decor'),
+    ('order-2', 2, 'perfumery'),
+    ('order-2', 1, 'bed_bath_table'),
+    ('order-2', 3, 'perfumery'),
+]
+
+
+class OrderIndexTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.directory, 'orders.db')}")
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE orders (order_id TEXT NOT NULL, customer_id TEXT NOT NULL, order_status TEXT, "
+                "payment_sequential INTEGER NOT NULL, payment_type TEXT, payment_value REAL, "
+                "PRIMARY KEY (order_id, payment_sequential));"))
+            conn.execute(text(
+                "CREATE TABLE order_items (order_id TEXT NOT NULL, order_item_id INTEGER NOT NULL, "
+                "product_category_name TEXT, PRIMARY KEY (order_id, order_item_id));"))
+            conn.execute(text("CREATE INDEX ix_orders_order_id_customer_id ON orders (order_id, customer_id);"))
+            conn.execute(text("INSERT INTO orders VALUES (:order_id, :customer_id, :status, :sequential, :type, "
+                              ":value);"),
+                         [dict(zip(['order_id', 'customer_id', 'status', 'sequential', 'type', 'value'], row))
+                          for row in ORDERS])
+            conn.execute(text("INSERT INTO order_items VALUES (:order_id, :item_id, :category);"),
+                         [dict(zip(['order_id', 'item_id', 'category'], row)) for row in ORDER_ITEMS])
+
+    def tearDown(self) -> None:
+        self.engine.dispose()
+        shutil.rmtree(self.directory)
+
+    def make_index(self, refresh_seconds: float = 60) -> OrderIndex:
+        index = OrderIndex(refresh_seconds, self.engine)
+        index.load()
+        return index
+
+    @parameterized.expand([(lookup,) for lookup in LOOKUPS])
+    def test_same_result_as_the_query(self, lookup: str) -> None:
+        """
+        the index answers every order the way the query does, once the tool results serialize the rows
+        :param lookup: the repository method to compare
+        :return: none
+        """
+        index = self.make_index()
+        repository = OrderRepository(self.engine)
+        for order_id, customer_id in [('order-1', 'customer-1'), ('order-2', 'customer-1'),
+                                      ('order-3', 'customer-2')]:
+            rows = getattr(index, lookup)(order_id, customer_id)
+            self.assertIsNotNone(rows)
+            # the tools drop the statuses and categories the joins repeat, but keep every payment
+            dedupe = lookup != 'get_refund_policy'
+            self.assertEqual(serialize_rows(rows, dedupe=dedupe),
+                             serialize_rows(getattr(repository, lookup)(order_id, customer_id), dedupe=dedupe))
+
+    def test_categorical_values_are_shared(self) -> None:
+        index = self.make_index()
+        first = index.records[('order-1', 'customer-1')]
+        second = index.records[('order-2', 'customer-1')]
+        self.assertIs(first.payment_types[0], second.payment_types[1])
+        self.assertIs(first.payment_types, index.records[('order-3', 'customer-2')].payment_types)
+
+    def test_read_through(self) -> None:
+        """
+        an order that isn't in the index is looked up in the database, a wrong customer_id finds nothing
+        :return: none
+        """
+        repository = IndexedOrderRepository(self.make_index(), self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(text("INSERT INTO orders VALUES ('order-4', 'customer-3', 'invoiced', 1, 'debit_card', 5.0);"))
+
+        self.assertEqual(serialize_rows(repository.get_order_status('order-4', 'customer-3')),
+                         '{"order_status":["invoiced"]}')
+        self.assertEqual(serialize_rows(repository.get_order_status('order-1', 'customer-2')), '{"rows":[]}')
+
+    def test_refresh_on_change(self) -> None:
+        """
+        a write to the database file loads the index again in the background
+        :return: none
+        """
+        index = self.make_index(refresh_seconds=0)
+        with self.engine.begin() as conn:
+            conn.execute(text("UPDATE orders SET order_status = 'delivered' WHERE order_id = 'order-2';"))
+
+        deadline = time.monotonic() + 5
+        while index.get_order_status('order-2', 'customer-1')[0].order_status != 'delivered':
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
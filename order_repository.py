@@ -0,0 +1,169 @@
+import json
+import os
+import threading
+from typing import List, Optional
+from sqlalchemy import create_engine, text, Engine, Row
+from metrics import DB_LATENCY, DB_ROWS
+
+with open('config.json') as f:
+    config = json.loads(f.read())
+
+
+# the statements are built once at import time and bound with parameters on every call,
+# so sqlalchemy can reuse the compiled sql and sqlite can reuse the prepared statement
+ORDER_STATUS_QUERY = text(
+    "SELECT order_status FROM orders "
+    "WHERE order_id = :order_id AND customer_id = :customer_id;"
+)
+
+ORDER_PRODUCT_TYPE_QUERY = text(
+    "SELECT product_category_name FROM order_items "
+    "INNER JOIN orders ON order_items.order_id = orders.order_id "
+    "WHERE order_items.order_id = :order_id AND orders.customer_id = :customer_id;"
+)
+
+REFUND_POLICY_QUERY = text(
+    "SELECT payment_type, payment_value FROM orders "
+    "WHERE order_id = :order_id AND customer_id = :customer_id;"
+)
+
+# one row per order of a customer with its product categories and payments as json arrays,
+# the customer_id index finds the payment rows of the orders and the order_items primary key finds their items
+CUSTOMER_ORDERS_QUERY = text(
+    "SELECT order_id, MAX(order_status) AS order_status, "
+    "MAX(order_purchase_timestamp) AS order_purchase_timestamp, "
+    "(SELECT json_group_array(DISTINCT product_category_name) FROM order_items "
+    "WHERE order_items.order_id = orders.order_id) AS product_categories, "
+    "json_group_array(json_array(payment_type, payment_value)) AS payments "
+    "FROM orders WHERE customer_id = :customer_id GROUP BY order_id "
+    "ORDER BY order_purchase_timestamp DESC, order_id LIMIT :limit OFFSET :offset;"
+)
+
+_engine: Optional[Engine] = None
+_repository: Optional['OrderRepository'] = None
+_lock = threading.RLock()
+
+
+def get_engine() -> Engine:
+    """
+    will create the engine for the database once per process and return the same engine on every call
+    the pool settings come from the database section in the config file
+    :return: the shared engine
+    """
+    global _engine
+
+    if _engine is None:
+        with _lock:
+            if _engine is None:
+                database_config = config['database']
+                _engine = create_engine(
+                    database_config['name'],
+                    pool_size=database_config['pool_size'],
+                    max_overflow=database_config['max_overflow'],
+                    pool_timeout=database_config['pool_timeout'],
+                    pool_recycle=database_config['pool_recycle'],
+                    pool_pre_ping=True
+                )
+    return _engine
+
+
+def _reset_after_fork() -> None:
+    """
+    a forked worker can't share the pooled connections of its parent,
+    so it drops them and builds its own engine on first use
+    :return: none
+    """
+    global _engine, _repository
+
+    if _engine is not None:
+        _engine.dispose(close=False)
+    _engine = None
+    _repository = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class OrderRepository:
+    def __init__(self, engine: Optional[Engine] = None) -> None:
+        """
+        the repository runs all the order lookups the chatbot functions need
+        :param engine: the engine to run the queries on, defaults to the shared process engine
+        """
+        self.engine = engine or get_engine()
+
+    def fetch_all(self, query_name: str, query, **params) -> List[Row]:
+        """
+        will run a prepared query with bound parameters on a pooled connection
+        and record its latency and the rows it returned
+        :param query_name: the name the query is recorded under in the metrics
+        :param query: one of the prepared queries of this module
+        :param params: the values to bind to the query
+        :return: all the rows the query returned
+        """
+        with DB_LATENCY.time(query=query_name):
+            with self.engine.connect() as conn:
+                rows = conn.execute(query, params).all()
+        DB_ROWS.observe(len(rows), query=query_name)
+        return rows
+
+    def get_order_status(self, order_id: str, customer_id: str) -> List[Row]:
+        """
+        will get the status of an order
+        :param order_id: the id of the order to check
+        :param customer_id: the id of the customer
+        :return: the rows of order_status
+        """
+        return self.fetch_all('get_order_status', ORDER_STATUS_QUERY, order_id=order_id, customer_id=customer_id)
+
+    def get_order_product_type(self, order_id: str, customer_id: str) -> List[Row]:
+        """
+        will get the product category of every item in an order
+        :param order_id: the id of the order to check
+        :param customer_id: the id of the customer
+        :return: the rows of product_category_name
+        """
+        return self.fetch_all('get_order_product_type', ORDER_PRODUCT_TYPE_QUERY, order_id=order_id, customer_id=customer_id)
+
+    def get_refund_policy(self, order_id: str, customer_id: str) -> List[Row]:
+        """
+        will get the payment type and value of an order
+        :param order_id: the id of the order to check
+        :param customer_id: the id of the customer
+        :return: the rows of payment_type and payment_value
+        """
+        return self.fetch_all('get_refund_policy', REFUND_POLICY_QUERY, order_id=order_id, customer_id=customer_id)
+
+    def get_customer_orders(self, customer_id: str, limit: int, offset: int) -> List[Row]:
+        """
+        will get every order of a customer with its status, product categories and payments in one query,
+        the newest orders first
+        :param customer_id: the id of the customer
+        :param limit: the most orders to return
+        :param offset: how many orders to skip
+        :return: the rows of order_id, order_status, order_purchase_timestamp,
+            product_categories and payments, the last two as json arrays
+        """
+        return self.fetch_all('get_customer_orders', CUSTOMER_ORDERS_QUERY,
+                              customer_id=customer_id, limit=limit, offset=offset)
+
+
+def get_order_repository() -> OrderRepository:
+    """
+    will get the repository shared by the whole process,
+    it answers the lookups of one order from the order index when it is enabled in the config file
+    :return: the order repository
+    """
+    global _repository
+
+    if _repository is None:
+        with _lock:
+            if _repository is None:
+                if config['order_index']['enabled']:
+                    # order_index builds on this module, so it is imported once it is needed
+                    from order_index import IndexedOrderRepository, get_order_index
+                    _repository = IndexedOrderRepository(get_order_index())
+                else:
+                    _repository = OrderRepository()
+    return _repository
@@ -0,0 +1,239 @@
+import csv
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+with open('config.json') as f:
+    config = json.loads(f.read())
+
+logger = logging.getLogger(__name__)
+
+TRANSLATION_CSV = 'dummy_data/raw_data/product_category_name_translation.csv'
+
+# the words a product name is asked with that say nothing about the product
+STOP_WORDS = {'a', 'an', 'the', 'my', 'this', 'that', 'it', 'is', 'of', 'and', 'for', 'some', 'item', 'items'}
+
+WORD_PATTERN = re.compile(r'[a-z]+')
+
+_index: Optional['PolicyIndex'] = None
+_lock = threading.Lock()
+
+
+def get_ngrams(text: str) -> Counter:
+    """
+    the character trigrams of every word, so plurals and spellings like tooth_brush and toothbrush still match,
+    and the whole words, so a word that only shares its letters with another one like table and vegetable doesn't
+    :param text: the text to split
+    :return: the count of every trigram and word
+    """
+    ngrams = Counter()
+    for word in WORD_PATTERN.findall(text.lower()):
+        if word in STOP_WORDS:
+            continue
+        padded = f' {word} '
+        ngrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+        ngrams[word] += 1
+    return ngrams
+
+
+def get_config_key() -> str:
+    """
+    the index is built from the return policy and the index sections of the config file,
+    so an index built before either changed is stale
+    :return: the hash of both sections
+    """
+    sections = json.dumps([config['prompts']['return_policy'], config['return_policy_index']], sort_keys=True)
+    return hashlib.sha1(sections.encode()).hexdigest()
+
+
+def get_documents() -> List[Dict]:
+    """
+    will make the documents of the index, every product category with its portuguese name,
+    every keyword of the classes that can't be returned and the policy clauses
+    :return: the documents with their text, kind, name and verdict
+    """
+    index_config = config['return_policy_index']
+    non_returnable = {category: name for name, policy_class in index_config['non_returnable'].items()
+                      for category in policy_class['categories']}
+
+    with open(TRANSLATION_CSV, newline='', encoding='utf-8-sig') as file:
+        translations = list(csv.reader(file))[1:]
+
+    documents = []
+    for portuguese, english in translations:
+        # the english and the portuguese name are documents of their own, a short document matches a short query better
+        for name in (english, portuguese):
+            documents.append({
+                'kind': 'category', 'name': english, 'text': name.replace('_', ' '),
+                'verdict': 'non_returnable' if english in non_returnable else 'returnable',
+                'class': non_returnable.get(english),
+            })
+    for name, policy_class in index_config['non_returnable'].items():
+        for keyword in policy_class['keywords']:
+            documents.append({'kind': 'keyword', 'name': keyword, 'text': keyword,
+                              'verdict': 'non_returnable', 'class': name})
+    for clause in index_config['clauses']:
+        documents.append({'kind': 'clause', 'name': clause, 'text': config['prompts']['return_policy'][clause],
+                          'verdict': None, 'class': None})
+    return documents
+
+
+class PolicyIndex:
+    def __init__(self, documents: List[Dict], idf: Dict[str, float], key: str) -> None:
+        """
+        a tf-idf index of character trigrams and words over the product categories, the keywords of the items
+        that can't be returned and the return policy clauses, small enough to search in microseconds
+        :param documents: the documents with their normalized trigram weights in vector
+        :param idf: the inverse document frequency of every trigram
+        :param key: the hash of the config sections the index was built from
+        """
+        self.documents = documents
+        self.idf = idf
+        self.key = key
+
+        # the postings of every trigram, so a search only touches the documents that share a trigram with the query
+        self.postings: Dict[str, List[Tuple[int, float]]] = {}
+        for i, document in enumerate(documents):
+            for ngram, weight in document['vector'].items():
+                self.postings.setdefault(ngram, []).append((i, weight))
+
+    @staticmethod
+    def build() -> 'PolicyIndex':
+        """
+        will build the index from the translation csv and the config file
+        :return: the index
+        """
+        documents = get_documents()
+        counts = [get_ngrams(document['text']) for document in documents]
+        document_frequency = Counter(ngram for ngrams in counts for ngram in ngrams)
+        idf = {ngram: math.log((1 + len(documents)) / (1 + frequency)) + 1
+               for ngram, frequency in document_frequency.items()}
+        for document, ngrams in zip(documents, counts):
+            document['vector'] = PolicyIndex.get_vector(ngrams, idf)
+        return PolicyIndex(documents, idf, get_config_key())
+
+    @staticmethod
+    def get_vector(ngrams: Counter, idf: Dict[str, float]) -> Dict[str, float]:
+        """
+        :param ngrams: the trigram counts of a text
+        :param idf: the inverse document frequency of every trigram, the unknown ones are dropped
+        :return: the l2 normalized tf-idf weights
+        """
+        weights = {ngram: count * idf[ngram] for ngram, count in ngrams.items() if ngram in idf}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        return {ngram: weight / norm for ngram, weight in weights.items()} if norm else {}
+
+    def save(self, path: str) -> None:
+        """
+        will write the index as json next to the database, the file is replaced in one rename
+        :param path: the file to write
+        :return: none
+        """
+        with open(path + '.tmp', 'w') as f:
+            f.write(json.dumps({'key': self.key, 'idf': self.idf, 'documents': self.documents},
+                               separators=(',', ':')))
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def load(path: str) -> 'PolicyIndex':
+        with open(path) as f:
+            index = json.loads(f.read())
+        return PolicyIndex(index['documents'], index['idf'], index['key'])
+
+    def search(self, text: str, kinds: Tuple[str, ...] = ('category', 'keyword'),
+               limit: int = 3) -> List[Tuple[float, Dict]]:
+        """
+        :param text: the text to look up
+        :param kinds: the kinds of documents to return
+        :param limit: the most documents to return
+        :return: the best documents with their cosine similarity, best first
+        """
+        scores: Dict[int, float] = {}
+        for ngram, weight in self.get_vector(get_ngrams(text), self.idf).items():
+            for i, document_weight in self.postings.get(ngram, ()):
+                scores[i] = scores.get(i, 0.0) + weight * document_weight
+        matches = sorted(((score, self.documents[i]) for i, score in scores.items()
+                          if self.documents[i]['kind'] in kinds), key=lambda match: match[0], reverse=True)
+        return matches[:limit]
+
+    def check(self, product: str) -> Dict:
+        """
+        will decide if a product can be returned from the closest category or keyword
+        a keyword matches every product name that has the word in it, like cheese in cheese grater,
+        so a keyword needs a much higher score than a category
+        :param product: the name or type of the product the user asks about
+        :return: the verdict, the match it is based on, if it is confident enough to answer without the llm
+            and the policy clauses that apply, the verdict is unknown and every clause is given
+            when nothing is close enough
+        """
+        index_config = config['return_policy_index']
+        policy = config['prompts']['return_policy']
+        min_scores = {'category': index_config['min_score'], 'keyword': index_config['min_keyword_score']}
+        matches = [(score, document) for score, document in self.search(product, limit=10)
+                   if score >= min_scores[document['kind']]]
+        if not matches:
+            return {'product': product, 'verdict': 'unknown',
+                    'policy': [policy[clause] for clause in index_config['clauses']]}
+
+        score, document = matches[0]
+        if document['verdict'] == 'non_returnable':
+            clauses = index_config['non_returnable'][document['class']]['clauses']
+        else:
+            clauses = index_config['returnable_clauses']
+        # only a product that is a category of the catalog is answered without the llm
+        confident = document['kind'] == 'category' and score >= index_config['min_local_reply_score']
+        result = {'product': product, 'verdict': document['verdict'], 'match': document['name'],
+                  'score': round(score, 3), 'confident': confident, 'policy': [policy[clause] for clause in clauses]}
+        if document['class'] is not None:
+            result['class'] = document['class']
+        return result
+
+
+def render_verdict(result: Dict) -> Optional[str]:
+    """
+    will write the reply to a return question from a check of the index
+    :param result: the result of PolicyIndex.check
+    :return: the reply or None when the verdict is unknown or not confident and the llm has to answer
+    """
+    template = config['return_policy_index']['templates'].get(result['verdict'])
+    if template is None or not result.get('confident'):
+        return None
+    return template.format(product=result['product'].replace('_', ' '), policy_class=result.get('class'),
+                           policy=' '.join(clause.strip() for clause in result['policy']))
+
+
+def build_policy_index() -> PolicyIndex:
+    """
+    will build the index and save it where the config file says, setup_db runs it with the database
+    :return: the index
+    """
+    index = PolicyIndex.build()
+    index.save(config['return_policy_index']['path'])
+    return index
+
+
+def get_policy_index() -> PolicyIndex:
+    """
+    will load the index saved by setup_db once per process,
+    a missing or stale index is built in memory until setup_db saves a new one
+    :return: the index
+    """
+    global _index
+
+    if _index is None:
+        with _lock:
+            if _index is None:
+                path = config['return_policy_index']['path']
+                index = PolicyIndex.load(path) if os.path.exists(path) else None
+                if index is None or index.key != get_config_key():
+                    logger.warning('the return policy index at %s is missing or stale, run setup_db.py to save it',
+                                   path)
+                    index = PolicyIndex.build()
+                _index = index
+    return _index
@@ -0,0 +1,84 @@
+import json
+import unittest
+from parameterized import parameterized
+from chatbot import Chatbot
+from policy_index import PolicyIndex, render_verdict
+
+
+class PolicyIndexTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.index = PolicyIndex.build()
+
+    @parameterized.expand([
+        ('diapers', 'non_returnable', 'personal care items'),
+        ('diapers_and_hygiene', 'non_returnable', 'personal care items'),
+        ('tooth_brush', 'non_returnable', 'personal care items'),
+        # table shares most of its trigrams with vegetable, the whole word has to decide
+        ('table', 'returnable', None),
+        # a keyword in a longer product name doesn't decide it, the llm gets every clause
+        ('cheese grater', 'unknown', None),
+        ('plant pot', 'unknown', None),
+        ('toothbrush', 'unknown', None),
+    ])
+    def test_check(self, product: str, verdict: str, policy_class: str) -> None:
+        result = self.index.check(product)
+        self.assertEqual(result['verdict'], verdict)
+        self.assertEqual(result.get('class'), policy_class)
+        self.assertNotIn('vegetable', result.get('match', ''))
+        self.assertTrue(result['policy'])
+
+    @parameterized.expand([
+        ('diapers_and_hygiene', True),
+        ('bed_bath_table', True),
+        ('furniture decor', True),
+        ('diapers', False),
+        ('tooth_brush', False),
+        # food is a category, but food processor is only close to it
+        ('food processor', False),
+        ('cheese grater', False),
+    ])
+    def test_local_reply_only_when_confident(self, product: str, confident: bool) -> None:
+        """
+        only a product that is a category of the catalog is answered without the llm
+        :param product: the product the user asks about
+        :param confident: if the check is answered locally
+        :return: none
+        """
+        result = self.index.check(product)
+        self.assertEqual(bool(result.get('confident')), confident)
+        self.assertEqual(render_verdict(result) is not None, confident)
+        reply = Chatbot.get_local_reply([LocalReplyTest.get_message(json.dumps(result))])
+        self.assertEqual(reply is not None, confident)
+
+    def test_unknown(self) -> None:
+        self.assertEqual(self.index.check('xyzzy')['verdict'], 'unknown')
+
+
+class LocalReplyTest(unittest.TestCase):
+    @staticmethod
+    def get_message(content: str) -> dict:
+        return {'tool_call_id': 'call_1', 'role': 'tool', 'name': 'check_return_policy', 'content': content}
+
+    def test_verdict(self) -> None:
+        result = PolicyIndex.build().check('diapers_and_hygiene')
+        reply = Chatbot.get_local_reply([self.get_message(json.dumps(result))])
+        self.assertIsNotNone(reply)
+        self.assertIn('diapers and hygiene', reply)
+
+    @parameterized.expand([
+        ('the function timed out, please try again later',),
+        ('["not", "a", "verdict"]',),
+        ('{"error": "no product"}',),
+    ])
+    def test_no_verdict(self, content: str) -> None:
+        """
+        a tool result that isn't a verdict, like the message of a timed out call, is left to the llm
+        :param content: the content of the tool message
+        :return: none
+        """
+        self.assertIsNone(Chatbot.get_local_reply([self.get_message(content)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import asyncio
+import threading
+import time
+import unittest
+from typing import List
+from unittest import mock
+import httpx
+import openai
+import completion_scheduler
+from completion_scheduler import CompletionScheduler, FOLLOW_UP, NEW_TURN
+
+ARGS = {'model': 'gpt-4-turbo', 'temperature': 0, 'messages': [{'role': 'user', 'content': 'hi'}]}
+
+
+def make_scheduler(requests_per_minute: float = 6000, tokens_per_minute: float = 10 ** 7) -> CompletionScheduler:
+    return CompletionScheduler(requests_per_minute, tokens_per_minute, max_retries=3, backoff_seconds=0.01,
+                               max_backoff_seconds=0.05, coalesce=True)
+
+
+def get_rate_limit_error(retry_after_ms: int) -> openai.RateLimitError:
+    request = httpx.Request('POST', 'http://127.0.0.1/v1/chat/completions')
+    response = httpx.Response(429, headers={'retry-after-ms': str(retry_after_ms)}, request=request)
+    return openai.RateLimitError('rate limited', response=response, body=None)
+
+
+class CompletionSchedulerTest(unittest.TestCase):
+    def test_follow_ups_go_first(self) -> None:
+        """
+        when the requests a minute are used up, the follow up turns that come later still go before the new turns
+        :return: none
+        """
+        scheduler = make_scheduler(requests_per_minute=1200)
+        scheduler.requests.available = 0
+        order: List[str] = []
+
+        def request(name: str, priority: int) -> None:
+            scheduler.acquire(priority, 1)
+            order.append(name)
+
+        threads = [threading.Thread(target=request, args=(f'new {i}', NEW_TURN)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        while len(scheduler.queue) < 4:
+            time.sleep(0.001)
+        follow_ups = [threading.Thread(target=request, args=(f'follow up {i}', FOLLOW_UP)) for i in range(3)]
+        for thread in follow_ups:
+            thread.start()
+        for thread in threads + follow_ups:
+            thread.join()
+
+        # the first new turn can be on its way out when the follow ups come
+        self.assertEqual(order[1:4] if order[0].startswith('new') else order[:3],
+                         ['follow up 0', 'follow up 1', 'follow up 2'])
+
+    def test_token_limit(self) -> None:
+        """
+        a request waits until the bucket has refilled enough tokens for it
+        :return: none
+        """
+        scheduler = make_scheduler(tokens_per_minute=60000)
+        scheduler.tokens.available = 0
+        start = time.perf_counter()
+        scheduler.acquire(NEW_TURN, 200)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.15)
+        self.assertLess(time.perf_counter() - start, 1.0)
+
+    def test_coalescing(self) -> None:
+        """
+        identical requests in flight at the same time are sent once and share the response
+        :return: none
+        """
+        scheduler = make_scheduler()
+        calls = []
+
+        def create() -> str:
+            calls.append(1)
+            time.sleep(0.2)
+            return 'response'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(scheduler.run(ARGS, NEW_TURN, create)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [('response', False)] + [('response', True)] * 4)
+        self.assertEqual(scheduler.in_flight, {})
+
+    def test_async_coalescing(self) -> None:
+        scheduler = make_scheduler()
+        calls = []
+
+        async def create() -> str:
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return 'response'
+
+        async def run() -> list:
+            return await asyncio.gather(*(scheduler.run_async(ARGS, NEW_TURN, create) for _ in range(3)))
+
+        results = asyncio.run(run())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([response for response, _ in results], ['response'] * 3)
+
+    def test_retry_after(self) -> None:
+        """
+        a rate limit is retried after the time the response asked for and the requests after it wait too
+        :return: none
+        """
+        scheduler = make_scheduler()
+        errors = [get_rate_limit_error(300)]
+
+        def create() -> str:
+            if errors:
+                raise errors.pop()
+            return 'response'
+
+        start = time.perf_counter()
+        self.assertEqual(scheduler.run(ARGS, NEW_TURN, create), ('response', False))
+        self.assertGreaterEqual(time.perf_counter() - start, 0.3)
+        self.assertGreater(scheduler.blocked_until, 0)
+
+    def test_retries_run_out(self) -> None:
+        scheduler = make_scheduler()
+
+        def create() -> str:
+            raise get_rate_limit_error(1)
+
+        with self.assertRaises(openai.RateLimitError):
+            scheduler.run(ARGS, NEW_TURN, create)
+        self.assertEqual(scheduler.in_flight, {})
+
+    def test_limits_split_across_workers(self) -> None:
+        """
+        every worker process enforces its share of the rate limits of the account
+        :return: none
+        """
+        scheduler_config = completion_scheduler.config['scheduler']
+        with mock.patch.dict('os.environ', {'CHATBOT_WORKERS': '4'}), \
+                mock.patch.object(completion_scheduler, '_scheduler', None):
+            scheduler = completion_scheduler.get_scheduler()
+        self.assertEqual(scheduler.requests.capacity, scheduler_config['requests_per_minute'] / 4)
+        self.assertEqual(scheduler.tokens.capacity, scheduler_config['tokens_per_minute'] / 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+the production entry point, it runs the app with several worker processes
+the flask app runs on gunicorn with gunicorn.conf.py, the async app on a hypercorn process for every worker
+the defaults come from the server section in the config file
+run it from the project root with: python serve.py --workers 4
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+
+with open('config.json') as f:
+    config = json.loads(f.read())
+
+
+def get_gunicorn_command(args: argparse.Namespace) -> list:
+    """
+    will build the command line of gunicorn for the flask app
+    :param args: the parsed arguments of serve.py
+    :return: the arguments of the server process
+    """
+    command = [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py',
+               '--bind', args.bind, '--workers', str(args.workers)]
+    if args.threads is not None:
+        command += ['--threads', str(args.threads)]
+    return command + ['app:app']
+
+
+def serve_asgi(args: argparse.Namespace) -> int:
+    """
+    will serve the async app with a hypercorn process for every worker on one shared socket
+    hypercorn stops all of its workers as soon as one of them exits, so with its own workers an idle worker
+    that shuts down first kills the busy ones, here every worker shuts down gracefully on its own
+    hypercorn has no preload, every worker warms up before it starts serving
+    :param args: the parsed arguments of serve.py
+    :return: the exit code
+    """
+    host, port = args.bind.rsplit(':', 1)
+    sock = socket.create_server((host, int(port)), backlog=2048)
+    command = [sys.executable, '-m', 'hypercorn', '--bind', f'fd://{sock.fileno()}', '--workers', '0',
+               '--graceful-timeout', str(config['server']['graceful_timeout']), 'asgi_app:app']
+    # the workers split the openai rate limits of the scheduler section between them
+    env = {**os.environ, 'CHATBOT_WORKERS': str(args.workers)}
+    workers = [subprocess.Popen(command, pass_fds=[sock.fileno()], env=env) for _ in range(args.workers)]
+
+    def stop(signum, _) -> None:
+        for worker in workers:
+            worker.send_signal(signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    return max(worker.wait() for worker in workers)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--bind', default=config['server']['bind'])
+    parser.add_argument('--workers', type=int, default=config['server']['workers'])
+    parser.add_argument('--threads', type=int, default=None, help='the threads of every gunicorn worker')
+    parser.add_argument('--asgi', action='store_true', help='serve asgi_app.py with hypercorn')
+    args = parser.parse_args()
+
+    if args.workers > 1 and config['sessions']['backend'] == 'memory':
+        # every worker would have its own sessions and a conversation would be lost when another worker gets a turn
+        sys.exit('the memory sessions backend only works with one worker, use the sqlite or log backend')
+
+    # on SIGTERM the server stops accepting requests and the workers finish theirs within the graceful timeout
+    if args.asgi:
+        sys.exit(serve_asgi(args))
+    # gunicorn replaces this process so it gets the signals of the process manager directly
+    command = get_gunicorn_command(args)
+    os.execv(command[0], command)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,96 +1,576 @@
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, Connection
 
+try:
+    import resource
+except ImportError:
+    # windows has no resource module, the peak memory isn't reported there
+    resource = None
 
-def change_payment_type(payment_type: str) -> str:
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+from order_repository import ORDER_STATUS_QUERY, ORDER_PRODUCT_TYPE_QUERY, REFUND_POLICY_QUERY, CUSTOMER_ORDERS_QUERY
+from policy_index import build_policy_index
+
+with open('config.json') as f:
+    config = json.loads(f.read())
+
+
+# the explicit schema of the database, the indexes cover the order_id and customer_id lookups of the chatbot
+SCHEMA = {
+    'orders': {
+        'columns': [
+            ('order_id', 'TEXT NOT NULL'),
+            ('customer_id', 'TEXT NOT NULL'),
+            ('order_status', 'TEXT'),
+            ('order_purchase_timestamp', 'TEXT'),
+            ('order_approved_at', 'TEXT'),
+            ('order_delivered_carrier_date', 'TEXT'),
+            ('order_delivered_customer_date', 'TEXT'),
+            ('order_estimated_delivery_date', 'TEXT'),
+            ('payment_sequential', 'INTEGER NOT NULL'),
+            ('payment_type', 'TEXT'),
+            ('payment_value', 'REAL'),
+        ],
+        'primary_key': ('order_id', 'payment_sequential'),
+        'watermark': 'order_purchase_timestamp',
+        'indexes': {
+            'ix_orders_order_id_customer_id': ('order_id', 'customer_id'),
+            'ix_orders_customer_id': ('customer_id', 'order_purchase_timestamp'),
+        }
+    },
+    'order_items': {
+        'columns': [
+            ('order_id', 'TEXT NOT NULL'),
+            ('order_item_id', 'INTEGER NOT NULL'),
+            ('shipping_limit_date', 'TEXT'),
+            ('price', 'REAL'),
+            ('freight_value', 'REAL'),
+            ('product_category_name', 'TEXT'),
+        ],
+        'primary_key': ('order_id', 'order_item_id'),
+        'watermark': 'shipping_limit_date',
+        'indexes': {}
+    }
+}
+
+# the bookkeeping of the incremental sync, these tables aren't in tables_names so the chatbot never sees them
+SYNC_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS sync_hashes (\n\t'
+    'table_name TEXT NOT NULL,\n\trow_key TEXT NOT NULL,\n\trow_hash INTEGER NOT NULL,\n\t'
+    'PRIMARY KEY (table_name, row_key)\n) WITHOUT ROWID;',
+    'CREATE TABLE IF NOT EXISTS sync_state (\n\t'
+    'table_name TEXT PRIMARY KEY,\n\twatermark TEXT,\n\trows_upserted INTEGER,\n\t'
+    'rows_deleted INTEGER,\n\tsynced_at TEXT\n);',
+]
+
+RAW_DATA = 'dummy_data/raw_data/'
+CLEAN_DATA = 'dummy_data/clean_data/'
+
+# the simplified payment types, the ones not in here are refunded in cash
+PAYMENT_TYPES = {'credit_card': 'credit_card', 'debit_card': 'debit_card', 'voucher': 'check'}
+PAYMENT_TYPE_DTYPE = pd.CategoricalDtype(['credit_card', 'debit_card', 'check', 'cash'])
+
+# the queries the chatbot runs, used to verify they are answered from an index
+LOOKUP_QUERIES = {
+    'get_order_status': ORDER_STATUS_QUERY,
+    'get_order_product_type': ORDER_PRODUCT_TYPE_QUERY,
+    'get_refund_policy': REFUND_POLICY_QUERY,
+    'get_customer_orders': CUSTOMER_ORDERS_QUERY,
+}
+
+
+def get_payment_types(payment_types: pd.Series) -> pd.Series:
     """
     the payment_type in the csv file had many different option so i simplified it for testing
-    :param payment_type: the payment_type string to be converted
-    :return: the simplified payment_type string
+    cards stay the same, vouchers become check and everything else cash
+    :param payment_types: the payment_type column to be converted
+    :return: the simplified payment_type column
     """
-
-    if payment_type == 'credit_card' or payment_type == 'debit_card':
-        return payment_type
-    if payment_type == 'voucher':
-        return 'check'
-    return 'cash'
+    return payment_types.astype(object).map(PAYMENT_TYPES).fillna('cash').astype(PAYMENT_TYPE_DTYPE)
 
 
-def get_product_df() -> pd.DataFrame:
+def get_product_categories() -> pd.Series:
     """
     this will read the csv files for the products and their english translation
-    and create a simplified dataframe
-    :return: the product data frame with the columns product_id and product_category_name
+    :return: the english product_category_name of every product_id
+    """
+    products_df = pd.read_csv(RAW_DATA + 'olist_products_dataset.csv',
+                              usecols=['product_id', 'product_category_name'],
+                              dtype={'product_category_name': 'category'})
+    translation_df = pd.read_csv(RAW_DATA + 'product_category_name_translation.csv')
+
+    translation = translation_df.set_index('product_category_name')['product_category_name_english']
+    categories = products_df['product_category_name'].map(translation).astype('category')
+    return pd.Series(categories.values, index=products_df['product_id'], name='product_category_name')
+
+
+def get_payments_df() -> pd.DataFrame:
+    """
+    will read the order_payments csv file in chunks and simplify the payment types
+    :return: the payments data frame indexed by order_id
+    """
+    chunks = []
+    for chunk in pd.read_csv(RAW_DATA + 'olist_order_payments_dataset.csv',
+                             usecols=['order_id', 'payment_sequential', 'payment_type', 'payment_value'],
+                             chunksize=config['database']['load_chunk_size']):
+        chunk['payment_type'] = get_payment_types(chunk['payment_type'])
+        chunks.append(chunk)
+    return pd.concat(chunks, ignore_index=True).set_index('order_id')
+
+
+def get_orders_chunks() -> Iterator[pd.DataFrame]:
+    """
+    will read the orders csv file in chunks and join every chunk with its payments
+    :return: the chunks of the simplified orders table
+    """
+    columns = [column for column, _ in SCHEMA['orders']['columns']]
+    payments_df = get_payments_df()
+
+    for chunk in pd.read_csv(RAW_DATA + 'olist_orders_dataset.csv', dtype={'order_status': 'category'},
+                             chunksize=config['database']['load_chunk_size']):
+        chunk = chunk.join(payments_df, on='order_id')
+
+        # an order without a payment still needs a value for the primary key and is refunded in cash
+        chunk['payment_sequential'] = chunk['payment_sequential'].fillna(1).astype(int)
+        chunk['payment_type'] = chunk['payment_type'].fillna('cash')
+        yield chunk[columns]
+
+
+def get_order_items_chunks() -> Iterator[pd.DataFrame]:
+    """
+    will read the order_items csv file in chunks and replace the product id with the product category
+    :return: the chunks of the simplified order_items table
+    """
+    columns = [column for column, _ in SCHEMA['order_items']['columns']]
+    product_categories = get_product_categories()
+
+    for chunk in pd.read_csv(RAW_DATA + 'olist_order_items_dataset.csv',
+                             usecols=['order_id', 'order_item_id', 'product_id', 'shipping_limit_date',
+                                      'price', 'freight_value'],
+                             chunksize=config['database']['load_chunk_size']):
+        yield chunk.join(product_categories, on='product_id')[columns]
+
+
+def get_table_chunks(name: str, from_parquet: bool) -> Iterator[pd.DataFrame]:
+    """
+    :param name: the name of the table
+    :param from_parquet: if the chunks are read from the parquet files of an earlier run instead of the raw data
+    :return: the chunks of the clean table
+    """
+    if from_parquet:
+        return get_parquet_chunks(name)
+    if name == 'orders':
+        return get_orders_chunks()
+    return get_order_items_chunks()
+
+
+def get_parquet_chunks(name: str) -> Iterator[pd.DataFrame]:
     """
+    will read the clean parquet file of a table an earlier run wrote in chunks
+    :param name: the name of the table
+    :return: the chunks of the table
+    """
+    parquet_file = pq.ParquetFile(CLEAN_DATA + name + '.parquet')
+    for batch in parquet_file.iter_batches(batch_size=config['database']['load_chunk_size']):
+        yield batch.to_pandas()
+
+
+def get_parquet_schema(name: str) -> 'pa.Schema':
+    """
+    the parquet schema comes from the sql schema, so the chunks of a table all have the same types
+    even when a chunk has only missing values in a column or different categories
+    :param name: the name of the table
+    :return: the parquet schema of the table
+    """
+    types = {'TEXT': pa.string(), 'INTEGER': pa.int64(), 'REAL': pa.float64()}
+    return pa.schema([(column, types[column_type.split()[0]]) for column, column_type in SCHEMA[name]['columns']])
+
 
-    products_df = pd.read_csv('dummy_data/raw_data/olist_products_dataset.csv')
-    translation_df = pd.read_csv('dummy_data/raw_data/product_category_name_translation.csv')
+class CleanDataWriter:
+    def __init__(self, name: str, csv: bool, parquet: bool) -> None:
+        """
+        writes the chunks of a clean table to its csv file, the tests sample their orders from it,
+        and to its parquet file when asked to
+        :param name: the name of the table
+        :param csv: if the clean csv file is written
+        :param parquet: if the clean parquet file is written
+        """
+        os.makedirs(CLEAN_DATA, exist_ok=True)
+        self.csv_path = CLEAN_DATA + name + '.csv' if csv else None
+        self.parquet_writer = pq.ParquetWriter(CLEAN_DATA + name + '.parquet', get_parquet_schema(name)) \
+            if parquet else None
+        self.header = True
 
-    products_df = products_df.join(translation_df.set_index('product_category_name'), on='product_category_name')
-    products_df['product_category_name'] = products_df['product_category_name_english']
-    products_df = products_df[['product_id', 'product_category_name']]
-    return products_df
+    def write(self, chunk: pd.DataFrame) -> None:
+        if self.csv_path:
+            chunk.to_csv(self.csv_path, mode='w' if self.header else 'a', header=self.header, index=False)
+            self.header = False
 
+        if self.parquet_writer is not None:
+            self.parquet_writer.write_table(
+                pa.Table.from_pandas(chunk, schema=self.parquet_writer.schema, preserve_index=False))
 
-def get_orders_df() -> pd.DataFrame:
+    def close(self) -> None:
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+
+
+def get_create_table_statements(name: str) -> List[str]:
     """
-    will read in the orders csv file and join it with the order_payments csv file
-    :return: the simplified orders data frame
+    will build the create table and create index statements of a table in the schema
+    :param name: the name of the table
+    :return: the list of statements
     """
-    orders_df = pd.read_csv('dummy_data/raw_data/olist_orders_dataset.csv')
-    orders_payment_df = pd.read_csv('dummy_data/raw_data/olist_order_payments_dataset.csv')
+    table = SCHEMA[name]
+    columns = [f'{column} {column_type}' for column, column_type in table['columns']]
+    columns.append(f'PRIMARY KEY ({", ".join(table["primary_key"])})')
 
-    orders_payment_df = orders_payment_df[['order_id', 'payment_type', 'payment_value']]
+    statements = [f'CREATE TABLE {name} (\n\t' + ',\n\t'.join(columns) + '\n);']
+    for index_name, index_columns in table['indexes'].items():
+        statements.append(f'CREATE INDEX IF NOT EXISTS {index_name} ON {name} ({", ".join(index_columns)});')
+    return statements
 
-    orders_df = orders_df.join(orders_payment_df.set_index('order_id'), on='order_id')
 
-    orders_df['payment_type'] = orders_df['payment_type'].apply(lambda n: change_payment_type(n))
-    return orders_df
+def set_pragmas(conn: Connection) -> None:
+    """
+    will set the pragmas from the config file, page_size goes first since it only applies before the first write
+    :param conn: the connection to set them on
+    :return: none
+    """
+    for pragma, value in config['database']['pragmas'].items():
+        conn.exec_driver_sql(f'PRAGMA {pragma}={value};')
 
 
-def get_order_items_df() -> pd.DataFrame:
+def get_insert_statement(name: str, upsert: bool = False) -> str:
     """
-    will read in the order_item csv file and replace the product id with the product category
-    :return: the simplified order_items data frame
+    :param name: the name of the table
+    :param upsert: if a row with the same primary key is updated instead of failing the insert
+    :return: the insert statement of the table with ? placeholders
     """
-    order_items_df = pd.read_csv('dummy_data/raw_data/olist_order_items_dataset.csv')
-    order_items_df = order_items_df.join(get_product_df().set_index('product_id'), on='product_id')
-    order_items_df = order_items_df.drop(['product_id', 'seller_id'], axis=1)
-    return order_items_df
+    table = SCHEMA[name]
+    columns = [column for column, _ in table['columns']]
+    insert = (f'INSERT INTO {name} ({", ".join(columns)}) '
+              f'VALUES ({", ".join("?" * len(columns))})')
+    if upsert:
+        updates = [f'{column} = excluded.{column}' for column in columns if column not in table['primary_key']]
+        insert += f' ON CONFLICT ({", ".join(table["primary_key"])}) DO UPDATE SET {", ".join(updates)}'
+    return insert + ';'
 
 
-def get_clean_csvs() -> None:
-    orders_df = get_orders_df()
-    orders_df.name = 'orders'
-    orders_df.to_csv('dummy_data/clean_data/orders.csv', index=False)
+def load_chunk(conn: Connection, name: str, chunk: pd.DataFrame, upsert: bool = False) -> int:
+    """
+    will bulk insert a chunk into its table
+    :param conn: the connection with the open transaction
+    :param name: the name of the table
+    :param chunk: the rows to insert
+    :param upsert: if the rows replace the rows with the same primary key
+    :return: the number of rows loaded
+    """
+    columns = [column for column, _ in SCHEMA[name]['columns']]
 
-    order_items_df = get_order_items_df()
-    order_items_df.name = 'order_items'
-    order_items_df.to_csv('dummy_data/clean_data/order_items.csv', index=False)
+    # sqlite wants None instead of NaN for missing values
+    chunk = chunk[columns].astype(object).where(chunk[columns].notna(), None)
+    conn.exec_driver_sql(get_insert_statement(name, upsert), list(chunk.itertuples(index=False, name=None)))
+    return len(chunk)
 
 
-def make_db():
-    engine = create_engine('sqlite:///dummy_database.db', echo=True)
-    orders_df = pd.read_csv('dummy_data/clean_data/orders.csv')
-    orders_df.name = 'orders'
+def get_row_hashes(name: str, chunk: pd.DataFrame) -> pd.Series:
+    """
+    will hash the content of every row, the values are hashed as text
+    so a chunk read from csv or parquet hashes the same, a missing value is nan in a chunk read from csv
+    and None in one read from parquet, so both are hashed as an empty string
+    :param name: the name of the table
+    :param chunk: the rows to hash
+    :return: the hash of every row indexed by its primary key joined with |
+    """
+    table = SCHEMA[name]
+    columns = [column for column, _ in table['columns']]
+
+    keys = chunk[table['primary_key'][0]].astype(str)
+    for column in table['primary_key'][1:]:
+        keys = keys + '|' + chunk[column].astype(str)
+
+    # sqlite integers are signed, so the unsigned hashes are stored as their signed 64 bit value
+    values = chunk[columns].astype(object)
+    values = values.where(values.notna(), '').astype(str)
+    hashes = pd.util.hash_pandas_object(values, index=False).to_numpy().view('int64')
+    return pd.Series(hashes, index=keys.to_numpy(), dtype=object)
 
-    orders_df.to_sql(
-        name=orders_df.name,
-        con=engine,
-        if_exists='replace',
-        index=False
+
+def save_row_hashes(conn: Connection, name: str, hashes: pd.Series) -> None:
+    """
+    :param conn: the connection with the open transaction
+    :param name: the name of the table
+    :param hashes: the hashes of the rows that were loaded
+    :return: none
+    """
+    conn.exec_driver_sql(
+        'INSERT INTO sync_hashes (table_name, row_key, row_hash) VALUES (?, ?, ?) '
+        'ON CONFLICT (table_name, row_key) DO UPDATE SET row_hash = excluded.row_hash;',
+        [(name, key, int(row_hash)) for key, row_hash in hashes.items()]
     )
 
-    orders_items_df = pd.read_csv('dummy_data/clean_data/order_items.csv')
-    orders_items_df.name = 'order_items'
 
-    orders_items_df.to_sql(
-        name=orders_items_df.name,
-        con=engine,
-        if_exists='replace',
-        index=False
+def get_watermark(name: str, chunk: pd.DataFrame, watermark: Optional[str]) -> Optional[str]:
+    """
+    :param name: the name of the table
+    :param chunk: the rows that were read
+    :param watermark: the watermark of the chunks before
+    :return: the newest timestamp of the watermark column so far
+    """
+    newest = chunk[SCHEMA[name]['watermark']].dropna().astype(str).max()
+    if isinstance(newest, str) and (watermark is None or newest > watermark):
+        return newest
+    return watermark
+
+
+def record_sync(conn: Connection, name: str, watermark: Optional[str], rows_upserted: int,
+                rows_deleted: int) -> None:
+    """
+    will record the watermark and counts of the last load or sync of a table in sync_state
+    :param conn: the connection with the open transaction
+    :param name: the name of the table
+    :param watermark: the newest timestamp of the watermark column
+    :param rows_upserted: the rows that were new or changed
+    :param rows_deleted: the rows that were deleted
+    :return: none
+    """
+    conn.exec_driver_sql(
+        'INSERT INTO sync_state (table_name, watermark, rows_upserted, rows_deleted, synced_at) '
+        "VALUES (?, ?, ?, ?, datetime('now')) "
+        'ON CONFLICT (table_name) DO UPDATE SET watermark = excluded.watermark, '
+        'rows_upserted = excluded.rows_upserted, rows_deleted = excluded.rows_deleted, '
+        'synced_at = excluded.synced_at;',
+        (name, watermark, rows_upserted, rows_deleted)
     )
 
 
-get_clean_csvs()
-make_db()
+def sync_table(conn: Connection, name: str, chunks: Iterator[pd.DataFrame], prune: bool) -> Tuple[int, int]:
+    """
+    will upsert only the rows that are new or whose content hash changed since the last load or sync
+    :param conn: the connection with the open transaction
+    :param name: the name of the table
+    :param chunks: the chunks of the clean table
+    :param prune: if the rows that are no longer in the chunks are deleted
+    :return: the number of rows upserted and deleted
+    """
+    existing = dict(conn.exec_driver_sql(
+        'SELECT row_key, row_hash FROM sync_hashes WHERE table_name = ?;', (name,)).all())
+    known_hashes = pd.Series(existing, dtype=object)
+
+    rows_upserted = 0
+    watermark = None
+    seen = set()
+    for chunk in chunks:
+        hashes = get_row_hashes(name, chunk)
+        changed = hashes.ne(known_hashes.reindex(hashes.index)).to_numpy()
+        if changed.any():
+            rows_upserted += load_chunk(conn, name, chunk[changed], upsert=True)
+            save_row_hashes(conn, name, hashes[changed])
+        watermark = get_watermark(name, chunk, watermark)
+        if prune:
+            seen.update(hashes.index)
+
+    deleted = [key for key in existing if key not in seen] if prune else []
+    if deleted:
+        primary_key = SCHEMA[name]['primary_key']
+        conn.exec_driver_sql(
+            f'DELETE FROM {name} WHERE ' + ' AND '.join(f'{column} = ?' for column in primary_key) + ';',
+            [tuple(key.split('|')) for key in deleted]
+        )
+        conn.exec_driver_sql('DELETE FROM sync_hashes WHERE table_name = ? AND row_key = ?;',
+                             [(name, key) for key in deleted])
+
+    record_sync(conn, name, watermark, rows_upserted, len(deleted))
+    return rows_upserted, len(deleted)
+
+
+def verify_query_plans(conn: Connection) -> Dict[str, bool]:
+    """
+    will print the query plan of every lookup the chatbot runs to check it uses an index and not a full scan
+    :param conn: the connection to the database
+    :return: a dictionary of query name and if the query uses an index
+    """
+    uses_index = {}
+    for name, query in LOOKUP_QUERIES.items():
+        plan = conn.exec_driver_sql(
+            'EXPLAIN QUERY PLAN ' + str(query),
+            {'order_id': '', 'customer_id': '', 'limit': 1, 'offset': 0}
+        ).all()
+        details = [row[-1] for row in plan]
+
+        # a SCAN without an index means sqlite reads the whole table
+        uses_index[name] = all('USING' in detail for detail in details if detail.startswith(('SCAN', 'SEARCH')))
+        print(f'{name}: {"uses index" if uses_index[name] else "FULL SCAN"}')
+        for detail in details:
+            print(f'\t{detail}')
+    return uses_index
+
+
+def get_peak_rss_mb() -> Optional[float]:
+    """
+    :return: the peak resident memory of the process in megabytes, None where it can't be read
+    """
+    if resource is None:
+        return None
+
+    # linux reports kilobytes and macos bytes
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / 1024 / 1024 if sys.platform == 'darwin' else peak_rss / 1024
+
+
+def make_db(csv: bool = True, parquet: bool = False, from_parquet: bool = False) -> None:
+    """
+    will create the database with the explicit schema and stream the clean tables into it in one transaction,
+    the raw csv files are read in chunks and every chunk is cleaned and inserted without a clean csv round trip
+    it prints the load time, the peak memory and the query plans of the chatbot lookups
+    :param csv: if the clean csv files are written next to the database
+    :param parquet: if the clean tables are also written as parquet files
+    :param from_parquet: if the database is loaded from the parquet files of an earlier run instead of the raw data
+    :return: none
+    """
+    if (parquet or from_parquet) and pq is None:
+        raise ImportError('the parquet options need pyarrow, install it with pip install pyarrow')
+
+    start = time.perf_counter()
+
+    # autocommit lets the pragmas run outside a transaction and the load run in one explicit transaction
+    engine = create_engine(config['database']['name'], isolation_level='AUTOCOMMIT')
+    with engine.connect() as conn:
+        set_pragmas(conn)
+
+        conn.exec_driver_sql('BEGIN;')
+        try:
+            for statement in SYNC_SCHEMA:
+                conn.exec_driver_sql(statement)
+
+            for name in SCHEMA:
+                conn.exec_driver_sql(f'DROP TABLE IF EXISTS {name};')
+                for statement in get_create_table_statements(name):
+                    conn.exec_driver_sql(statement)
+                conn.exec_driver_sql('DELETE FROM sync_hashes WHERE table_name = ?;', (name,))
+
+                # the hashes are saved with the full load, so the first sync after it only upserts what changed
+                table_start = time.perf_counter()
+                writer = CleanDataWriter(name, csv and not from_parquet, parquet and not from_parquet)
+                rows_loaded = 0
+                watermark = None
+                try:
+                    for chunk in get_table_chunks(name, from_parquet):
+                        rows_loaded += load_chunk(conn, name, chunk)
+                        save_row_hashes(conn, name, get_row_hashes(name, chunk))
+                        watermark = get_watermark(name, chunk, watermark)
+                        writer.write(chunk)
+                finally:
+                    writer.close()
+                record_sync(conn, name, watermark, rows_loaded, 0)
+                print(f'loaded {rows_loaded} rows into {name} in {time.perf_counter() - table_start:.2f}s')
+            conn.exec_driver_sql('COMMIT;')
+        except Exception:
+            conn.exec_driver_sql('ROLLBACK;')
+            raise
+
+        conn.exec_driver_sql('ANALYZE;')
+        page_size = conn.exec_driver_sql('PRAGMA page_size;').scalar()
+        journal_mode = conn.exec_driver_sql('PRAGMA journal_mode;').scalar()
+        print(f'load time: {time.perf_counter() - start:.2f}s (page_size={page_size}, journal_mode={journal_mode})')
+
+        peak_rss = get_peak_rss_mb()
+        if peak_rss is not None:
+            print(f'peak rss: {peak_rss:.1f} MB')
+
+        verify_query_plans(conn)
+
+    save_policy_index()
+
+
+def save_policy_index() -> None:
+    """
+    will build the return policy index from the product categories and the policy in the config file
+    and save it for the check_return_policy tool
+    :return: none
+    """
+    start = time.perf_counter()
+    index = build_policy_index()
+    print(f'saved the return policy index of {len(index.documents)} documents to '
+          f'{config["return_policy_index"]["path"]} in {time.perf_counter() - start:.2f}s')
+
+
+def sync_db(from_parquet: bool = False, prune: bool = False) -> None:
+    """
+    will refresh the database in place, only the new and changed rows are written,
+    the sync runs in one write transaction and with WAL the chatbot keeps reading the old rows until it commits
+    a database without the tables gets the tables made first and every row is new
+    :param from_parquet: if the rows come from the parquet files of an earlier run instead of the raw data
+    :param prune: if the rows that are no longer in the data are deleted, leave it off to sync a partial export
+    :return: none
+    """
+    if from_parquet and pq is None:
+        raise ImportError('the parquet options need pyarrow, install it with pip install pyarrow')
+
+    start = time.perf_counter()
+    engine = create_engine(config['database']['name'], isolation_level='AUTOCOMMIT')
+    with engine.connect() as conn:
+        set_pragmas(conn)
+
+        # immediate takes the write lock up front, readers aren't blocked by it in WAL mode
+        conn.exec_driver_sql('BEGIN IMMEDIATE;')
+        try:
+            for statement in SYNC_SCHEMA:
+                conn.exec_driver_sql(statement)
+
+            for name in SCHEMA:
+                exists = conn.exec_driver_sql(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?;", (name,)).scalar()
+                # the indexes are made if not exists, so a sync adds the indexes added to the schema since the load
+                statements = get_create_table_statements(name)
+                for statement in statements if not exists else statements[1:]:
+                    conn.exec_driver_sql(statement)
+
+                table_start = time.perf_counter()
+                rows_upserted, rows_deleted = sync_table(conn, name, get_table_chunks(name, from_parquet), prune)
+                print(f'synced {name} in {time.perf_counter() - table_start:.2f}s: '
+                      f'{rows_upserted} rows upserted, {rows_deleted} rows deleted')
+            conn.exec_driver_sql('COMMIT;')
+        except Exception:
+            conn.exec_driver_sql('ROLLBACK;')
+            raise
+
+        conn.exec_driver_sql('ANALYZE;')
+        for name, watermark in conn.exec_driver_sql('SELECT table_name, watermark FROM sync_state;').all():
+            print(f'{name} watermark: {watermark}')
+        print(f'sync time: {time.perf_counter() - start:.2f}s')
+
+        verify_query_plans(conn)
+
+    save_policy_index()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='builds the database from the raw olist csv files')
+    parser.add_argument('--no-csv', action='store_true',
+                        help="don't write the clean csv files the tests sample their orders from")
+    parser.add_argument('--parquet', action='store_true',
+                        help='also write the clean tables as parquet files')
+    parser.add_argument('--from-parquet', action='store_true',
+                        help='load the database from the parquet files of an earlier run instead of the raw data')
+    parser.add_argument('--sync', action='store_true',
+                        help='only write the new and changed rows into the existing database')
+    parser.add_argument('--prune', action='store_true',
+                        help='with --sync also delete the rows that are no longer in the data')
+    args = parser.parse_args()
+
+    if args.sync:
+        sync_db(from_parquet=args.from_parquet, prune=args.prune)
+    else:
+        make_db(csv=not args.no_csv, parquet=args.parquet, from_parquet=args.from_parquet)
@@ -0,0 +1,33 @@
+import io
+import unittest
+import pandas as pd
+import setup_db
+
+CLEAN_ORDER_ITEMS = (
+    'order_id,order_item_id,shipping_limit_date,price,freight_value,product_category_name\n'
+    'order-1,1,2017-09-19 09:45:35,58.9,13.29,cool_stuff\n'
+    'order-1,2,,,13.29,\n'
+    'order-2,1,2017-05-03 11:05:13,239.9,,\n'
+)
+
+
+@unittest.skipIf(setup_db.pa is None, 'pyarrow is not installed')
+class RowHashesTest(unittest.TestCase):
+    def test_csv_and_parquet_hash_the_same(self) -> None:
+        """
+        a chunk read from the clean csv file and the same chunk read from its parquet file hash the same,
+        with the missing values of both, so a sync from parquet doesn't upsert every row with one
+        :return: none
+        """
+        csv_chunk = pd.read_csv(io.StringIO(CLEAN_ORDER_ITEMS))
+        table = setup_db.pa.Table.from_pandas(csv_chunk, schema=setup_db.get_parquet_schema('order_items'),
+                                              preserve_index=False)
+        parquet_chunk = table.to_pandas()
+        self.assertIsNone(parquet_chunk['product_category_name'][1])
+
+        pd.testing.assert_series_equal(setup_db.get_row_hashes('order_items', csv_chunk),
+                                       setup_db.get_row_hashes('order_items', parquet_chunk))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,16 +2,46 @@ async function sendMessage()
 {
     const message = document.getElementById('message').value;
     const response = await fetch(
-        '/chat',
+        '/chat/stream',
         {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ message })
+            credentials: 'same-origin',
+            body: JSON.stringify({ message, session_id: sessionStorage.getItem('session_id') })
         }
     );
 
-    const data = await response.json();
     document.getElementById('chat').innerHTML += `<p><strong>You:</strong> ${message}</p>`;
-    document.getElementById('chat').innerHTML += `<p><strong>Bot:</strong> ${data.response}</p>`;
+    document.getElementById('chat').innerHTML += `<p><strong>Bot:</strong> <span></span></p>`;
     document.getElementById('message').value = '';
-        }
\ No newline at end of file
+    const botResponse = document.getElementById('chat').lastElementChild.querySelector('span');
+
+    // an error page or a json error isn't a stream of events, the user is told the message failed
+    const contentType = response.headers.get('Content-Type') || '';
+    if (!response.ok || !contentType.startsWith('text/event-stream'))
+    {
+        botResponse.textContent = `Sorry, something went wrong (${response.status}), please try again.`;
+        return;
+    }
+
+    // the response is a stream of server-sent events, every event is one line of json after "data: "
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = '';
+    while (true)
+    {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        buffer += value;
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        for (const event of events)
+        {
+            const data = JSON.parse(event.replace(/^data: /, ''));
+            if (data.delta) botResponse.textContent += data.delta;
+            // the server also sets a cookie, keeping the id here lets the tab continue its session without cookies
+            if (data.done || data.error) sessionStorage.setItem('session_id', data.session_id);
+            if (data.error) botResponse.textContent += data.error;
+        }
+    }
+        }
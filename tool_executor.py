@@ -0,0 +1,140 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Callable, Dict, List, Optional
+from openai.types.chat import ChatCompletionMessageToolCall
+
+with open('config.json') as f:
+    config = json.loads(f.read())
+
+logger = logging.getLogger(__name__)
+
+HandleToolCall = Callable[[ChatCompletionMessageToolCall], Dict[str, str]]
+
+_executor: Optional['ToolExecutor'] = None
+_lock = threading.Lock()
+
+
+class ToolExecutor:
+    def __init__(self, max_workers: int, timeout: float, timeouts: Dict[str, float]) -> None:
+        """
+        runs the tool calls of one assistant message at the same time on a shared thread pool
+        :param max_workers: the most tool calls running at once in the process
+        :param timeout: the seconds a tool call can take before the chatbot is told it timed out
+        :param timeouts: the timeout of specific functions by function name
+        """
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tool')
+        self.timeout = timeout
+        self.timeouts = timeouts
+
+    def get_timeout(self, tool_call: ChatCompletionMessageToolCall) -> float:
+        return self.timeouts.get(tool_call.function.name, self.timeout)
+
+    @staticmethod
+    def get_timeout_message(tool_call: ChatCompletionMessageToolCall) -> Dict[str, str]:
+        """
+        the tool message for a tool call that didn't finish in time, so every tool_call_id still gets an answer
+        :param tool_call: the tool call that timed out
+        :return: the tool message
+        """
+        return {
+            'tool_call_id': tool_call.id,
+            'role': 'tool',
+            'name': tool_call.function.name,
+            'content': 'the function timed out, please try again later',
+        }
+
+    @staticmethod
+    def get_error_message(tool_call: ChatCompletionMessageToolCall) -> Dict[str, str]:
+        """
+        the tool message for a tool call that raised, a failed tool is answered like a slow one
+        so the assistant message with the tool calls is never left without its tool messages
+        :param tool_call: the tool call that raised
+        :return: the tool message
+        """
+        logger.exception('the tool call %s of %s failed', tool_call.id, tool_call.function.name)
+        return {
+            'tool_call_id': tool_call.id,
+            'role': 'tool',
+            'name': tool_call.function.name,
+            'content': 'the function failed, please try again later',
+        }
+
+    def run(self, handle_tool_call: HandleToolCall,
+            tool_calls: List[ChatCompletionMessageToolCall]) -> List[Dict[str, str]]:
+        """
+        will run all the tool calls concurrently and wait for them
+        :param handle_tool_call: the function that runs one tool call and returns its tool message
+        :param tool_calls: the tool calls of the assistant message
+        :return: the tool messages in the same order as the tool calls
+        """
+        start = time.monotonic()
+        futures = [self.pool.submit(handle_tool_call, tool_call) for tool_call in tool_calls]
+
+        responses = []
+        for tool_call, future in zip(tool_calls, futures):
+            try:
+                # the tool calls started together, so each timeout counts from the start
+                responses.append(future.result(timeout=max(0.0, start + self.get_timeout(tool_call) - time.monotonic())))
+            except TimeoutError:
+                future.cancel()
+                responses.append(self.get_timeout_message(tool_call))
+            except Exception:
+                responses.append(self.get_error_message(tool_call))
+        return responses
+
+    async def run_async(self, handle_tool_call: HandleToolCall,
+                        tool_calls: List[ChatCompletionMessageToolCall]) -> List[Dict[str, str]]:
+        """
+        the async version of run, the tool calls run on the same thread pool so they don't block the event loop
+        :param handle_tool_call: the function that runs one tool call and returns its tool message
+        :param tool_calls: the tool calls of the assistant message
+        :return: the tool messages in the same order as the tool calls
+        """
+        loop = asyncio.get_running_loop()
+
+        async def run_tool_call(tool_call: ChatCompletionMessageToolCall) -> Dict[str, str]:
+            try:
+                return await asyncio.wait_for(
+                    loop.run_in_executor(self.pool, handle_tool_call, tool_call),
+                    timeout=self.get_timeout(tool_call)
+                )
+            except asyncio.TimeoutError:
+                return self.get_timeout_message(tool_call)
+            except Exception:
+                return self.get_error_message(tool_call)
+
+        return list(await asyncio.gather(*map(run_tool_call, tool_calls)))
+
+
+def _reset_after_fork() -> None:
+    # the threads of the pool don't exist in a forked worker
+    global _executor
+    _executor = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_tool_executor() -> ToolExecutor:
+    """
+    will get the tool executor shared by the whole process, built from the tools section of the config file
+    :return: the tool executor
+    """
+    global _executor
+
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                tools_config = config['tools']
+                _executor = ToolExecutor(
+                    tools_config['max_concurrency'],
+                    tools_config['timeout'],
+                    tools_config['timeouts']
+                )
+    return _executor
@@ -0,0 +1,55 @@
+"""
+the tool results are resent to openai with every later completion of the conversation,
+so they are serialized as minimal json instead of prose and the repr of the rows
+"""
+import json
+from typing import Any, Dict, List, Optional, Sequence
+from sqlalchemy import Row
+
+with open('config.json') as f:
+    config = json.loads(f.read())
+
+
+def dumps(value: Any) -> str:
+    """
+    :param value: the value to serialize
+    :return: the value as json without whitespace
+    """
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def get_rows_result(rows: Sequence[Row], max_rows: Optional[int] = None, dedupe: bool = False) -> Dict[str, Any]:
+    """
+    will keep the first max_rows of the rows, the duplicate rows are dropped first when dedupe is set
+    a single column becomes a list of its values and more columns become a list of columns and rows of values
+    :param rows: the rows a query returned
+    :param max_rows: the most rows to keep, defaults to max_rows in the config file
+    :param dedupe: if the repeated rows are join artifacts, like the status of an order repeated for every payment,
+        two payments of the same type and value are two real rows and are kept
+    :return: the result, with the number of dropped rows under truncated when there were too many
+    """
+    max_rows = max_rows or config['tool_results']['max_rows']
+    if not rows:
+        return {'rows': []}
+
+    columns = list(rows[0]._fields)
+    unique_rows = list(dict.fromkeys(tuple(row) for row in rows)) if dedupe else [tuple(row) for row in rows]
+
+    if len(columns) == 1:
+        result: Dict[str, Any] = {columns[0]: [row[0] for row in unique_rows[:max_rows]]}
+    else:
+        result = {'columns': columns, 'rows': [list(row) for row in unique_rows[:max_rows]]}
+
+    if len(unique_rows) > max_rows:
+        result['truncated'] = len(unique_rows) - max_rows
+    return result
+
+
+def serialize_rows(rows: Sequence[Row], max_rows: Optional[int] = None, dedupe: bool = False) -> str:
+    """
+    :param rows: the rows a query returned
+    :param max_rows: the most rows to keep, defaults to max_rows in the config file
+    :param dedupe: if the repeated rows are join artifacts that are dropped
+    :return: the truncated rows as minimal json
+    """
+    return dumps(get_rows_result(rows, max_rows, dedupe))
@@ -0,0 +1,41 @@
+import unittest
+from collections import namedtuple
+from tool_results import get_rows_result, serialize_rows
+
+StatusRow = namedtuple('StatusRow', ['order_status'])
+PaymentRow = namedtuple('PaymentRow', ['payment_type', 'payment_value'])
+
+
+class ToolResultsTest(unittest.TestCase):
+    def test_payments_are_kept(self) -> None:
+        """
+        two payments of the same type and value are two payments, the refund sums all of them
+        :return: none
+        """
+        rows = [PaymentRow('voucher', 10.0), PaymentRow('credit_card', 45.5), PaymentRow('voucher', 10.0)]
+        self.assertEqual(get_rows_result(rows), {
+            'columns': ['payment_type', 'payment_value'],
+            'rows': [['voucher', 10.0], ['credit_card', 45.5], ['voucher', 10.0]],
+        })
+
+    def test_dedupe(self) -> None:
+        """
+        a status the join repeats for every payment is listed once
+        :return: none
+        """
+        rows = [StatusRow('shipped'), StatusRow('shipped'), StatusRow('shipped')]
+        self.assertEqual(serialize_rows(rows, dedupe=True), '{"order_status":["shipped"]}')
+        self.assertEqual(serialize_rows(rows), '{"order_status":["shipped","shipped","shipped"]}')
+
+    def test_truncated(self) -> None:
+        rows = [PaymentRow('voucher', float(value)) for value in range(5)]
+        result = get_rows_result(rows, max_rows=2)
+        self.assertEqual(result['rows'], [['voucher', 0.0], ['voucher', 1.0]])
+        self.assertEqual(result['truncated'], 3)
+
+    def test_no_rows(self) -> None:
+        self.assertEqual(serialize_rows([]), '{"rows":[]}')
+
+
+if __name__ == '__main__':
+    unittest.main()